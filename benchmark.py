@@ -0,0 +1,290 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Local benchmark of the request handlers in main.py.
+
+Drives the WSGI application against the App Engine SDK's in-memory service
+stubs (datastore, memcache, users, task queue), seeded with a configurable
+number of users, purchases and user-built levels. For every handler it
+reports throughput, p50/p95/p99 latency and datastore RPCs per request.
+
+Results can be saved as a JSON baseline and compared against later runs:
+
+  python benchmark.py --users=50 --levels_per_user=200 --save=baseline.json
+  python benchmark.py --users=50 --levels_per_user=200 --compare=baseline.json
+
+Every user repeats every request far faster than rate_limits allows, so
+admission control is off unless --admission_control is given.
+
+The App Engine SDK must be on sys.path (or pass --sdk).
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# standard library imports
+import optparse
+import os
+import sys
+import time
+
+try:
+  import json
+except ImportError:
+  from django.utils import simplejson as json
+
+
+DATASTORE_SERVICE = 'datastore_v3'
+
+
+class DatastoreCallCounter(object):
+  """Counts datastore RPCs by method; Hook is the apiproxy pre-call hook."""
+
+  def __init__(self):
+    self.calls = {}
+
+  def Hook(self, service, call, request, response):
+    # apiproxy only accepts functions and methods as hooks
+    if service == DATASTORE_SERVICE:
+      self.calls[call] = self.calls.get(call, 0) + 1
+
+  def Total(self):
+    return sum(self.calls.values())
+
+  def Reset(self):
+    self.calls.clear()
+
+
+def Percentile(sorted_values, fraction):
+  """Returns the value at fraction (0-1) of an already sorted list."""
+  if not sorted_values:
+    return 0.0
+  index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+  return sorted_values[index]
+
+
+class Environment(object):
+  """Activates the SDK stubs and imports the application.
+
+  With admission_control False, rate_limits lets every request through.
+  """
+
+  def __init__(self, admission_control=False):
+    # Must be set before main is imported so the in-process queue is used
+    os.environ['SERVER_SOFTWARE'] = 'Development/benchmark'
+    # The runtime in app.yaml; testbed would otherwise pick python27's webapp2
+    # and bundled Django instead of webapp and Django 0.96
+    os.environ['APPENGINE_RUNTIME'] = 'python'
+    from google.appengine.api import apiproxy_stub_map
+    from google.appengine.ext import testbed
+
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_datastore_v3_stub()
+    self.testbed.init_memcache_stub()
+    self.testbed.init_user_stub()
+    # queue.yaml names the queues main.py adds tasks to
+    self.testbed.init_taskqueue_stub(
+        root_path=os.path.dirname(os.path.abspath(__file__)))
+    self.counter = DatastoreCallCounter()
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+        'benchmark-counter', self.counter.Hook, DATASTORE_SERVICE)
+
+    import main
+    import rate_limits
+    self.main = main
+    rate_limits.ENABLED = admission_control
+
+  def LogIn(self, email):
+    os.environ['USER_EMAIL'] = email
+    os.environ['USER_ID'] = str(abs(hash(email)))
+    os.environ['FEDERATED_IDENTITY'] = 'https://id.example.com/%s' % email
+    os.environ['FEDERATED_PROVIDER'] = 'id.example.com'
+
+  def Request(self, path, post=None):
+    """Runs one request through the WSGI app and returns the response."""
+    from webob import Request
+    if post is None:
+      request = Request.blank(path)
+    else:
+      request = Request.blank(path, POST=post)
+    return request.get_response(self.main.application)
+
+  def Deactivate(self):
+    self.testbed.deactivate()
+
+
+def Seed(env, num_users, purchases_per_user, levels_per_user, batch_size=500):
+  """Fills the datastore; returns the list of seeded user emails."""
+  from google.appengine.api import users
+  from google.appengine.ext import db
+  from constants import CATALOG
+  from level_codec import EncodeLayout
+  from load_levels import LoadStockLevels
+  from models import Level
+  from models import PurchasedItem
+
+  LoadStockLevels()
+  emails = ['user%d@example.com' % i for i in range(num_users)]
+  pending = []
+
+  def Flush(force=False):
+    if pending and (force or len(pending) >= batch_size):
+      db.put(pending)
+      del pending[:]
+
+  layout = EncodeLayout({7: [4, 5]}, {2: [4]},
+                        {'row': 4, 'column': 23}, {'x': 256, 'y': 320})
+  for email in emails:
+    env.LogIn(email)
+    user = users.get_current_user()
+    identity = user.federated_identity()
+    for index in range(purchases_per_user):
+      # Cycles through the catalog; repeats model duplicate old postbacks
+      item_name, price = CATALOG[index % len(CATALOG)]
+      order_id = '%s-%d' % (email, index)
+      pending.append(PurchasedItem(
+          key_name=PurchasedItem.KeyNameForOrder(order_id),
+          currency_code='USD', federated_identity=identity,
+          item_name=item_name, item_price=price, order_id=order_id))
+      Flush()
+    for index in range(levels_per_user):
+      level_name = 'custom%d' % index
+      pending.append(Level(key_name=Level.KeyNameFor(level_name, user),
+                           owner=user, level=level_name, base_rows=4,
+                           layout=layout))
+      Flush()
+  Flush(force=True)
+  return emails
+
+
+def PostbackJwt(order_id, identity, item_name='Sprite', price='0.50'):
+  """Signs a postback for a purchase by identity, as Google would."""
+  import jwt
+  from sellerinfo import SELLER_ID
+  from sellerinfo import SELLER_SECRET
+  now = int(time.time())
+  payload = {'iss': 'Google', 'aud': SELLER_ID,
+             'typ': 'google/payments/inapp/item/v1/postback/buy',
+             'iat': now, 'exp': now + 3600,
+             'request': {'currencyCode': 'USD',
+                         'sellerData': identity,
+                         'name': item_name, 'price': price},
+             'response': {'orderId': order_id}}
+  return jwt.encode(payload, SELLER_SECRET)
+
+
+def Scenarios(env):
+  """Returns (name, callable(email, iteration)) pairs to benchmark."""
+  valid_build = {'base_rows': '4', 'static_column0': '7',
+                 'static_rows0': '4,5', 'moveable_column0': '2',
+                 'moveable_rows0': '4', 'door_column': '23',
+                 'door_row': '4', 'player_column': '4', 'player_row': '4'}
+
+  def BuildPost(email, iteration):
+    post = dict(valid_build)
+    post['level'] = 'bench%d' % iteration
+    return env.Request('/build-level', post)
+
+  def Postback(email, iteration):
+    order_id = 'bench-%s-%d' % (email, iteration)
+    return env.Request('/postback-verify',
+                       {'jwt': PostbackJwt(order_id,
+                                           os.environ['FEDERATED_IDENTITY'])})
+
+  return [
+      ('MainHandler.get', lambda email, i: env.Request('/')),
+      ('Play.get stock', lambda email, i: env.Request('/play?level=2')),
+      ('Play.get custom',
+       lambda email, i: env.Request('/play?level=custom0')),
+      ('BuildLevel.get', lambda email, i: env.Request('/build-level')),
+      ('BuildLevel.post', BuildPost),
+      ('PostbackVerify.post', Postback),
+      ('Instructions.get', lambda email, i: env.Request('/instructions')),
+  ]
+
+
+def Run(env, emails, iterations):
+  """Runs every scenario, returning {name: statistics}."""
+  results = {}
+  for name, scenario in Scenarios(env):
+    latencies = []
+    env.counter.Reset()
+    start = time.time()
+    for iteration in range(iterations):
+      email = emails[iteration % len(emails)]
+      env.LogIn(email)
+      request_start = time.time()
+      response = scenario(email, iteration)
+      latencies.append(time.time() - request_start)
+      if response.status_int >= 500:
+        raise RuntimeError('%s failed: %s' % (name, response.status))
+    elapsed = time.time() - start
+    latencies.sort()
+    results[name] = {
+        'requests': iterations,
+        'throughput': iterations / max(elapsed, 1e-9),
+        'p50_ms': 1000 * Percentile(latencies, 0.50),
+        'p95_ms': 1000 * Percentile(latencies, 0.95),
+        'p99_ms': 1000 * Percentile(latencies, 0.99),
+        'datastore_calls': float(env.counter.Total()) / iterations,
+        'datastore_by_method': dict(env.counter.calls)}
+  return results
+
+
+def Report(results, baseline=None, out=sys.stdout):
+  """Prints a table of results, with percentage change against baseline."""
+  columns = ('throughput', 'p50_ms', 'p95_ms', 'p99_ms', 'datastore_calls')
+  out.write('%-22s %12s %10s %10s %10s %10s\n'
+            % (('handler',) + columns[:4] + ('ds/req',)))
+  for name in sorted(results):
+    stats = results[name]
+    cells = []
+    for column in columns:
+      cell = '%.1f' % stats[column]
+      if baseline and name in baseline and baseline[name][column]:
+        change = 100.0 * (stats[column] / baseline[name][column] - 1)
+        cell += '(%+d%%)' % change
+      cells.append(cell)
+    out.write('%-22s %12s %10s %10s %10s %10s\n' % tuple([name] + cells))
+
+
+def main(argv):
+  parser = optparse.OptionParser(usage='%prog [options]')
+  parser.add_option('--sdk', help='path to the App Engine SDK')
+  parser.add_option('--users', type='int', default=20)
+  parser.add_option('--purchases_per_user', type='int', default=4)
+  parser.add_option('--levels_per_user', type='int', default=50)
+  parser.add_option('--iterations', type='int', default=200)
+  parser.add_option('--save', help='write results as a JSON baseline')
+  parser.add_option('--compare', help='JSON baseline to compare against')
+  parser.add_option('--admission_control', action='store_true',
+                    default=False, help='apply the rate limits')
+  options, _ = parser.parse_args(argv[1:])
+
+  if options.sdk:
+    sys.path.insert(0, options.sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+
+  env = Environment(admission_control=options.admission_control)
+  try:
+    emails = Seed(env, options.users, options.purchases_per_user,
+                  options.levels_per_user)
+    results = Run(env, emails, options.iterations)
+  finally:
+    env.Deactivate()
+
+  baseline = None
+  if options.compare:
+    baseline = json.load(open(options.compare))['results']
+  Report(results, baseline)
+  if options.save:
+    out = open(options.save, 'w')
+    json.dump({'options': options.__dict__, 'results': results}, out,
+              indent=2, sort_keys=True)
+    out.close()
+
+
+if __name__ == '__main__':
+  main(sys.argv)
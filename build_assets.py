@@ -0,0 +1,162 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Builds the fingerprinted script and stylesheet bundles.
+
+Each bundle is the minified concatenation of its source files, written to
+bundles/ under a name containing a hash of its contents, e.g.
+bundles/game.3f2a9c1d.js. bundles/manifest.json maps bundle names to those
+URLs and is read by rendering.AssetUrl, so templates always point at the
+current bundle and app.yaml can let browsers cache bundles forever.
+
+Run after changing anything in javascripts/ or stylesheets/, before
+deploying:
+
+  python build_assets.py
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# standard library imports
+import glob
+import hashlib
+import os
+import re
+import sys
+
+try:
+  import json
+except ImportError:
+  from django.utils import simplejson as json
+
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+BUNDLE_DIR = os.path.join(ROOT_DIR, 'bundles')
+MANIFEST_FILE = os.path.join(BUNDLE_DIR, 'manifest.json')
+BUNDLE_URL = '/bundles'
+HASH_LENGTH = 8
+
+# Bundle name -> source files, relative to the application root, in order
+BUNDLES = {
+    'game.js': ('javascripts/thirdparty/jquery.hotkeys.js',
+                'javascripts/thirdparty/key_status.js',
+                'javascripts/thirdparty/sprite.js',
+                'javascripts/block.js',
+                'javascripts/player.js'),
+    'screen.css': ('stylesheets/screen.css',),
+}
+
+# Block comments carrying a copyright or license are kept
+_PRESERVED_COMMENT = re.compile(r'copyright|licen[cs]e', re.IGNORECASE)
+
+
+def StripComments(source):
+  """Removes comments from JavaScript or CSS outside of string literals."""
+  result = []
+  index = 0
+  length = len(source)
+  quote = None
+  while index < length:
+    char = source[index]
+    if quote is not None:
+      result.append(char)
+      if char == '\\' and index + 1 < length:
+        result.append(source[index + 1])
+        index += 1
+      elif char == quote or char == '\n':
+        quote = None
+      index += 1
+    elif char in '"\'':
+      quote = char
+      result.append(char)
+      index += 1
+    elif source.startswith('/*', index):
+      end = source.find('*/', index + 2)
+      end = length if end == -1 else end + 2
+      comment = source[index:end]
+      if _PRESERVED_COMMENT.search(comment):
+        result.append(comment)
+      index = end
+    elif source.startswith('//', index):
+      end = source.find('\n', index)
+      index = length if end == -1 else end
+    else:
+      result.append(char)
+      index += 1
+  return ''.join(result)
+
+
+def Minify(source, css=False):
+  """Strips comments, indentation and blank lines.
+
+  Line breaks are kept so JavaScript's automatic semicolon insertion still
+  sees the statements it did before.
+  """
+  if css:
+    # // is not a comment in CSS, and appears in url(http://...)
+    source = source.replace('//', '\0')
+  source = StripComments(source)
+  if css:
+    source = source.replace('\0', '//')
+  lines = [line.strip() for line in source.splitlines()]
+  return '\n'.join(line for line in lines if line) + '\n'
+
+
+def BuildBundle(name, sources, root=ROOT_DIR):
+  """Returns (file name, contents) for one bundle."""
+  css = name.endswith('.css')
+  parts = []
+  for path in sources:
+    source_file = open(os.path.join(root, path))
+    try:
+      parts.append(Minify(source_file.read(), css=css))
+    finally:
+      source_file.close()
+  # A leading semicolon guards against a file missing its final one
+  separator = '\n' if css else ';\n'
+  contents = separator.join(parts)
+  digest = hashlib.md5(contents).hexdigest()[:HASH_LENGTH]
+  base, extension = os.path.splitext(name)
+  return '%s.%s%s' % (base, digest, extension), contents
+
+
+def BuildAll(bundles=BUNDLES, bundle_dir=BUNDLE_DIR):
+  """Writes every bundle and the manifest, removing superseded bundles.
+
+  Returns:
+    The manifest, a dictionary of bundle name to URL.
+  """
+  if not os.path.isdir(bundle_dir):
+    os.makedirs(bundle_dir)
+  manifest = {}
+  for name, sources in sorted(bundles.iteritems()):
+    file_name, contents = BuildBundle(name, sources)
+    out = open(os.path.join(bundle_dir, file_name), 'wb')
+    try:
+      out.write(contents)
+    finally:
+      out.close()
+    manifest[name] = '%s/%s' % (BUNDLE_URL, file_name)
+
+    base, extension = os.path.splitext(name)
+    for stale in glob.glob(os.path.join(bundle_dir, base + '.*' + extension)):
+      if os.path.basename(stale) != file_name:
+        os.remove(stale)
+
+  out = open(os.path.join(bundle_dir, os.path.basename(MANIFEST_FILE)), 'w')
+  try:
+    json.dump(manifest, out, indent=2, sort_keys=True)
+    out.write('\n')
+  finally:
+    out.close()
+  return manifest
+
+
+def main(unused_argv):
+  for name, url in sorted(BuildAll().iteritems()):
+    sys.stdout.write('%s -> %s\n' % (name, url))
+
+
+if __name__ == '__main__':
+  main(sys.argv)
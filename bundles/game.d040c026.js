@@ -0,0 +1,468 @@
+/*
+* jQuery Hotkeys Plugin
+* Copyright 2010, John Resig
+* Dual licensed under the MIT or GPL Version 2 licenses.
+*
+* Based upon the plugin by Tzury Bar Yochay:
+* http://github.com/tzuryby/hotkeys
+*
+* Original idea by:
+* Binny V A, http://www.openjs.com/scripts/events/keyboard_shortcuts/
+*/
+(function(jQuery){
+jQuery.hotkeys = {
+version: "0.8",
+specialKeys: {
+8: "backspace", 9: "tab", 13: "return", 16: "shift", 17: "ctrl", 18: "alt", 19: "pause",
+20: "capslock", 27: "esc", 32: "space", 33: "pageup", 34: "pagedown", 35: "end", 36: "home",
+37: "left", 38: "up", 39: "right", 40: "down", 45: "insert", 46: "del",
+96: "0", 97: "1", 98: "2", 99: "3", 100: "4", 101: "5", 102: "6", 103: "7",
+104: "8", 105: "9", 106: "*", 107: "+", 109: "-", 110: ".", 111 : "/",
+112: "f1", 113: "f2", 114: "f3", 115: "f4", 116: "f5", 117: "f6", 118: "f7", 119: "f8",
+120: "f9", 121: "f10", 122: "f11", 123: "f12", 144: "numlock", 145: "scroll", 191: "/", 224: "meta"
+},
+shiftNums: {
+"`": "~", "1": "!", "2": "@", "3": "#", "4": "$", "5": "%", "6": "^", "7": "&",
+"8": "*", "9": "(", "0": ")", "-": "_", "=": "+", ";": ": ", "'": "\"", ",": "<",
+".": ">",  "/": "?",  "\\": "|"
+}
+};
+function keyHandler( handleObj ) {
+if ( typeof handleObj.data !== "string" ) {
+return;
+}
+var origHandler = handleObj.handler,
+keys = handleObj.data.toLowerCase().split(" ");
+handleObj.handler = function( event ) {
+if ( this !== event.target && (/textarea|select/i.test( event.target.nodeName ) ||
+event.target.type === "text") ) {
+return;
+}
+var special = event.type !== "keypress" && jQuery.hotkeys.specialKeys[ event.which ],
+character = String.fromCharCode( event.which ).toLowerCase(),
+key, modif = "", possible = {};
+if ( event.altKey && special !== "alt" ) {
+modif += "alt+";
+}
+if ( event.ctrlKey && special !== "ctrl" ) {
+modif += "ctrl+";
+}
+if ( event.metaKey && !event.ctrlKey && special !== "meta" ) {
+modif += "meta+";
+}
+if ( event.shiftKey && special !== "shift" ) {
+modif += "shift+";
+}
+if ( special ) {
+possible[ modif + special ] = true;
+} else {
+possible[ modif + character ] = true;
+possible[ modif + jQuery.hotkeys.shiftNums[ character ] ] = true;
+if ( modif === "shift+" ) {
+possible[ jQuery.hotkeys.shiftNums[ character ] ] = true;
+}
+}
+for ( var i = 0, l = keys.length; i < l; i++ ) {
+if ( possible[ keys[i] ] ) {
+return origHandler.apply( this, arguments );
+}
+}
+};
+}
+jQuery.each([ "keydown", "keyup", "keypress" ], function() {
+jQuery.event.special[ this ] = { add: keyHandler };
+});
+})( jQuery );
+;
+$(function() {
+window.keydown = {};
+function keyName(event) {
+return jQuery.hotkeys.specialKeys[event.which] ||
+String.fromCharCode(event.which).toLowerCase();
+}
+$(document).bind("keydown", function(event) {
+keydown[keyName(event)] = true;
+});
+$(document).bind("keyup", function(event) {
+keydown[keyName(event)] = false;
+});
+});
+;
+(function() {
+function LoaderProxy() {
+return {
+draw: $.noop,
+fill: $.noop,
+frame: $.noop,
+update: $.noop,
+width: null,
+height: null
+};
+}
+function Sprite(image, sourceX, sourceY, width, height) {
+sourceX = sourceX || 0;
+sourceY = sourceY || 0;
+width = width || image.width;
+height = height || image.height;
+return {
+draw: function(canvas, x, y) {
+canvas.drawImage(
+image,
+sourceX,
+sourceY,
+width,
+height,
+x,
+y,
+width,
+height
+);
+},
+fill: function(canvas, x, y, width, height, repeat) {
+repeat = repeat || "repeat";
+var pattern = canvas.createPattern(image, repeat);
+canvas.fillColor(pattern);
+canvas.fillRect(x, y, width, height);
+},
+width: width,
+height: height
+};
+};
+Sprite.load = function(url, loadedCallback) {
+var img = new Image();
+var proxy = LoaderProxy();
+img.onload = function() {
+var tile = Sprite(this);
+$.extend(proxy, tile);
+if(loadedCallback) {
+loadedCallback(proxy);
+}
+};
+img.src = url;
+return proxy;
+};
+var spriteImagePath = "images/";
+window.Sprite = function(name, callback) {
+return Sprite.load(spriteImagePath + name + ".png", callback);
+};
+window.Sprite.EMPTY = LoaderProxy();
+window.Sprite.load = Sprite.load;
+}());
+;
+var STATIC_COLORS = ['#3369E8',
+'#D50F25',
+'#009925'];
+function Block(isStatic, row, column, size, canvasHeight) {
+this.soloFreefall = false;
+this.row = row;
+this.column = column;
+this.static = isStatic;
+this.size = size;
+if (this.static) {
+this.color = STATIC_COLORS[(this.row + this.column) % 3];
+} else {
+this.color = '#EEB211';
+}
+this.x = size * this.column;
+this.y = canvasHeight - (this.row + 1) * size;
+}
+Block.prototype.draw = function(canvas) {
+canvas.fillStyle = this.color;
+canvas.fillRect(this.x, this.y, this.size, this.size);
+canvas.strokeStyle = '#000';
+canvas.strokeRect(this.x, this.y, this.size, this.size);
+};
+Block.prototype.fall = function(player, staticBlocks, moveBlocks, constants) {
+if (this.x % this.size != 0) {
+console.log('Block not in a column when fall called');
+return;
+}
+var column = this.x / this.size,
+bottomLocation = constants.canvasHeight - (this.y + this.size),
+destinationRow = Math.floor(
+(bottomLocation - constants.stepSize) / this.size);
+if (destinationRow < constants.baseBlocks) {
+this.y = constants.canvasHeight - this.size -
+constants.baseBlocks * this.size;
+this.soloFreefall = false;
+} else {
+var staticIndex = $.inArray(destinationRow, staticBlocks[column] || []),
+moveIndex = $.inArray(destinationRow, moveBlocks[column] || []);
+if (staticIndex != -1 || moveIndex != -1) {
+this.y = constants.canvasHeight - this.size -
+(destinationRow + 1) * this.size;
+this.soloFreefall = false;
+} else {
+this.y += constants.stepSize;
+}
+}
+if (!this.soloFreefall) {
+delete player.block;
+this.row = destinationRow + 1;
+this.column = column;
+if (column in moveBlocks) {
+moveBlocks[column].push(destinationRow + 1);
+} else {
+moveBlocks[column] = [destinationRow + 1];
+}
+}
+};
+;
+function Player(x, y, sprite) {
+this.x = x;
+this.y = y;
+this.freefall = false;
+this.facing = 'right';
+this.sprite = Sprite(sprite);
+}
+Player.prototype.draw = function(canvas) {
+this.sprite.draw(canvas, this.x, this.y);
+};
+Player.prototype.row_ = function(canvasHeight, size) {
+if ((canvasHeight - (this.y + size)) % size != 0) {
+return -1;
+} else {
+return (canvasHeight - (this.y + size)) / size;
+}
+};
+Player.prototype.nextColumn_ = function(size, stepSize) {
+if (this.facing == 'left') {
+return Math.floor((this.x - stepSize) / size);
+} else if (this.facing == 'right') {
+return Math.ceil((this.x + stepSize) / size);
+} else {
+console.log('Exiting nextColumn. Direction ' +
+this.facing +
+' is not defined.');
+return;
+}
+};
+Player.prototype.step = function(direction, staticBlocks,
+moveBlocks, constants) {
+this.facing = direction;
+var size = constants.entitySize,
+stepSize = constants.stepSize;
+var row = this.row_(constants.canvasHeight, size);
+if (row == -1) {
+return;
+}
+var currColumn = this.nextColumn_(size, 0),
+newColumn = this.nextColumn_(size, stepSize);
+if (currColumn == newColumn) {
+this.x += (direction == 'left') ? -stepSize : stepSize;
+} else {
+var staticIndex = $.inArray(row, staticBlocks[newColumn] || []),
+moveIndex = $.inArray(row, moveBlocks[newColumn] || []),
+aboveStaticIndex = $.inArray(row + 1,
+staticBlocks[newColumn] || []);
+if (staticIndex != -1 || moveIndex != -1 ||
+(typeof this.block != 'undefined' && aboveStaticIndex != -1)) {
+this.x = currColumn * size;
+} else {
+if (row == constants.baseBlocks) {
+this.x += (direction == 'left') ? -stepSize : stepSize;
+} else {
+staticIndex = $.inArray(row - 1, staticBlocks[newColumn] || []);
+moveIndex = $.inArray(row - 1, moveBlocks[newColumn] || []);
+if (staticIndex != -1 || moveIndex != -1) {
+this.x += (direction == 'left') ? -stepSize : stepSize;
+} else {
+this.x = newColumn * size;
+this.freefall = true;
+}
+}
+}
+}
+if (this.x < 0) {
+this.x = 0;
+} else if (this.x + size > constants.canvasWidth) {
+this.x = constants.canvasWidth - size;
+}
+if (typeof this.block != 'undefined') {
+this.block.x = this.x;
+}
+};
+Player.prototype.fall = function(staticBlocks, moveBlocks, constants) {
+var size = constants.entitySize;
+if (this.x % size != 0) {
+console.log('Player not in a column when fall called');
+return;
+}
+var column = this.x / size,
+footLocation = constants.canvasHeight - (this.y + size),
+destinationRow = Math.floor(
+(footLocation - constants.stepSize) / size);
+if (destinationRow < constants.baseBlocks) {
+this.y = constants.canvasHeight - size - constants.baseBlocks * size;
+this.freefall = false;
+} else {
+var staticIndex = $.inArray(destinationRow, staticBlocks[column] || []),
+moveIndex = $.inArray(destinationRow, moveBlocks[column] || []);
+if (staticIndex != -1 || moveIndex != -1) {
+this.y = constants.canvasHeight - size -
+(destinationRow + 1) * size;
+this.freefall = false;
+} else {
+this.y += constants.stepSize;
+}
+}
+if (typeof this.block != 'undefined') {
+this.block.y = this.y - size;
+}
+};
+Player.prototype.canJump_ = function(staticBlocks, moveBlocks,
+size, canvasHeight) {
+var row = this.row_(canvasHeight, size);
+if (row == -1) {
+return [false, -1, -1];
+}
+if (this.x % size != 0) {
+return [false, -1, -1];
+}
+var currColumn = this.x / size,
+blockColumn = currColumn + ((this.facing == 'left') ? -1 : 1);
+var aboveIndex = $.inArray(row + 1, staticBlocks[currColumn] || []);
+if (aboveIndex != -1) {
+return [false, -1, -1];
+}
+var indexMove = $.inArray(row, moveBlocks[blockColumn] || []),
+indexStatic = $.inArray(row, staticBlocks[blockColumn] || []);
+if (indexMove == -1 && indexStatic == -1) {
+return [false, -1, -1];
+} else {
+var aboveIndexMove = $.inArray(row + 1, moveBlocks[blockColumn] || []),
+aboveIndexStatic = $.inArray(row + 1,
+staticBlocks[blockColumn] || []),
+aboveTwoIndexStatic = $.inArray(row + 2,
+staticBlocks[blockColumn] || []);
+if (aboveIndexMove != -1 || aboveIndexStatic != -1 ||
+(typeof this.block != 'undefined' &&
+aboveTwoIndexStatic != -1)) {
+return [false, -1, -1];
+} else {
+return [true, row, blockColumn];
+}
+}
+};
+Player.prototype.jump = function(staticBlocks, moveBlocks, constants) {
+var valid = this.canJump_(staticBlocks, moveBlocks,
+constants.entitySize, constants.canvasHeight);
+if (valid[0]) {
+var row = valid[1],
+column = valid[2];
+this.x = column * constants.entitySize;
+this.y = constants.canvasHeight - (row + 2) * constants.entitySize;
+if (typeof this.block != 'undefined') {
+this.block.x = this.x;
+this.block.y = this.y - constants.entitySize;
+}
+}
+};
+Player.prototype.canPickup_ = function(staticBlocks, moveBlocks,
+size, canvasHeight) {
+if (typeof this.block != 'undefined') {
+return [false, -1, -1];
+}
+var row = this.row_(canvasHeight, size);
+if (row == -1) {
+return [false, -1, -1];
+}
+if (this.x % size != 0) {
+return [false, -1, -1];
+}
+var currColumn = this.x / size;
+var abovePlayerIndex = $.inArray(row + 1, staticBlocks[currColumn] || []);
+if (abovePlayerIndex != -1) {
+return [false, -1, -1];
+}
+var blockColumn = currColumn + ((this.facing == 'left') ? -1 : 1);
+var index = $.inArray(row, moveBlocks[blockColumn] || []);
+if (index == -1) {
+return [false, -1, -1];
+} else {
+var aboveIndexMove = $.inArray(row + 1, moveBlocks[blockColumn] || []),
+aboveIndexStatic = $.inArray(row + 1,
+staticBlocks[blockColumn] || []);
+if (aboveIndexMove == -1 && aboveIndexStatic == -1) {
+return [true, row, blockColumn];
+} else {
+return [false, -1, -1];
+}
+}
+};
+Player.prototype.pickup = function(blocks, staticBlocks,
+moveBlocks, constants) {
+var valid = this.canPickup_(staticBlocks, moveBlocks,
+constants.entitySize, constants.canvasHeight);
+if (valid[0]) {
+var row = valid[1],
+column = valid[2];
+var foundBlock;
+$.each(blocks, function(index, block) {
+if (!block.static && block.row == row && block.column == column) {
+foundBlock = block;
+}
+});
+if (typeof foundBlock == 'undefined') {
+console.log('Error. No match to pick up.');
+return;
+}
+foundBlock.x = this.x;
+foundBlock.y = this.y - constants.entitySize;
+this.block = foundBlock;
+var index = $.inArray(row, moveBlocks[column] || []);
+if (index == -1) {
+console.log('Exiting step. Direction ' +
+player.facing +
+' is not defined.');
+return;
+}
+moveBlocks[column].splice(index, 1);
+}
+};
+Player.prototype.canPutdown_ = function(staticBlocks, moveBlocks, size,
+canvasHeight, canvasWidth) {
+if (typeof this.block == 'undefined') {
+return [false, -1, -1];
+}
+var row = this.row_(canvasHeight, size);
+if (row == -1) {
+return [false, -1, -1];
+}
+var targetColumn = this.nextColumn_(size, size);
+if (targetColumn < 0 || targetColumn * size >= canvasWidth) {
+return [false, -1, -1];
+}
+var indexMove = $.inArray(row, moveBlocks[targetColumn] || []),
+indexStatic = $.inArray(row, staticBlocks[targetColumn] || []);
+if (indexMove != -1 || indexStatic != -1) {
+return [false, -1, -1];
+} else {
+var aboveIndexStatic = $.inArray(row + 1,
+staticBlocks[targetColumn] || []);
+if (aboveIndexStatic != -1) {
+return [false, -1, -1];
+} else {
+return [true, row, targetColumn];
+}
+}
+};
+Player.prototype.putdown = function(staticBlocks, moveBlocks, constants) {
+var valid = this.canPutdown_(staticBlocks, moveBlocks, constants.entitySize,
+constants.canvasHeight, constants.canvasWidth);
+if (valid[0]) {
+var row = valid[1],
+column = valid[2];
+this.block.soloFreefall = true;
+this.block.x = column * constants.entitySize;
+this.block.y = constants.canvasHeight -
+(row + 1) * constants.entitySize;
+}
+};
+Player.prototype.reached = function(door, constants) {
+var xDisplace = Math.abs(this.x - door.column * constants.entitySize),
+yDisplace = Math.abs(this.y + constants.entitySize +
+door.row * constants.entitySize -
+constants.canvasHeight);
+return (xDisplace < constants.stepSize && yDisplace == 0);
+};
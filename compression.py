@@ -0,0 +1,145 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""gzip compression of responses, negotiated from Accept-Encoding.
+
+GzipMiddleware wraps the WSGI application and compresses text and JSON
+responses for clients which accept gzip, marking every such response with
+Vary: Accept-Encoding so caches keep the two encodings apart. Responses
+which already carry a Content-Encoding are passed through untouched; that
+is how rendering.WriteCachedPage serves the compressed copies it keeps of
+cached pages.
+
+webapp buffers a whole response and hands it over as one string once the
+handler returns, so there is nothing to stream; the body is compressed
+after the handler has finished.
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# standard library imports
+import zlib
+
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript',
+                      'application/x-javascript')
+MIN_SIZE = 512  # bytes; gzip's header and trailer outweigh any saving below
+COMPRESSION_LEVEL = 6
+_GZIP_WBITS = 16 + zlib.MAX_WBITS  # gzip header and trailer, not zlib's
+
+
+def AcceptsGzip(accept_encoding):
+  """Returns True if an Accept-Encoding header value allows gzip."""
+  gzip_quality = None
+  any_quality = None
+  for coding in accept_encoding.lower().split(','):
+    parts = coding.split(';')
+    name = parts[0].strip()
+    quality = 1.0
+    for param in parts[1:]:
+      param = param.strip()
+      if param.startswith('q='):
+        try:
+          quality = float(param[2:])
+        except ValueError:
+          quality = 0.0
+    if name in ('gzip', 'x-gzip'):
+      gzip_quality = quality
+    elif name == '*':
+      any_quality = quality
+  if gzip_quality is None:
+    gzip_quality = any_quality
+  return bool(gzip_quality)
+
+
+def GzipChunks(chunks, level=COMPRESSION_LEVEL):
+  """Compresses a list of strings in the gzip format.
+
+  Returns:
+    List of compressed strings.
+  """
+  compressor = zlib.compressobj(level, zlib.DEFLATED, _GZIP_WBITS)
+  compressed = []
+  for chunk in chunks:
+    if isinstance(chunk, unicode):
+      chunk = chunk.encode('utf-8')
+    output = compressor.compress(chunk)
+    if output:
+      compressed.append(output)
+  compressed.append(compressor.flush())
+  return compressed
+
+
+def Gzip(data, level=COMPRESSION_LEVEL):
+  """Returns data compressed in the gzip format."""
+  return ''.join(GzipChunks([data], level=level))
+
+
+def _Header(headers, name):
+  name = name.lower()
+  for header, value in headers:
+    if header.lower() == name:
+      return value
+  return None
+
+
+def _IsCompressible(headers):
+  content_type = (_Header(headers, 'Content-Type') or '').lower()
+  return (_Header(headers, 'Content-Encoding') is None and
+          content_type.startswith(COMPRESSIBLE_TYPES))
+
+
+def _AddVary(headers):
+  vary = _Header(headers, 'Vary')
+  if vary is None:
+    headers.append(('Vary', 'Accept-Encoding'))
+  elif 'accept-encoding' not in vary.lower():
+    headers[:] = [(name, value) for name, value in headers
+                  if name.lower() != 'vary']
+    headers.append(('Vary', vary + ', Accept-Encoding'))
+
+
+class GzipMiddleware(object):
+  """WSGI middleware compressing responses for clients accepting gzip."""
+
+  def __init__(self, application):
+    self.application = application
+
+  def __call__(self, environ, start_response):
+    if not AcceptsGzip(environ.get('HTTP_ACCEPT_ENCODING', '')):
+      def StartUncompressed(status, headers, exc_info=None):
+        if _IsCompressible(headers):
+          _AddVary(headers)
+        return start_response(status, headers, exc_info)
+      return self.application(environ, StartUncompressed)
+
+    started = []
+    body = []
+
+    def StartBuffered(status, headers, exc_info=None):
+      started[:] = [status, headers, exc_info]
+      return body.append
+
+    result = self.application(environ, StartBuffered)
+    try:
+      for chunk in result:
+        if chunk:
+          body.append(chunk)
+    finally:
+      if hasattr(result, 'close'):
+        result.close()
+
+    status, headers, exc_info = started
+    if _IsCompressible(headers):
+      _AddVary(headers)
+      size = sum([len(chunk) for chunk in body])
+      if size >= MIN_SIZE and status[:3] not in ('204', '304'):
+        body = GzipChunks(body)
+        headers = [(name, value) for name, value in headers
+                   if name.lower() != 'content-length']
+        headers.append(('Content-Encoding', 'gzip'))
+        headers.append(('Content-Length',
+                        str(sum([len(chunk) for chunk in body]))))
+    start_response(status, headers, exc_info)
+    return body
@@ -5,4 +5,12 @@ OPEN_ID_PROVIDERS = (
     ('AOL', 'aol.com'),
     ('MyOpenID', 'myopenid.com'),
 )
-POSTBACK_URL = 'http://iap-hello-world.appspot.com/postback-verify'
+# Served by its own version, see rate_limits
+POSTBACK_URL = 'http://postbacks.iap-hello-world.appspot.com/postback-verify'
+# (item_name, price) for everything sold in the game, in display order
+CATALOG = (
+    ('Levels', '0.50'),
+    ('Sprite', '0.50'),
+    ('Builder', '2.00'),
+    ('Source', '8.00'),
+)
@@ -0,0 +1,144 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Per-user entitlement lookups for IAP Hello World.
+
+Every handler used to run one PurchasedItem count query per catalog item it
+cared about. Instead, all of a user's purchases are fetched in a single query
+and the resulting set of item names is cached in memcache, with a short-lived
+in-process copy in front of it.
+
+Clients polling for a purchase compare versions (a hash of the set of item
+names) and can wait on a change counter in memcache, which is bumped every
+time a user's entitlements are invalidated.
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# standard library imports
+import hashlib
+import time
+
+# third-party imports
+from google.appengine.api import memcache
+from google.appengine.ext import db
+
+# application-specific imports
+from models import PurchasedItem
+from queries import PurchasesFor
+
+
+MEMCACHE_NAMESPACE = 'entitlements'
+MEMCACHE_TTL = 3600  # seconds
+# Invalidation only clears the in-process cache on the instance handling the
+# postback, so other instances may serve a stale set for at most this long
+LOCAL_TTL = 5  # seconds
+LOCAL_MAX_ENTRIES = 1000
+# After an invalidation, memcache.add is refused for this long so a request
+# racing with the postback can't write back the pre-purchase set
+INVALIDATION_LOCK = 2  # seconds
+CHANGES_NAMESPACE = 'entitlement-changes'
+
+_local_cache = {}
+
+
+def _LoadFromDatastore(identity):
+  """Fetches the names of every item purchased by identity in one query."""
+  return frozenset(purchase.item_name for purchase in PurchasesFor(identity))
+
+
+def GetEntitlements(identity, use_local_cache=True):
+  """Returns the set of catalog item names purchased by a user.
+
+  Args:
+    identity: federated identity of the user, as stored in sellerData
+    use_local_cache: if False, skips the in-process copy, which may be up to
+                     LOCAL_TTL seconds behind a purchase on another instance
+
+  Returns:
+    frozenset of item names, e.g. frozenset(['Levels', 'Sprite'])
+  """
+  now = time.time()
+  cached = _local_cache.get(identity)
+  if use_local_cache and cached is not None and cached[0] > now:
+    return cached[1]
+
+  items = memcache.get(identity, namespace=MEMCACHE_NAMESPACE)
+  if items is None:
+    items = _LoadFromDatastore(identity)
+    memcache.add(identity, items, time=MEMCACHE_TTL,
+                 namespace=MEMCACHE_NAMESPACE)
+
+  if len(_local_cache) >= LOCAL_MAX_ENTRIES:
+    _local_cache.clear()
+  _local_cache[identity] = (now + LOCAL_TTL, items)
+  return items
+
+
+def HasPurchased(identity, item_name):
+  """Returns True if the user identified by identity owns item_name."""
+  return item_name in GetEntitlements(identity)
+
+
+def EntitlementsVersion(items):
+  """Returns a short string which changes whenever the set items does."""
+  return hashlib.md5(','.join(sorted(items))).hexdigest()[:16]
+
+
+def ChangeCounter(identity):
+  """Returns the number of times identity's entitlements were invalidated.
+
+  Only meaningful for spotting a change between two calls; None if memcache
+  has no count.
+  """
+  return memcache.get(identity, namespace=CHANGES_NAMESPACE)
+
+
+def InvalidateEntitlements(identity):
+  """Drops cached entitlements for identity after its purchases change."""
+  _local_cache.pop(identity, None)
+  memcache.delete(identity, seconds=INVALIDATION_LOCK,
+                  namespace=MEMCACHE_NAMESPACE)
+  memcache.incr(identity, namespace=CHANGES_NAMESPACE, initial_value=0)
+
+
+def RecordPurchases(purchases):
+  """Stores purchases from postbacks, at most once per order.
+
+  Each entity's key is derived from its order id, so purchases which are
+  already stored (retried postbacks) are found with one batch get and
+  skipped. Everything new is written with a single batch put. Two drains
+  holding copies of the same order can both write it and both return it;
+  sales.CountSales counts it once all the same.
+
+  Args:
+    purchases: list of dictionaries as built by
+               purchase_queue.PurchaseFromPostback
+
+  Returns:
+    List of the PurchasedItem entities that were newly written.
+  """
+  by_key_name = {}
+  for purchase in purchases:
+    key_name = PurchasedItem.KeyNameForOrder(purchase['order_id'])
+    by_key_name[key_name] = purchase
+  key_names = by_key_name.keys()
+  existing = PurchasedItem.get_by_key_name(key_names)
+
+  new_items = []
+  for key_name, stored in zip(key_names, existing):
+    if stored is None:
+      purchase = by_key_name[key_name]
+      new_items.append(PurchasedItem(
+          key_name=key_name,
+          currency_code=purchase['currency_code'],
+          federated_identity=purchase['federated_identity'],
+          item_name=purchase['item_name'],
+          item_price=purchase['item_price'],
+          order_id=purchase['order_id']))
+  if new_items:
+    db.put(new_items)
+    for identity in set(item.federated_identity for item in new_items):
+      InvalidateEntitlements(identity)
+  return new_items
@@ -0,0 +1,216 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Per-request timing for IAP Hello World.
+
+StatsMiddleware wraps the WSGI application and, for every route, records
+wall time along with the time spent in datastore RPCs (counted per kind),
+template rendering and JWT signing/verification. Timings are aggregated in
+fixed-bucket histograms held in instance memory, and a sample of slow
+requests is kept with its full breakdown. Both are served at /_stats.
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# standard library imports
+import random
+import threading
+import time
+
+# third-party imports
+from google.appengine.api import apiproxy_stub_map
+
+
+# Upper bounds of the histogram buckets, in milliseconds
+BUCKET_BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
+                    10000, 30000)
+SLOW_REQUEST_MS = 500
+SLOW_SAMPLE_RATE = 0.1
+MAX_SLOW_TRACES = 50
+
+# Datastore RPC methods grouped the way the handlers think about them
+_DATASTORE_KINDS = {'RunQuery': 'query', 'Next': 'query', 'Count': 'query',
+                    'Get': 'get', 'Put': 'put', 'Delete': 'delete'}
+
+
+class Histogram(object):
+  """Counts of values (in milliseconds) per fixed bucket."""
+
+  def __init__(self):
+    self.counts = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+    self.total = 0
+    self.sum_ms = 0.0
+
+  def Add(self, value_ms):
+    index = 0
+    for bound in BUCKET_BOUNDS_MS:
+      if value_ms <= bound:
+        break
+      index += 1
+    self.counts[index] += 1
+    self.total += 1
+    self.sum_ms += value_ms
+
+  def Percentile(self, fraction):
+    """Returns the upper bound of the bucket holding the given fraction."""
+    if not self.total:
+      return 0
+    target = fraction * self.total
+    seen = 0
+    for index, count in enumerate(self.counts):
+      seen += count
+      if seen >= target:
+        if index < len(BUCKET_BOUNDS_MS):
+          return BUCKET_BOUNDS_MS[index]
+        break
+    return None  # beyond the last bound
+
+  def Summary(self):
+    mean = self.sum_ms / self.total if self.total else 0.0
+    return {'count': self.total,
+            'mean_ms': round(mean, 3),
+            'p50_ms': self.Percentile(0.50),
+            'p95_ms': self.Percentile(0.95),
+            'p99_ms': self.Percentile(0.99)}
+
+
+class _RequestStats(object):
+  """Timings gathered while serving a single request."""
+
+  def __init__(self, route):
+    self.route = route
+    self.start = time.time()
+    self.timings = {}  # component -> [count, seconds]
+    self.pending_rpcs = {}
+
+  def Add(self, component, seconds):
+    timing = self.timings.setdefault(component, [0, 0.0])
+    timing[0] += 1
+    timing[1] += seconds
+
+
+_local = threading.local()
+_wall_times = {}  # route -> Histogram
+_component_times = {}  # route -> {component: Histogram}
+_component_calls = {}  # route -> {component: number of calls}
+_slow_traces = []
+
+
+def _Current():
+  return getattr(_local, 'stats', None)
+
+
+def RecordTiming(component, seconds):
+  """Adds time spent in component to the request being served, if any."""
+  stats = _Current()
+  if stats is not None:
+    stats.Add(component, seconds)
+
+
+def _PreCallHook(service, call, request, response):
+  stats = _Current()
+  if stats is not None:
+    stats.pending_rpcs[id(request)] = time.time()
+
+
+def _PostCallHook(service, call, request, response):
+  stats = _Current()
+  if stats is not None:
+    start = stats.pending_rpcs.pop(id(request), None)
+    if start is not None:
+      kind = _DATASTORE_KINDS.get(call, call.lower())
+      stats.Add('datastore_%s' % kind, time.time() - start)
+
+
+_hooks_installed = []
+
+
+def InstallDatastoreHooks():
+  """Registers the apiproxy hooks timing datastore RPCs, once."""
+  if not _hooks_installed:
+    apiproxy = apiproxy_stub_map.apiproxy
+    apiproxy.GetPreCallHooks().Append('instrumentation', _PreCallHook,
+                                      'datastore_v3')
+    apiproxy.GetPostCallHooks().Append('instrumentation', _PostCallHook,
+                                       'datastore_v3')
+    _hooks_installed.append(True)
+
+
+def _Finish(stats):
+  wall_ms = 1000 * (time.time() - stats.start)
+  _wall_times.setdefault(stats.route, Histogram()).Add(wall_ms)
+  components = _component_times.setdefault(stats.route, {})
+  calls = _component_calls.setdefault(stats.route, {})
+  for component, (count, seconds) in stats.timings.iteritems():
+    components.setdefault(component, Histogram()).Add(1000 * seconds)
+    calls[component] = calls.get(component, 0) + count
+
+  if wall_ms >= SLOW_REQUEST_MS and random.random() < SLOW_SAMPLE_RATE:
+    breakdown = {}
+    for component, (count, seconds) in stats.timings.iteritems():
+      breakdown[component] = {'count': count,
+                              'ms': round(1000 * seconds, 3)}
+    _slow_traces.append({'route': stats.route,
+                         'time': int(stats.start),
+                         'wall_ms': round(wall_ms, 3),
+                         'components': breakdown})
+    del _slow_traces[:-MAX_SLOW_TRACES]
+
+
+def RouteName(routes, environ):
+  """Names a request by its handler class and HTTP method, e.g. Play.get.
+
+  Args:
+    routes: the webapp.WSGIApplication the request is for
+    environ: WSGI environment of the request
+  """
+  path = environ.get('PATH_INFO', '')
+  method = environ.get('REQUEST_METHOD', 'GET')
+  for regexp, handler in routes._url_mapping:
+    if regexp.match(path):
+      return '%s.%s' % (handler.__name__, method.lower())
+  return 'unmatched.%s' % method.lower()
+
+
+class StatsMiddleware(object):
+  """WSGI middleware recording per-route timings for a webapp application."""
+
+  def __init__(self, application):
+    self.application = application
+    InstallDatastoreHooks()
+
+  def __call__(self, environ, start_response):
+    stats = _RequestStats(RouteName(self.application, environ))
+    _local.stats = stats
+    try:
+      return self.application(environ, start_response)
+    finally:
+      _local.stats = None
+      _Finish(stats)
+
+
+def Snapshot():
+  """Returns all aggregated timings and slow traces."""
+  routes = {}
+  for route, histogram in _wall_times.iteritems():
+    components = {}
+    calls = _component_calls.get(route, {})
+    for component, component_histogram in (
+        _component_times.get(route, {}).iteritems()):
+      summary = component_histogram.Summary()
+      summary['calls'] = calls.get(component, 0)
+      components[component] = summary
+    routes[route] = {'wall': histogram.Summary(),
+                     'components': components}
+  return {'bucket_bounds_ms': BUCKET_BOUNDS_MS,
+          'routes': routes,
+          'slow_requests': list(_slow_traces)}
+
+
+def Reset():
+  """Clears every histogram and slow trace."""
+  _wall_times.clear()
+  _component_times.clear()
+  _component_calls.clear()
+  del _slow_traces[:]
@@ -6,16 +6,27 @@ http://self-issued.info/docs/draft-jones-json-web-token-01.html
 import base64
 import hashlib
 import hmac
+import sys
+import time
 
 try:
     import json
 except ImportError:
     import simplejson as json
-    
-__all__ = ['encode', 'decode', 'DecodeError']
+
+__all__ = ['encode', 'decode', 'encode_many', 'decode_many', 'Signer',
+           'DecodeError', 'ExpiredSignature']
 
 class DecodeError(Exception): pass
 
+class ExpiredSignature(DecodeError): pass
+
+digest_methods = {
+    'HS256': hashlib.sha256,
+    'HS384': hashlib.sha384,
+    'HS512': hashlib.sha512,
+}
+
 signing_methods = {
     'HS256': lambda msg, key: hmac.new(key, msg, hashlib.sha256).digest(),
     'HS384': lambda msg, key: hmac.new(key, msg, hashlib.sha384).digest(),
@@ -29,6 +40,15 @@ def base64url_decode(input):
 def base64url_encode(input):
     return base64.urlsafe_b64encode(input).replace('=', '')
 
+def constant_time_compare(val1, val2):
+    """Compares two strings without short-circuiting on the first mismatch."""
+    if len(val1) != len(val2):
+        return False
+    result = 0
+    for x, y in zip(val1, val2):
+        result |= ord(x) ^ ord(y)
+    return result == 0
+
 def header(jwt):
     header_segment = jwt.split('.', 1)[0]
     try:
@@ -36,37 +56,113 @@ def header(jwt):
     except (ValueError, TypeError):
         raise DecodeError("Invalid header encoding")
 
-def encode(payload, key, algorithm='HS256'):
-    segments = []
-    header = {"typ": "JWT", "alg": algorithm}
-    segments.append(base64url_encode(json.dumps(header)))
-    segments.append(base64url_encode(json.dumps(payload)))
-    signing_input = '.'.join(segments)
-    try:
-        ascii_key = unicode(key).encode('utf8')
-        signature = signing_methods[algorithm](signing_input, ascii_key)
-    except KeyError:
-        raise NotImplementedError("Algorithm not supported")
-    segments.append(base64url_encode(signature))
-    return '.'.join(segments)
-
-def decode(jwt, key='', verify=True):
-    try:
-        signing_input, crypto_segment = jwt.rsplit('.', 1)
-        header_segment, payload_segment = signing_input.split('.', 1)
-    except ValueError:
-        raise DecodeError("Not enough segments")
-    try:
-        header = json.loads(base64url_decode(header_segment))
-        payload = json.loads(base64url_decode(payload_segment))
-        signature = base64url_decode(crypto_segment)
-    except (ValueError, TypeError):
-        raise DecodeError("Invalid segment encoding")
-    if verify:
+class Signer(object):
+    """Reusable encoder/verifier bound to a single key and algorithm.
+
+    The header segment and the keyed HMAC state are prepared once; each
+    message only copies the HMAC state and feeds it the signing input.
+    """
+
+    def __init__(self, key, algorithm='HS256', leeway=0):
         try:
-            ascii_key = unicode(key).encode('utf8')
-            if not signature == signing_methods[header['alg']](signing_input, ascii_key):
-                raise DecodeError("Signature verification failed")
+            digestmod = digest_methods[algorithm]
         except KeyError:
-            raise DecodeError("Algorithm not supported")
-    return payload
+            raise NotImplementedError("Algorithm not supported")
+        self.algorithm = algorithm
+        self.leeway = leeway
+        self._hmac = hmac.new(unicode(key).encode('utf8'), digestmod=digestmod)
+        header = {"typ": "JWT", "alg": algorithm}
+        self._header_segment = base64url_encode(json.dumps(header))
+
+    def sign(self, signing_input):
+        mac = self._hmac.copy()
+        mac.update(signing_input)
+        return mac.digest()
+
+    def encode(self, payload):
+        signing_input = '.'.join([self._header_segment,
+                                  base64url_encode(json.dumps(payload))])
+        return '.'.join([signing_input,
+                         base64url_encode(self.sign(signing_input))])
+
+    def decode(self, jwt, verify=True, verify_expiration=False, now=None):
+        try:
+            signing_input, crypto_segment = jwt.rsplit('.', 1)
+            header_segment, payload_segment = signing_input.split('.', 1)
+        except ValueError:
+            raise DecodeError("Not enough segments")
+        try:
+            if header_segment == self._header_segment:
+                header = None
+            else:
+                header = json.loads(base64url_decode(header_segment))
+            payload = json.loads(base64url_decode(payload_segment))
+            signature = base64url_decode(crypto_segment)
+        except (ValueError, TypeError):
+            raise DecodeError("Invalid segment encoding")
+        if verify:
+            if header is not None and header.get('alg') != self.algorithm:
+                raise DecodeError("Algorithm not supported")
+            if not constant_time_compare(signature, self.sign(signing_input)):
+                raise DecodeError("Signature verification failed")
+        if verify_expiration:
+            self.validate_times(payload, now)
+        return payload
+
+    def validate_times(self, payload, now=None):
+        """Checks the exp and iat claims, if present, against now."""
+        if now is None:
+            now = time.time()
+        try:
+            if 'exp' in payload and now > int(payload['exp']) + self.leeway:
+                raise ExpiredSignature("Signature has expired")
+            if 'iat' in payload and now < int(payload['iat']) - self.leeway:
+                raise DecodeError("Token issued in the future")
+        except (ValueError, TypeError):
+            raise DecodeError("Invalid exp or iat claim")
+
+    def encode_many(self, payloads):
+        return [self.encode(payload) for payload in payloads]
+
+    def decode_many(self, jwts, verify=True, verify_expiration=False):
+        """Decodes each token; failures are returned as DecodeError values."""
+        now = time.time()
+        results = []
+        for jwt in jwts:
+            try:
+                results.append(self.decode(jwt, verify, verify_expiration,
+                                           now))
+            except DecodeError:
+                results.append(sys.exc_info()[1])
+        return results
+
+_signers = {}
+
+def get_signer(key, algorithm='HS256'):
+    """Returns a shared Signer for key and algorithm."""
+    cache_key = (key, algorithm)
+    signer = _signers.get(cache_key)
+    if signer is None:
+        signer = _signers[cache_key] = Signer(key, algorithm)
+    return signer
+
+def encode(payload, key, algorithm='HS256'):
+    return get_signer(key, algorithm).encode(payload)
+
+def decode(jwt, key='', verify=True, verify_expiration=False):
+    if not verify:
+        return Signer(key).decode(jwt, verify=False,
+                                  verify_expiration=verify_expiration)
+    try:
+        algorithm = header(jwt)['alg']
+        signer = get_signer(key, algorithm)
+    except (KeyError, TypeError, NotImplementedError):
+        raise DecodeError("Algorithm not supported")
+    return signer.decode(jwt, verify_expiration=verify_expiration)
+
+def encode_many(payloads, key, algorithm='HS256'):
+    return get_signer(key, algorithm).encode_many(payloads)
+
+def decode_many(jwts, key, algorithm='HS256', verify_expiration=False):
+    return get_signer(key, algorithm).decode_many(
+        jwts, verify_expiration=verify_expiration)
@@ -0,0 +1,125 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Cache of fully decoded levels for the /play handler.
+
+Levels are looked up by name and owner (None for the stock levels) and
+stored as plain dictionaries holding everything game_play.html needs. An
+in-process LRU sits in front of memcache; the stock levels are pinned in
+process once loaded since they never change.
+
+Levels are read by their deterministic key, so a level is found as soon as
+it has been written; only levels still stored under numeric ids fall back
+to a query.
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# third-party imports
+from google.appengine.api import memcache
+
+# application-specific imports
+from level_codec import LevelLayout
+from lru import LRUCache
+from models import Level
+from queries import LevelsNamed
+
+
+STOCK_LEVELS = ('1', '2', '3', '4', '5')
+MEMCACHE_NAMESPACE = 'levels'
+MEMCACHE_TTL = 24 * 3600  # seconds
+LOCAL_TTL = 600  # seconds
+LOCAL_MAX_ENTRIES = 500
+# Stock level names with no level behind them, i.e. every custom level
+# looked up as stock first, are remembered only locally and briefly; misses
+# for a builder's levels aren't, as the level may be written on another
+# instance right after
+MISSING_TTL = 60  # seconds
+_MISSING = 'missing'
+
+_stock_levels = {}
+_local_cache = LRUCache(LOCAL_MAX_ENTRIES, ttl=LOCAL_TTL)
+
+
+def _CacheKey(level_name, owner):
+  owner_email = '' if owner is None else owner.email()
+  return '%s/%s' % (owner_email, level_name)
+
+
+def DecodeLevel(level):
+  """Returns a dictionary with the template-facing fields of a Level."""
+  decoded = LevelLayout(level)
+  decoded.update({'level': level.level,
+                  'next_level': level.next_level,
+                  'owner': level.owner,
+                  'base_rows': level.base_rows,
+                  'entity_size': level.entity_size,
+                  'canvas_width_blocks': level.canvas_width_blocks,
+                  'canvas_height_blocks': level.canvas_height_blocks,
+                  'step_size': level.step_size,
+                  'public': bool(level.public)})
+  return decoded
+
+
+def _LoadFromDatastore(level_name, owner):
+  level = Level.get_by_key_name(Level.KeyNameFor(level_name, owner))
+  if level is not None:
+    return DecodeLevel(level)
+  # Levels from before deterministic keys, until level_io.py delete-legacy
+  matches = LevelsNamed(level_name, owner, limit=2)
+  # Mirrors the old behavior of refusing ambiguous names
+  if len(matches) != 1:
+    return None
+  return DecodeLevel(matches[0])
+
+
+def GetLevel(level_name, owner=None):
+  """Returns the decoded level named level_name owned by owner.
+
+  Args:
+    level_name: value of Level.level
+    owner: users.User who built the level, or None for the stock levels
+
+  Returns:
+    Dictionary as built by DecodeLevel, or None if there is no such level.
+    The dictionary is shared between requests and must not be modified.
+  """
+  if owner is None and level_name in _stock_levels:
+    return _stock_levels[level_name]
+
+  key = _CacheKey(level_name, owner)
+  decoded = _local_cache.get(key)
+  if decoded is None:
+    decoded = memcache.get(key, namespace=MEMCACHE_NAMESPACE)
+    if decoded is None:
+      decoded = _LoadFromDatastore(level_name, owner)
+      if decoded is None:
+        if owner is None:
+          _local_cache.set(key, _MISSING, ttl=MISSING_TTL)
+        return None
+      memcache.set(key, decoded, time=MEMCACHE_TTL,
+                   namespace=MEMCACHE_NAMESPACE)
+    if owner is None and level_name in STOCK_LEVELS:
+      _stock_levels[level_name] = decoded
+    else:
+      _local_cache.set(key, decoded)
+  elif decoded == _MISSING:
+    return None
+  return decoded
+
+
+def InvalidateLevel(level_name, owner=None):
+  """Drops a level from every cache after it is written."""
+  key = _CacheKey(level_name, owner)
+  if owner is None:
+    _stock_levels.pop(level_name, None)
+  _local_cache.pop(key)
+  memcache.delete(key, namespace=MEMCACHE_NAMESPACE)
+
+
+def LevelCacheStats():
+  """Returns size and hit/miss counters for the in-process caches."""
+  stats = _local_cache.Stats()
+  stats['pinned'] = len(_stock_levels)
+  return stats
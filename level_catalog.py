@@ -0,0 +1,219 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Public catalog of user-built levels.
+
+Builders can opt a level into the catalog, which makes it playable by
+everyone. Every public level has a PublicLevel summary under the same key
+name as the Level, holding just what the browser shows, so listing and
+searching never decode block layouts.
+
+Builders' emails are never shown to other players: catalog and /play URLs
+name a builder by the opaque user_id() stored as PublicLevel.owner_id, and
+the catalog shows only the part of the builder's nickname before any @.
+
+Search is by prefix of the words in level names and creator names: every
+summary stores each such prefix in tokens, so a search is an equality filter
+on a list property, served from the composite indexes in index.yaml. The
+two-term index has an entry per pair of tokens, so a summary keeps at most
+MAX_TOKENS of them, shortest first; words of a very long name may then only
+be found by their shorter prefixes.
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# standard library imports
+import re
+
+# third-party imports
+from google.appengine.ext import db
+
+# application-specific imports
+from level_cache import GetLevel
+from level_cache import InvalidateLevel
+from level_codec import LevelLayout
+from level_preview import LevelPreviewVersion
+from models import Level
+from models import PublicLevel
+from queries import PublicLevelNamed
+
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PREFIX_LENGTH = 16
+# Keeps the tokens x tokens index at no more than 1600 entries per summary
+MAX_TOKENS = 40
+# Each term is one more equality filter; index.yaml has indexes for up to two
+MAX_SEARCH_TERMS = 2
+_WORD = re.compile(r'[a-z0-9]+')
+
+
+def _Words(text):
+  return _WORD.findall(text.lower())
+
+
+def SearchTokens(level_name, creator):
+  """Returns the prefixes of the words in a level name and creator.
+
+  At most MAX_TOKENS are returned, shortest prefixes first.
+  """
+  words = _Words(level_name) + _Words(creator)
+  tokens = set()
+  for length in range(1, MAX_PREFIX_LENGTH + 1):
+    for word in words:
+      if len(word) >= length and word[:length] not in tokens:
+        if len(tokens) == MAX_TOKENS:
+          return sorted(tokens)
+        tokens.add(word[:length])
+  return sorted(tokens)
+
+
+def _BlockCount(blocks):
+  return sum(len(rows) for rows in blocks.itervalues())
+
+
+def CreatorName(user):
+  """Returns the name a builder is shown by, which is never their email.
+
+  nickname() is the whole email address for accounts outside the auth
+  domain, so only the part before any @ is kept.
+  """
+  return user.nickname().split('@', 1)[0]
+
+
+def SummaryFor(level):
+  """Returns the unsaved PublicLevel for a user-built Level."""
+  layout = LevelLayout(level)
+  creator = CreatorName(level.owner)
+  return PublicLevel(key_name=Level.KeyNameFor(level.level, level.owner),
+                     owner=level.owner,
+                     owner_id=level.owner.user_id(),
+                     level=level.level,
+                     creator=creator,
+                     base_rows=level.base_rows,
+                     static_count=_BlockCount(layout['static_blocks']),
+                     move_count=_BlockCount(layout['move_blocks']),
+                     min_moves=level.min_moves,
+                     tokens=SearchTokens(level.level, creator),
+                     preview=LevelPreviewVersion(level))
+
+
+def SetPublic(level, public):
+  """Adds a saved level to the catalog or takes it out.
+
+  When publishing, the Level and its summary are written in a single batch.
+  """
+  level.public = public
+  if public:
+    db.put([level, SummaryFor(level)])
+  else:
+    level.put()
+    db.delete(db.Key.from_path('PublicLevel',
+                               Level.KeyNameFor(level.level, level.owner)))
+  InvalidateLevel(level.level, level.owner)
+
+
+def FindPublicLevel(level_name, owner_id):
+  """Returns the PublicLevel for a level, or None if it isn't public.
+
+  Args:
+    level_name: name of the level
+    owner_id: PublicLevel.owner_id of the builder, as in catalog URLs
+  """
+  if not owner_id:
+    return None
+  return PublicLevelNamed(level_name, owner_id)
+
+
+def FindPlayableLevel(level_name, user, owner_id=''):
+  """Looks up a level user may play.
+
+  The PublicLevel summary alone decides whether someone else's level is
+  public; the decoded level may be cached from before it was published.
+
+  Args:
+    level_name: name of the level
+    user: users.User playing
+    owner_id: PublicLevel.owner_id of the builder for someone else's public
+              level; empty for stock levels and the user's own
+
+  Returns:
+    (decoded level, owner) as for level_cache.GetLevel, or (None, None).
+  """
+  if owner_id and owner_id != user.user_id():
+    summary = FindPublicLevel(level_name, owner_id)
+    if summary is None:
+      return None, None
+    decoded = GetLevel(level_name, summary.owner)
+    if decoded is None:
+      return None, None
+    return decoded, summary.owner
+
+  decoded = GetLevel(level_name)
+  if decoded is not None:
+    return decoded, None
+  decoded = GetLevel(level_name, user)
+  if decoded is None:
+    return None, None
+  return decoded, user
+
+
+def BrowseLevels(search='', cursor=None, page_size=DEFAULT_PAGE_SIZE):
+  """Returns one page of public levels, newest first.
+
+  Args:
+    search: words to match against level names and creators by prefix;
+            only the first MAX_SEARCH_TERMS are used
+    cursor: cursor returned with the previous page, or None; a cursor which
+            isn't one of ours gets the first page
+    page_size: maximum number of summaries to return
+
+  Returns:
+    (summaries, next_cursor) where next_cursor is None on the last page.
+  """
+  terms = [term[:MAX_PREFIX_LENGTH]
+           for term in _Words(search)[:MAX_SEARCH_TERMS]]
+
+  def Query():
+    query = PublicLevel.all()
+    for term in terms:
+      query.filter('tokens =', term)
+    return query.order('-published')
+
+  query = Query()
+  try:
+    if cursor:
+      query.with_cursor(cursor)
+    summaries = query.fetch(page_size)
+  except (db.BadRequestError, db.BadValueError):
+    query = Query()
+    summaries = query.fetch(page_size)
+  if len(summaries) < page_size:
+    return summaries, None
+  # A cursor only marks where a fetch stopped, so look one summary further
+  # rather than offer an empty next page
+  next_cursor = query.cursor()
+  query.with_cursor(next_cursor)
+  if not query.fetch(1):
+    return summaries, None
+  return summaries, next_cursor
+
+
+def RebuildCatalog(batch_size=100):
+  """Rewrites the summary of every public level; safe to rerun.
+
+  Returns:
+    Number of summaries written.
+  """
+  query = Level.all().filter('public =', True)
+  total = 0
+  while True:
+    levels = query.fetch(batch_size)
+    summaries = [SummaryFor(level) for level in levels
+                 if level.owner is not None]
+    if summaries:
+      db.put(summaries)
+      total += len(summaries)
+    if len(levels) < batch_size:
+      return total
+    query.with_cursor(query.cursor())
@@ -0,0 +1,158 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Compact binary encoding of Level block layouts.
+
+A layout is stored in Level.layout as a single blob:
+
+  header: version, canvas width and height in blocks (one byte each), the
+          door as row * width + column (two bytes) and the player start as
+          x << 16 | y in pixels (four bytes)
+  static: one bit per grid cell, column-major, padded to a whole byte
+  move:   same as static, for moveable blocks
+
+Levels saved before the blob existed keep their layout as pickled dicts in
+the old text properties; those are still readable, but only through an
+unpickler that refuses to load anything other than builtin containers.
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# standard library imports
+import array
+import struct
+from cStringIO import StringIO
+
+# third-party imports
+from google.appengine.ext import db
+
+
+LAYOUT_VERSION = 1
+_HEADER = struct.Struct('>BBBHI')
+
+
+class LayoutError(Exception):
+  """Raised when a stored layout can't be decoded."""
+
+
+def _GridBytes(width, height):
+  return (width * height + 7) // 8
+
+
+def _PackBlocks(blocks, width, height):
+  """Packs a {column: [rows]} dictionary into a column-major bitset."""
+  bits = array.array('B', [0] * _GridBytes(width, height))
+  for column, rows in blocks.iteritems():
+    for row in rows:
+      index = column * height + row
+      bits[index >> 3] |= 1 << (index & 7)
+  return bits.tostring()
+
+
+def _UnpackBlocks(bits, width, height):
+  """Inverse of _PackBlocks, returns rows in ascending order per column."""
+  blocks = {}
+  for byte_index, byte in enumerate(array.array('B', bits)):
+    if not byte:
+      continue
+    base = byte_index << 3
+    for bit in range(8):
+      if byte & (1 << bit):
+        column, row = divmod(base + bit, height)
+        if column < width:
+          blocks.setdefault(column, []).append(row)
+  return blocks
+
+
+def EncodeLayout(static_blocks, move_blocks, door, player_start,
+                 width=24, height=10):
+  """Encodes a level layout into a blob for Level.layout.
+
+  Args:
+    static_blocks: dictionary of column -> list of rows with static blocks
+    move_blocks: dictionary of column -> list of rows with moveable blocks
+    door: dictionary with integer 'row' and 'column' keys
+    player_start: dictionary with integer 'x' and 'y' keys, in pixels
+    width: canvas width in blocks
+    height: canvas height in blocks
+
+  Returns:
+    db.Blob holding the encoded layout.
+  """
+  header = _HEADER.pack(LAYOUT_VERSION, width, height,
+                        door['row'] * width + door['column'],
+                        (player_start['x'] << 16) | player_start['y'])
+  return db.Blob(header +
+                 _PackBlocks(static_blocks, width, height) +
+                 _PackBlocks(move_blocks, width, height))
+
+
+def DecodeLayout(blob):
+  """Decodes a blob written by EncodeLayout.
+
+  Returns:
+    Dictionary with keys static_blocks, move_blocks, door and player_start,
+    in the same shapes accepted by EncodeLayout.
+  """
+  blob = str(blob)
+  try:
+    version, width, height, door, player = _HEADER.unpack_from(blob)
+  except struct.error:
+    raise LayoutError('Layout header truncated')
+  if version != LAYOUT_VERSION:
+    raise LayoutError('Unknown layout version %s' % version)
+
+  grid_bytes = _GridBytes(width, height)
+  static_start = _HEADER.size
+  move_start = static_start + grid_bytes
+  if len(blob) != move_start + grid_bytes:
+    raise LayoutError('Layout has wrong length')
+
+  door_row, door_column = divmod(door, width)
+  return {'static_blocks': _UnpackBlocks(blob[static_start:move_start],
+                                         width, height),
+          'move_blocks': _UnpackBlocks(blob[move_start:], width, height),
+          'door': {'row': door_row, 'column': door_column},
+          'player_start': {'x': player >> 16, 'y': player & 0xFFFF}}
+
+
+_safe_unpickler = []
+
+
+def _SafeUnpickler():
+  """Returns the unpickler class, defining it on first use.
+
+  Only legacy levels need pickle, so importing it is left out of startup.
+  """
+  if not _safe_unpickler:
+    import pickle
+
+    class SafeUnpickler(pickle.Unpickler):
+      """Unpickler which refuses to import or construct any global."""
+
+      def find_class(self, module, name):
+        raise LayoutError('Refusing to unpickle %s.%s' % (module, name))
+
+    _safe_unpickler.append(SafeUnpickler)
+  return _safe_unpickler[0]
+
+
+def _SafeLoads(value):
+  import pickle
+  # pickle outputs str and expects it back, though app engine
+  # stores and returns from the DB as unicode
+  try:
+    return _SafeUnpickler()(StringIO(str(value))).load()
+  except (pickle.UnpicklingError, EOFError, ValueError, KeyError):
+    raise LayoutError('Invalid pickled layout')
+
+
+def LevelLayout(level):
+  """Returns the decoded layout of a Level, old pickled entities included."""
+  if level.layout is not None:
+    return DecodeLayout(level.layout)
+  return {'static_blocks': _SafeLoads(level.static_blocks),
+          'move_blocks': _SafeLoads(level.move_blocks),
+          'door': _SafeLoads(level.door),
+          'player_start': _SafeLoads(level.player_start)}
@@ -0,0 +1,103 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Tests for level_codec over the stock levels and old pickled layouts.
+
+level_codec imports google.appengine.ext.db, so run with the SDK on the
+path: PYTHONPATH=$APPENGINE_SDK python -m unittest level_codec_test
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# standard library imports
+import pickle
+import unittest
+
+# third-party imports
+from google.appengine.ext import db
+
+# application-specific imports
+from level_codec import DecodeLayout
+from level_codec import EncodeLayout
+from level_codec import LayoutError
+from level_codec import LevelLayout
+from level_solver_test import StockLevels
+
+
+def DBPIckle(value):
+  """Pickles a value the way BuildLevel.post stored layouts before blobs."""
+  return db.Text(pickle.dumps(value))
+
+
+class FakeLevel(object):
+  """Stands in for a Level; LevelLayout only reads these properties."""
+
+  def __init__(self, layout=None, static_blocks=None, move_blocks=None,
+               door=None, player_start=None):
+    self.layout = layout
+    self.static_blocks = static_blocks
+    self.move_blocks = move_blocks
+    self.door = door
+    self.player_start = player_start
+
+
+def Normalized(layout):
+  """Returns a layout with every list of rows sorted, for comparison."""
+  result = dict(layout)
+  for kind in ('static_blocks', 'move_blocks'):
+    result[kind] = dict([(column, sorted(rows))
+                         for column, rows in layout[kind].items() if rows])
+  return result
+
+
+class LevelCodecTest(unittest.TestCase):
+
+  def testStockLevelsRoundTrip(self):
+    for record, layout in StockLevels():
+      blob = EncodeLayout(layout['static_blocks'], layout['move_blocks'],
+                          layout['door'], layout['player_start'])
+      self.assertEqual(Normalized(layout), Normalized(DecodeLayout(blob)),
+                       'level %s' % record['level'])
+      self.assertEqual(Normalized(layout),
+                       Normalized(LevelLayout(FakeLevel(layout=blob))))
+
+  def testBoardCornersRoundTrip(self):
+    layout = {'static_blocks': {0: [0, 9], 23: [0, 9]},
+              'move_blocks': {11: [5]},
+              'door': {'row': 8, 'column': 23},
+              'player_start': {'x': 23 * 64, 'y': 0}}
+    blob = EncodeLayout(layout['static_blocks'], layout['move_blocks'],
+                        layout['door'], layout['player_start'])
+    self.assertEqual(Normalized(layout), Normalized(DecodeLayout(blob)))
+
+  def testOldPickledLevelsDecode(self):
+    for record, layout in StockLevels():
+      old_level = FakeLevel(
+          static_blocks=DBPIckle(layout['static_blocks']),
+          move_blocks=DBPIckle(layout['move_blocks']),
+          door=DBPIckle(layout['door']),
+          player_start=DBPIckle(layout['player_start']))
+      decoded = LevelLayout(old_level)
+      self.assertEqual(Normalized(layout), Normalized(decoded),
+                       'level %s' % record['level'])
+      # and converting it to the blob loses nothing
+      blob = EncodeLayout(decoded['static_blocks'], decoded['move_blocks'],
+                          decoded['door'], decoded['player_start'])
+      self.assertEqual(Normalized(layout), Normalized(DecodeLayout(blob)))
+
+  def testPickledGlobalsAreRefused(self):
+    old_level = FakeLevel(static_blocks=DBPIckle(LayoutError('x')),
+                          move_blocks=DBPIckle({}),
+                          door=DBPIckle({'row': 0, 'column': 0}),
+                          player_start=DBPIckle({'x': 0, 'y': 0}))
+    self.assertRaises(LayoutError, LevelLayout, old_level)
+
+  def testTruncatedBlobIsRefused(self):
+    blob = EncodeLayout({}, {}, {'row': 0, 'column': 1}, {'x': 0, 'y': 0})
+    self.assertRaises(LayoutError, DecodeLayout, blob[:-1])
+    self.assertRaises(LayoutError, DecodeLayout, blob[:3])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,88 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Per-user index of level names, maintained whenever a level is saved.
+
+Every user-built Level has a small UserLevelName entity under the same key
+name, so checking whether a user already has a level is a single get, and
+the home page can list names a page at a time without loading full levels.
+Pages are keyset-paginated: the cursor is the last level name shown.
+
+Levels saved before the index existed get their entries from RebuildIndex,
+run by an admin at /_tasks/rebuild-index; until then LevelExists also looks
+for the Level itself.
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# third-party imports
+from google.appengine.ext import db
+
+# application-specific imports
+from level_preview import LevelPreviewVersion
+from models import Level
+from models import UserLevelName
+from queries import LevelNamesFor
+from queries import LevelsNamed
+
+
+DEFAULT_PAGE_SIZE = 50
+
+
+def IndexEntryFor(level):
+  """Returns the unsaved index entry for a user-built Level."""
+  return UserLevelName(key_name=Level.KeyNameFor(level.level, level.owner),
+                       owner=level.owner,
+                       level=level.level,
+                       preview=LevelPreviewVersion(level))
+
+
+def LevelExists(level_name, owner):
+  """Returns True if owner already has a level called level_name."""
+  key_name = Level.KeyNameFor(level_name, owner)
+  if UserLevelName.get_by_key_name(key_name) is not None:
+    return True
+  # Levels saved before the index may have no entry yet
+  return bool(LevelsNamed(level_name, owner, limit=1))
+
+
+def ListLevelNames(owner, after=None, page_size=DEFAULT_PAGE_SIZE):
+  """Returns one page of the index entries of owner's levels, in name order.
+
+  Args:
+    owner: users.User whose levels to list
+    after: level name the previous page ended with, or None for the first
+    page_size: maximum number of names to return
+
+  Returns:
+    (entries, next_after) where entries are UserLevelName entities and
+    next_after is the value of after for the next page, or None if this is
+    the last one.
+  """
+  entries = LevelNamesFor(owner, after=after, limit=page_size + 1)
+  if len(entries) > page_size:
+    return entries[:page_size], entries[page_size - 1].level
+  return entries, None
+
+
+def RebuildIndex(batch_size=100):
+  """Writes index entries for every user-built level; safe to rerun.
+
+  Only needed once for levels saved before the index existed.
+
+  Returns:
+    Number of index entries written.
+  """
+  query = Level.all()
+  total = 0
+  while True:
+    levels = query.fetch(batch_size)
+    entries = [IndexEntryFor(level) for level in levels
+               if level.owner is not None]
+    if entries:
+      db.put(entries)
+      total += len(entries)
+    if len(levels) < batch_size:
+      return total
+    query.with_cursor(query.cursor())
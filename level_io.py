@@ -0,0 +1,249 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Streaming bulk import and export of levels as JSON lines.
+
+Each line holds one level:
+
+  {"level": "1", "next_level": "2", "owner": null, "base_rows": 4,
+   "static_blocks": {"7": [4, 5]}, "move_blocks": {"2": [4]},
+   "door": {"row": 4, "column": 23}, "player_start": {"x": 256, "y": 320}}
+
+owner is the builder's email, or null for curated levels. Optional keys are
+next_level, entity_size, canvas_width_blocks, canvas_height_blocks,
+step_size, min_moves and public (true to list a user-built level in the
+public catalog).
+
+Levels are written in batches with a single db.put each, under key names
+derived from owner and level name, so importing the same file twice leaves
+one copy of every level.
+
+Usage against a deployed app (needs remote_api, see app.yaml):
+
+  python level_io.py --host=iap-hello-world.appspot.com import levels.jsonl
+  python level_io.py --host=iap-hello-world.appspot.com export > levels.jsonl
+  python level_io.py --host=iap-hello-world.appspot.com delete-legacy
+
+The stock levels are seeded separately, after delete-legacy, by posting to
+/_tasks/load-stock-levels as an admin (see load_levels.py).
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# standard library imports
+import getpass
+import optparse
+import sys
+import time
+
+try:
+  import json
+except ImportError:
+  from django.utils import simplejson as json
+
+# third-party imports
+from google.appengine.api import users
+from google.appengine.ext import db
+
+# application-specific imports
+from level_cache import InvalidateLevel
+from level_catalog import SummaryFor
+from level_codec import EncodeLayout
+from level_codec import LevelLayout
+from level_index import IndexEntryFor
+from level_preview import PreviewFor
+from models import Level
+
+
+DEFAULT_BATCH_SIZE = 100
+_OPTIONAL_FIELDS = ('entity_size', 'canvas_width_blocks',
+                    'canvas_height_blocks', 'step_size', 'min_moves')
+
+
+def _IntKeys(blocks):
+  """JSON object keys are strings; block layouts are keyed by column."""
+  result = {}
+  for column, rows in blocks.iteritems():
+    result[int(column)] = [int(row) for row in rows]
+  return result
+
+
+def LevelFromRecord(record):
+  """Builds an unsaved Level with a deterministic key from a record."""
+  owner = record.get('owner')
+  if owner:
+    owner = users.User(owner)
+  else:
+    owner = None
+
+  kwargs = {}
+  for field in _OPTIONAL_FIELDS:
+    if record.get(field) is not None:
+      kwargs[field] = int(record[field])
+  width = kwargs.get('canvas_width_blocks', 24)
+  height = kwargs.get('canvas_height_blocks', 10)
+
+  door = record['door']
+  player_start = record['player_start']
+  layout = EncodeLayout(_IntKeys(record['static_blocks']),
+                        _IntKeys(record['move_blocks']),
+                        {'row': int(door['row']),
+                         'column': int(door['column'])},
+                        {'x': int(player_start['x']),
+                         'y': int(player_start['y'])},
+                        width=width, height=height)
+  return Level(key_name=Level.KeyNameFor(record['level'], owner),
+               owner=owner,
+               level=record['level'],
+               next_level=record.get('next_level') or '',
+               base_rows=int(record['base_rows']),
+               layout=layout,
+               public=bool(owner and record.get('public')),
+               **kwargs)
+
+
+def RecordFromLevel(level):
+  """Returns the JSON-serializable record for a stored Level."""
+  record = LevelLayout(level)
+  record.update({'level': level.level,
+                 'next_level': level.next_level,
+                 'owner': level.owner and level.owner.email(),
+                 'base_rows': level.base_rows,
+                 'public': bool(level.public)})
+  for field in _OPTIONAL_FIELDS:
+    record[field] = getattr(level, field)
+  return record
+
+
+def PutLevels(levels):
+  """Writes Level entities and everything derived from them in one batch.
+
+  That is index entries, catalog summaries and previews; the written levels
+  are also dropped from the level caches.
+  """
+  user_levels = [level for level in levels if level.owner is not None]
+  db.put(levels +
+         [PreviewFor(level) for level in levels] +
+         [IndexEntryFor(level) for level in user_levels] +
+         [SummaryFor(level) for level in user_levels if level.public])
+  for level in levels:
+    InvalidateLevel(level.level, level.owner)
+
+
+def ImportLevels(lines, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+  """Imports levels from an iterable of JSON lines.
+
+  Args:
+    lines: iterable of JSON strings, e.g. an open file; blank lines and lines
+           starting with # are skipped
+    batch_size: number of levels written per db.put
+    progress: optional callable, passed the running total after each batch
+
+  Returns:
+    Number of levels written.
+  """
+  batch = []
+  total = 0
+  for line in lines:
+    line = line.strip()
+    if not line or line.startswith('#'):
+      continue
+    batch.append(LevelFromRecord(json.loads(line)))
+    if len(batch) >= batch_size:
+      PutLevels(batch)
+      total += len(batch)
+      batch = []
+      if progress is not None:
+        progress(total)
+  if batch:
+    PutLevels(batch)
+    total += len(batch)
+    if progress is not None:
+      progress(total)
+  return total
+
+
+def ExportLevels(out, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+  """Writes every level to out as JSON lines, paging with query cursors.
+
+  Returns:
+    Number of levels written.
+  """
+  query = Level.all()
+  total = 0
+  while True:
+    levels = query.fetch(batch_size)
+    for level in levels:
+      out.write(json.dumps(RecordFromLevel(level), sort_keys=True))
+      out.write('\n')
+    total += len(levels)
+    if progress is not None and levels:
+      progress(total)
+    if len(levels) < batch_size:
+      return total
+    query.with_cursor(query.cursor())
+
+
+def DeleteLegacyLevels(batch_size=DEFAULT_BATCH_SIZE, progress=None):
+  """Deletes levels stored under numeric ids, from before deterministic keys.
+
+  Export first; importing the export afterwards restores them under
+  deterministic keys.
+
+  Returns:
+    Number of levels deleted.
+  """
+  query = Level.all(keys_only=True)
+  total = 0
+  while True:
+    keys = query.fetch(batch_size)
+    legacy = [key for key in keys if key.name() is None]
+    if legacy:
+      db.delete(legacy)
+      total += len(legacy)
+      if progress is not None:
+        progress(total)
+    if len(keys) < batch_size:
+      return total
+    query.with_cursor(query.cursor())
+
+
+def _ConfigureRemoteApi(host):
+  from google.appengine.ext.remote_api import remote_api_stub
+
+  def AuthFunc():
+    return (raw_input('Email: '), getpass.getpass('Password: '))
+
+  remote_api_stub.ConfigureRemoteApi(None, '/_ah/remote_api', AuthFunc, host)
+
+
+def main(argv):
+  parser = optparse.OptionParser(
+      usage='%prog --host=HOST (import FILE | export | delete-legacy)')
+  parser.add_option('--host', help='app to connect to through remote_api')
+  parser.add_option('--batch_size', type='int', default=DEFAULT_BATCH_SIZE)
+  options, args = parser.parse_args(argv[1:])
+  if not options.host or not args:
+    parser.error('a host and a command are required')
+
+  _ConfigureRemoteApi(options.host)
+  start = time.time()
+
+  def Progress(total):
+    sys.stderr.write('%d levels (%.1f/s)\n'
+                     % (total, total / max(time.time() - start, 1e-6)))
+
+  command = args[0]
+  if command == 'import' and len(args) == 2:
+    ImportLevels(open(args[1]), options.batch_size, Progress)
+  elif command == 'export':
+    ExportLevels(sys.stdout, options.batch_size, Progress)
+  elif command == 'delete-legacy':
+    DeleteLegacyLevels(options.batch_size, Progress)
+  else:
+    parser.error('unknown command %s' % ' '.join(args))
+
+
+if __name__ == '__main__':
+  main(sys.argv)
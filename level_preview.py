@@ -0,0 +1,235 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Small PNG previews of levels.
+
+A preview is drawn from a level's layout in the colors of game_play.html,
+CELL_SIZE pixels per block, and encoded as a palette PNG with nothing but
+zlib and struct. Previews are rendered when a level is written (by
+BuildLevel.post or level_io) and stored as a LevelPreview under the Level's
+key name; a few hundred bytes each.
+
+Preview URLs name the level like /play links do and carry a version hashed
+from the layout, which UserLevelName and PublicLevel entries store, so pages
+can link previews from data they already have and the images can be cached
+forever: a changed level gets a new URL. After a PREVIEW_FORMAT bump,
+/_tasks/rebuild-previews redraws every stored preview.
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# standard library imports
+import array
+import hashlib
+import struct
+import time
+import zlib
+
+# third-party imports
+from google.appengine.ext import db
+
+# application-specific imports
+from level_cache import DecodeLevel
+from level_cache import GetLevel
+from lru import LRUCache
+from models import Level
+from models import LevelPreview
+
+
+PREVIEW_FORMAT = 1  # bump when the drawing changes, to change every URL
+CELL_SIZE = 6  # pixels per block
+LOCAL_TTL = 600  # seconds
+LOCAL_MAX_ENTRIES = 500
+# Least time between datastore reads for a cached preview asked for with
+# another version, so made-up versions can't force a read per request
+RECHECK_INTERVAL = 60  # seconds
+
+# Palette indices; colors from game_play.html, block.js and the sprites
+SKY, OUTLINE, BLUE, RED, GREEN, YELLOW, DOOR, PLAYER = range(8)
+PALETTE = ((0x87, 0xCE, 0xFA),
+           (0x00, 0x00, 0x00),
+           (0x33, 0x69, 0xE8),
+           (0xD5, 0x0F, 0x25),
+           (0x00, 0x99, 0x25),
+           (0xEE, 0xB2, 0x11),
+           (0x00, 0x00, 0x00),
+           (0xA4, 0xC6, 0x39))
+_STATIC_COLORS = (BLUE, RED, GREEN)  # STATIC_COLORS in block.js
+
+_PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+
+_local_cache = LRUCache(LOCAL_MAX_ENTRIES, ttl=LOCAL_TTL)
+_stock_versions = {}
+
+
+def _Chunk(chunk_type, data):
+  checksum = zlib.crc32(chunk_type + data) & 0xFFFFFFFF
+  return (struct.pack('>I', len(data)) + chunk_type + data +
+          struct.pack('>I', checksum))
+
+
+def EncodePng(pixels, width, height, palette=PALETTE):
+  """Encodes an 8-bit palette image as PNG.
+
+  Args:
+    pixels: array.array('B') of palette indices, row by row from the top
+    width: image width in pixels
+    height: image height in pixels
+    palette: sequence of (red, green, blue) tuples
+
+  Returns:
+    The PNG file as a string.
+  """
+  header = struct.pack('>IIBBBBB', width, height, 8, 3, 0, 0, 0)
+  colors = ''.join([struct.pack('BBB', *color) for color in palette])
+  scanlines = []
+  for top in range(0, width * height, width):
+    scanlines.append('\x00')  # filter type None
+    scanlines.append(pixels[top:top + width].tostring())
+  return (_PNG_SIGNATURE +
+          _Chunk('IHDR', header) +
+          _Chunk('PLTE', colors) +
+          _Chunk('IDAT', zlib.compress(''.join(scanlines), 9)) +
+          _Chunk('IEND', ''))
+
+
+class _Canvas(object):
+  """Palette pixels of a level, with rows counted from the bottom."""
+
+  def __init__(self, width_blocks, height_blocks, cell_size):
+    self.cell_size = cell_size
+    self.width = width_blocks * cell_size
+    self.height = height_blocks * cell_size
+    self.pixels = array.array('B', [SKY]) * (self.width * self.height)
+
+  def FillCells(self, column, row, color, columns=1, rows=1, outline=True):
+    """Fills a rectangle of cells whose bottom left cell is (column, row)."""
+    size = self.cell_size
+    left = column * size
+    right = min(left + columns * size, self.width)
+    top = self.height - (row + rows) * size
+    bottom = self.height - row * size
+    for y in range(max(top, 0), min(bottom, self.height)):
+      edge_row = outline and (y == top or y == bottom - 1)
+      for x in range(max(left, 0), right):
+        if edge_row or (outline and (x == left or x == right - 1)):
+          self.pixels[y * self.width + x] = OUTLINE
+        else:
+          self.pixels[y * self.width + x] = color
+
+
+def RenderPreview(level, cell_size=CELL_SIZE):
+  """Draws a decoded level (see level_cache.DecodeLevel) as a PNG string."""
+  width = level['canvas_width_blocks']
+  height = level['canvas_height_blocks']
+  canvas = _Canvas(width, height, cell_size)
+
+  for column in range(width):
+    for row in range(level['base_rows']):
+      canvas.FillCells(column, row, _STATIC_COLORS[(row + column) % 3])
+  for column, rows in level['static_blocks'].iteritems():
+    for row in rows:
+      canvas.FillCells(int(column), row,
+                       _STATIC_COLORS[(row + int(column)) % 3])
+  for column, rows in level['move_blocks'].iteritems():
+    for row in rows:
+      canvas.FillCells(int(column), row, YELLOW)
+
+  door = level['door']
+  canvas.FillCells(door['column'], door['row'], DOOR, rows=2, outline=False)
+  entity_size = level['entity_size']
+  player = level['player_start']
+  canvas.FillCells(player['x'] // entity_size,
+                   height - 1 - player['y'] // entity_size, PLAYER,
+                   outline=False)
+  return EncodePng(canvas.pixels, canvas.width, canvas.height)
+
+
+def PreviewVersion(level):
+  """Returns a short hash of everything a decoded level's preview shows."""
+  blocks = []
+  for kind in ('static_blocks', 'move_blocks'):
+    blocks.append(sorted([(int(column), sorted(rows))
+                          for column, rows in level[kind].iteritems()]))
+  door = level['door']
+  player = level['player_start']
+  drawn = (PREVIEW_FORMAT, level['base_rows'], level['canvas_width_blocks'],
+           level['canvas_height_blocks'], level['entity_size'], blocks,
+           (door['row'], door['column']), (player['x'], player['y']))
+  return hashlib.md5(repr(drawn)).hexdigest()[:10]
+
+
+def LevelPreviewVersion(level):
+  """Returns the preview version of a Level entity."""
+  return PreviewVersion(DecodeLevel(level))
+
+
+def StockPreviewVersion(level_name):
+  """Returns the preview version of a stock level, or None if missing."""
+  version = _stock_versions.get(level_name)
+  if version is None:
+    decoded = GetLevel(level_name)
+    if decoded is None:
+      return None
+    # Stock levels never change while an instance is up
+    version = _stock_versions[level_name] = PreviewVersion(decoded)
+  return version
+
+
+def PreviewFor(level):
+  """Returns the unsaved LevelPreview for a Level."""
+  decoded = DecodeLevel(level)
+  return LevelPreview(key_name=Level.KeyNameFor(level.level, level.owner),
+                      owner=level.owner,
+                      version=PreviewVersion(decoded),
+                      png=db.Blob(RenderPreview(decoded)))
+
+
+def GetPreview(level_name, owner=None, version=None):
+  """Returns the LevelPreview of a level, or None if there is no such level.
+
+  Previews are cached in process; a request for a version other than the
+  cached one goes to the datastore in case the level has changed, at most
+  once per RECHECK_INTERVAL, and otherwise gets the cached preview. Levels
+  saved before previews existed get theirs rendered and stored here.
+
+  Args:
+    level_name: value of Level.level
+    owner: users.User who built the level, or None for the stock levels
+    version: version the caller expects, from its index entry or summary
+  """
+  key_name = Level.KeyNameFor(level_name, owner)
+  cached = _local_cache.get(key_name)
+  if cached is not None:
+    preview, loaded_at = cached
+    if (not version or preview.version == version or
+        time.time() - loaded_at < RECHECK_INTERVAL):
+      return preview
+  preview = LevelPreview.get_by_key_name(key_name)
+  if preview is None:
+    level = Level.get_by_key_name(key_name)
+    if level is None:
+      return None
+    preview = PreviewFor(level)
+    preview.put()
+  _local_cache.set(key_name, (preview, time.time()))
+  return preview
+
+
+def RebuildPreviews(batch_size=100):
+  """Renders and writes the preview of every level; safe to rerun.
+
+  Returns:
+    Number of previews written.
+  """
+  query = Level.all()
+  total = 0
+  while True:
+    levels = query.fetch(batch_size)
+    if levels:
+      db.put([PreviewFor(level) for level in levels])
+      total += len(levels)
+    if len(levels) < batch_size:
+      return total
+    query.with_cursor(query.cursor())
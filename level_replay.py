@@ -0,0 +1,481 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Headless replay of recorded games, to confirm level completions.
+
+Simulation is a pixel-for-pixel port of javascripts/player.js and block.js
+driven by the update loop in game_play.html, so a trace of the keys held on
+each frame leads the server to exactly the position the browser reached.
+Unlike level_solver, nothing is abstracted: the player moves step_size
+pixels per frame, falls step_size pixels per frame and so on.
+
+Blocks are held in two flat arrays with one cell per (column, row): a static
+flag and a count of moveable blocks, which is what the $.inArray lookups on
+staticBlocks and moveBlocks amount to. Only the carried block needs its own
+position.
+
+A trace is the action taken on each frame, run-length encoded as an action
+character followed by a number of frames, e.g. 'r40s1.3l12':
+
+  .  no key          u  up (pickup)      d  down (putdown)
+  s  space (jump)    l  left             r  right
+
+Confirmed completions are kept as LevelCompletion entities, one per user and
+level holding the fastest trace.
+
+Large numbers of traces can be verified with VerifyBatch, which spreads them
+over a process pool where multiprocessing is available (not on App Engine):
+
+  python level_replay.py --host=iap-hello-world.appspot.com reports.jsonl
+
+where each line of reports.jsonl is
+{"level": "3", "owner": null, "trace": "r40s1..."}. owner is what
+game_play.html posts as LEVEL_OWNER: the builder's user id, or empty for the
+stock levels. As in LevelComplete, a builder's level is found through its
+catalog summary, so only public levels can be replayed in a batch.
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# standard library imports
+import array
+import getpass
+import optparse
+import re
+import sys
+
+try:
+  import json
+except ImportError:
+  from django.utils import simplejson as json
+
+# third-party imports
+from google.appengine.ext import db
+
+# application-specific imports
+from level_cache import DecodeLevel
+from level_catalog import FindPublicLevel
+from models import Level
+from models import LevelCompletion
+
+
+FPS = 30  # frames per second of the game loop in game_play.html
+MAX_FRAMES = 30 * 60 * FPS  # half an hour of play
+# Rows above the canvas a carried block or a jump check can look at
+GRID_MARGIN = 3
+# Below this many traces VerifyBatch doesn't bother starting processes
+POOL_THRESHOLD = 200
+
+IDLE, PICKUP, PUTDOWN, JUMP, LEFT, RIGHT = '.', 'u', 'd', 's', 'l', 'r'
+ACTIONS = (IDLE, PICKUP, PUTDOWN, JUMP, LEFT, RIGHT)
+_TRACE_RUN = re.compile(r'([.udslr])(\d+)')
+
+# Fields of a decoded level (see level_cache.DecodeLevel) a replay needs
+GEOMETRY_FIELDS = ('entity_size', 'canvas_width_blocks',
+                   'canvas_height_blocks', 'step_size', 'base_rows',
+                   'static_blocks', 'move_blocks', 'door', 'player_start')
+
+
+class TraceError(Exception):
+  """Raised when a trace is malformed or too long."""
+
+
+def ParseTrace(trace, max_frames=MAX_FRAMES):
+  """Returns a trace as a list of (action, frames) runs.
+
+  Raises:
+    TraceError: if the trace is not a sequence of runs or is longer than
+                max_frames in total.
+  """
+  runs = []
+  total = 0
+  position = 0
+  for match in _TRACE_RUN.finditer(trace):
+    if match.start() != position:
+      break
+    frames = int(match.group(2))
+    total += frames
+    if total > max_frames:
+      raise TraceError('Trace is longer than %d frames' % max_frames)
+    runs.append((match.group(1), frames))
+    position = match.end()
+  if position != len(trace):
+    raise TraceError('Malformed trace at character %d' % position)
+  return runs
+
+
+def Geometry(level):
+  """Returns only the fields of a decoded level a Simulation uses.
+
+  The result is small and picklable, for sending to worker processes.
+  """
+  return dict((field, level[field]) for field in GEOMETRY_FIELDS)
+
+
+class Simulation(object):
+  """State of one game of a level, advanced a frame at a time."""
+
+  def __init__(self, level):
+    """Sets up the level as game_play.html does.
+
+    Args:
+      level: decoded level, as returned by level_cache.GetLevel or Geometry
+    """
+    self.size = level['entity_size']
+    self.step_size = level['step_size']
+    self.width = level['canvas_width_blocks']
+    self.canvas_width = self.width * self.size
+    self.canvas_height = level['canvas_height_blocks'] * self.size
+    self.base_rows = level['base_rows']
+    self.grid_height = level['canvas_height_blocks'] + GRID_MARGIN
+
+    cells = self.width * self.grid_height
+    self.static = array.array('B', [0]) * cells
+    self.move = array.array('B', [0]) * cells
+    for column, rows in level['static_blocks'].iteritems():
+      for row in rows:
+        self.static[self._Cell(int(column), row)] = 1
+    for column, rows in level['move_blocks'].iteritems():
+      for row in rows:
+        self.move[self._Cell(int(column), row)] += 1
+
+    self.door_row = level['door']['row']
+    self.door_column = level['door']['column']
+    self.x = level['player_start']['x']
+    self.y = level['player_start']['y']
+    self.freefall = False
+    self.facing = RIGHT
+    # Carried block as [x, y, solo_freefall], None when empty handed
+    self.block = None
+    self.frames = 0
+
+  def _Cell(self, column, row):
+    if not (0 <= column < self.width and 0 <= row < self.grid_height):
+      raise TraceError('Block left the board at column %d, row %d'
+                       % (column, row))
+    return column * self.grid_height + row
+
+  def _Static(self, column, row):
+    if 0 <= column < self.width and 0 <= row < self.grid_height:
+      return self.static[column * self.grid_height + row]
+    return 0
+
+  def _Move(self, column, row):
+    if 0 <= column < self.width and 0 <= row < self.grid_height:
+      return self.move[column * self.grid_height + row]
+    return 0
+
+  def _Blocked(self, column, row):
+    return self._Static(column, row) or self._Move(column, row)
+
+  def _Row(self):
+    """Player.row_: the row the player stands in, or -1 between rows."""
+    above_floor = self.canvas_height - (self.y + self.size)
+    if above_floor % self.size != 0:
+      return -1
+    return above_floor // self.size
+
+  def _NextColumn(self, step_size):
+    """Player.nextColumn_: column of the leading edge after step_size."""
+    if self.facing == LEFT:
+      return (self.x - step_size) // self.size
+    return -(-(self.x + step_size) // self.size)  # ceiling
+
+  def _FallTo(self, column, y):
+    """Shared by Player.fall and Block.fall.
+
+    Returns:
+      (new y, row landed in), where the row is None while still falling.
+    """
+    bottom = self.canvas_height - (y + self.size)
+    destination_row = (bottom - self.step_size) // self.size
+    if destination_row < self.base_rows:
+      return (self.canvas_height - self.size - self.base_rows * self.size,
+              destination_row + 1)
+    if self._Blocked(column, destination_row):
+      return (self.canvas_height - self.size -
+              (destination_row + 1) * self.size, destination_row + 1)
+    return y + self.step_size, None
+
+  def Step(self, direction):
+    """Player.step."""
+    self.facing = direction
+    size = self.size
+    row = self._Row()
+    if row == -1:
+      return
+
+    delta = -self.step_size if direction == LEFT else self.step_size
+    current_column = self._NextColumn(0)
+    new_column = self._NextColumn(self.step_size)
+    if current_column == new_column:
+      self.x += delta
+    elif (self._Blocked(new_column, row) or
+          (self.block is not None and self._Static(new_column, row + 1))):
+      self.x = current_column * size
+    elif row == self.base_rows or self._Blocked(new_column, row - 1):
+      self.x += delta
+    else:
+      self.x = new_column * size
+      self.freefall = True
+
+    if self.x < 0:
+      self.x = 0
+    elif self.x + size > self.canvas_width:
+      self.x = self.canvas_width - size
+    if self.block is not None:
+      self.block[0] = self.x
+
+  def Fall(self):
+    """Player.fall."""
+    if self.x % self.size != 0:
+      return
+    self.y, landed_row = self._FallTo(self.x // self.size, self.y)
+    if landed_row is not None:
+      self.freefall = False
+    if self.block is not None:
+      self.block[1] = self.y - self.size
+
+  def _FacedColumn(self):
+    """Returns (row, current column, faced column) or None if unaligned."""
+    row = self._Row()
+    if row == -1 or self.x % self.size != 0:
+      return None
+    column = self.x // self.size
+    faced = column + (-1 if self.facing == LEFT else 1)
+    return row, column, faced
+
+  def Jump(self):
+    """Player.jump, including the checks of Player.canJump_."""
+    aligned = self._FacedColumn()
+    if aligned is None:
+      return
+    row, column, faced = aligned
+    if self._Static(column, row + 1) or not self._Blocked(faced, row):
+      return
+    if (self._Blocked(faced, row + 1) or
+        (self.block is not None and self._Static(faced, row + 2))):
+      return
+
+    self.x = faced * self.size
+    self.y = self.canvas_height - (row + 2) * self.size
+    if self.block is not None:
+      self.block[0] = self.x
+      self.block[1] = self.y - self.size
+
+  def Pickup(self):
+    """Player.pickup, including the checks of Player.canPickup_."""
+    if self.block is not None:
+      return
+    aligned = self._FacedColumn()
+    if aligned is None:
+      return
+    row, column, faced = aligned
+    if self._Static(column, row + 1) or not self._Move(faced, row):
+      return
+    if self._Blocked(faced, row + 1):
+      return
+
+    self.block = [self.x, self.y - self.size, False]
+    self.move[self._Cell(faced, row)] -= 1
+
+  def Putdown(self):
+    """Player.putdown, including the checks of Player.canPutdown_."""
+    if self.block is None:
+      return
+    row = self._Row()
+    if row == -1:
+      return
+    target = self._NextColumn(self.size)
+    if target < 0 or target * self.size >= self.canvas_width:
+      return
+    if self._Blocked(target, row) or self._Static(target, row + 1):
+      return
+
+    self.block[0] = target * self.size
+    self.block[1] = self.canvas_height - (row + 1) * self.size
+    self.block[2] = True
+
+  def BlockFall(self):
+    """Block.fall for the block the player has just put down."""
+    block = self.block
+    if block[0] % self.size != 0:
+      return
+    column = block[0] // self.size
+    block[1], landed_row = self._FallTo(column, block[1])
+    if landed_row is not None:
+      self.block = None
+      self.move[self._Cell(column, landed_row)] += 1
+
+  def Idle(self):
+    """Returns True if a frame with no key held would change nothing."""
+    return not self.freefall and not (self.block is not None and
+                                      self.block[2])
+
+  def Update(self, action):
+    """Advances one frame of update() in game_play.html."""
+    self.frames += 1
+    if self.freefall:
+      self.Fall()
+    elif self.block is not None and self.block[2]:
+      self.BlockFall()
+    elif action == PICKUP:
+      self.Pickup()
+    elif action == PUTDOWN:
+      self.Putdown()
+    elif action == JUMP:
+      self.Jump()
+    elif action == LEFT or action == RIGHT:
+      self.Step(action)
+
+  def Run(self, runs):
+    """Plays (action, frames) runs as returned by ParseTrace."""
+    for action, frames in runs:
+      while frames:
+        if action == IDLE and self.Idle():
+          self.frames += frames
+          break
+        self.Update(action)
+        frames -= 1
+
+  def Reached(self):
+    """Player.reached: True if the player is standing in the doorway."""
+    x_displace = abs(self.x - self.door_column * self.size)
+    y_displace = abs(self.y + self.size + self.door_row * self.size -
+                     self.canvas_height)
+    return x_displace < self.step_size and y_displace == 0
+
+
+def VerifyTrace(level, trace, max_frames=MAX_FRAMES):
+  """Replays a trace and reports whether it ends in the doorway.
+
+  Args:
+    level: decoded level, as returned by level_cache.GetLevel or Geometry
+    trace: run-length encoded trace, see the module docstring
+    max_frames: longest trace accepted
+
+  Returns:
+    (completed, frames): completed is False for malformed traces.
+  """
+  try:
+    runs = ParseTrace(trace, max_frames=max_frames)
+    simulation = Simulation(level)
+    simulation.Run(runs)
+  except TraceError:
+    return False, 0
+  return simulation.Reached(), simulation.frames
+
+
+def RecordCompletion(user, level_key_name, frames, trace):
+  """Stores a confirmed completion, keeping each user's fastest per level.
+
+  Returns:
+    True if this completion was stored.
+  """
+  key_name = LevelCompletion.KeyNameFor(user, level_key_name)
+
+  def Txn():
+    best = LevelCompletion.get_by_key_name(key_name)
+    if best is not None and best.frames <= frames:
+      return False
+    LevelCompletion(key_name=key_name, user=user,
+                    level_key_name=level_key_name, frames=frames,
+                    trace=trace).put()
+    return True
+  return db.run_in_transaction(Txn)
+
+
+def _VerifyJob(job):
+  level, trace = job
+  return VerifyTrace(level, trace)
+
+
+def VerifyBatch(jobs, processes=None, pool_threshold=POOL_THRESHOLD):
+  """Verifies many (level, trace) pairs, in parallel when worthwhile.
+
+  Args:
+    jobs: list of (level, trace); pass levels through Geometry so they are
+          cheap to send to worker processes
+    processes: size of the process pool, defaults to the number of CPUs
+    pool_threshold: minimum number of jobs for which a pool is used
+
+  Returns:
+    List of (completed, frames) in the same order as jobs.
+  """
+  if len(jobs) >= pool_threshold and processes != 1:
+    try:
+      import multiprocessing
+    except ImportError:
+      multiprocessing = None
+    if multiprocessing is not None:
+      processes = processes or multiprocessing.cpu_count()
+      pool = multiprocessing.Pool(processes)
+      try:
+        chunk_size = max(1, len(jobs) // (4 * processes))
+        return pool.map(_VerifyJob, jobs, chunk_size)
+      finally:
+        pool.close()
+        pool.join()
+  return [_VerifyJob(job) for job in jobs]
+
+
+def _ConfigureRemoteApi(host):
+  from google.appengine.ext.remote_api import remote_api_stub
+
+  def AuthFunc():
+    return (raw_input('Email: '), getpass.getpass('Password: '))
+
+  remote_api_stub.ConfigureRemoteApi(None, '/_ah/remote_api', AuthFunc, host)
+
+
+def _LoadJobs(lines):
+  """Reads reports, fetching each distinct level once."""
+  geometries = {}
+  owners = {}
+  jobs = []
+  for line in lines:
+    line = line.strip()
+    if not line or line.startswith('#'):
+      continue
+    report = json.loads(line)
+    level_name, owner_id = report['level'], report.get('owner')
+    owner = None
+    if owner_id:
+      if (level_name, owner_id) not in owners:
+        summary = FindPublicLevel(level_name, owner_id)
+        owners[level_name, owner_id] = summary and summary.owner
+      owner = owners[level_name, owner_id]
+      if owner is None:
+        sys.stderr.write('No public level %s by %s\n' % (level_name,
+                                                          owner_id))
+        continue
+    key_name = Level.KeyNameFor(level_name, owner)
+    if key_name not in geometries:
+      level = Level.get_by_key_name(key_name)
+      geometries[key_name] = level and Geometry(DecodeLevel(level))
+    if geometries[key_name] is not None:
+      jobs.append((geometries[key_name], report['trace']))
+    else:
+      sys.stderr.write('No level %s\n' % key_name)
+  return jobs
+
+
+def main(argv):
+  parser = optparse.OptionParser(usage='%prog --host=HOST REPORTS_FILE')
+  parser.add_option('--host', help='app to connect to through remote_api')
+  parser.add_option('--processes', type='int', default=None)
+  options, args = parser.parse_args(argv[1:])
+  if not options.host or len(args) != 1:
+    parser.error('a host and a reports file are required')
+
+  _ConfigureRemoteApi(options.host)
+  jobs = _LoadJobs(open(args[0]))
+  results = VerifyBatch(jobs, processes=options.processes)
+  completed = len([result for result in results if result[0]])
+  sys.stdout.write('%d of %d traces complete their level\n'
+                   % (completed, len(results)))
+
+
+if __name__ == '__main__':
+  main(sys.argv)
@@ -0,0 +1,236 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Server-side solvability check for level layouts.
+
+Models the mechanics of javascripts/player.js and block.js on whole grid
+cells rather than pixels:
+
+  step:    turn to face left or right and move one column if nothing is in
+           the way; stepping off a ledge falls to the next surface below
+  jump:    climb onto the block being faced if it is clear above
+  pickup:  lift the moveable block being faced if nothing is on top of it
+  putdown: drop the carried block into the column being faced, where it
+           falls to the next surface below
+
+In the browser the player moves in pixel steps, but pickup and jump are only
+possible once a bump has aligned the player with a column, and putdown and
+reaching the door depend only on the column the player's leading edge is in.
+Tracking the player by that column loses no reachable positions.
+
+The search is a breadth-first search over states packed into a single
+integer (moveable block bitmask, player cell, facing and carrying bits), so
+the first time the door is reached gives the minimal number of key presses.
+States already seen are kept per moveable block layout, as a bitset of the
+player bits, which takes a small fraction of the memory of a set of states.
+
+Stock-sized boards can take millions of states, so BuildLevel.post only
+searches INLINE_MAX_NODES states, a budget that doesn't depend on machine
+load, and leaves anything bigger to a task searching DEFERRED_MAX_NODES.
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# standard library imports
+import time
+
+
+SOLVABLE = 'solvable'
+UNSOLVABLE = 'unsolvable'
+UNKNOWN = 'unknown'  # search budget ran out
+
+INLINE_MAX_NODES = 50000  # about half a second
+DEFERRED_MAX_NODES = 5000000
+DEFERRED_TIME_LIMIT = 540  # seconds; tasks are cancelled after 600
+
+LEFT, RIGHT = 0, 1
+_DIRECTIONS = (-1, 1)
+
+
+class SolveResult(object):
+  """Outcome of a solvability check."""
+
+  def __init__(self, status, moves=None, nodes=0, seconds=0.0):
+    self.status = status
+    self.moves = moves  # minimal number of key presses when solvable
+    self.nodes = nodes
+    self.seconds = seconds
+
+  def __repr__(self):
+    return 'SolveResult(%r, moves=%r, nodes=%r)' % (self.status, self.moves,
+                                                    self.nodes)
+
+
+class LevelSolver(object):
+  """Breadth-first solver for one level layout."""
+
+  def __init__(self, base_rows, static_blocks, move_blocks, door,
+               player_start, width=24, height=10, entity_size=64):
+    """Builds the solver's view of a level.
+
+    Args:
+      base_rows: number of full rows at the bottom of the board
+      static_blocks: dictionary of column -> list of rows with static blocks
+      move_blocks: dictionary of column -> list of rows with moveable blocks
+      door: dictionary with integer 'row' and 'column' keys
+      player_start: dictionary with integer 'x' and 'y' keys, in pixels
+      width: canvas width in blocks
+      height: canvas height in blocks
+      entity_size: size of a block in pixels
+    """
+    self.base_rows = base_rows
+    self.width = width
+    self.height = height
+    self.static = self._Mask(static_blocks)
+    self.start_moveable = self._Mask(move_blocks)
+    self.door = (door['column'], door['row'])
+    self.start = (player_start['x'] // entity_size,
+                  height - 1 - player_start['y'] // entity_size)
+    # Bits below the moveable mask: player cell, facing and carrying
+    cell_bits = 1
+    while (1 << cell_bits) < width * height:
+      cell_bits += 1
+    self._shift = cell_bits + 2
+    self._low_mask = (1 << self._shift) - 1
+
+  def _Mask(self, blocks):
+    mask = 0
+    for column, rows in blocks.iteritems():
+      for row in rows:
+        mask |= 1 << (column * self.height + row)
+    return mask
+
+  def _Landing(self, occupied, cell, row):
+    """Returns (cell, row) where something dropped into cell comes to rest."""
+    base_rows = self.base_rows
+    while row > base_rows:
+      if occupied & (1 << (cell - 1)):
+        return cell, row
+      cell -= 1
+      row -= 1
+    return cell - row + base_rows, base_rows
+
+  def Successors(self, state):
+    """Returns the states after every key press that changes something.
+
+    A state packs the moveable block bitmask above the player's cell index
+    (column * height + row), facing bit and carrying bit.
+    """
+    height = self.height
+    shift = self._shift
+    moveable = state >> shift
+    carrying = state & 1
+    facing = (state >> 1) & 1
+    cell = (state & self._low_mask) >> 2
+    column, row = divmod(cell, height)
+    static = self.static
+    occupied = static | moveable
+    high = moveable << shift
+    # Nothing can be above the top row; guard so bits don't spill into the
+    # bottom of the next column
+    has_above = row + 1 < height
+    successors = []
+
+    # Step left or right
+    for direction, target_column in ((LEFT, column - 1),
+                                     (RIGHT, column + 1)):
+      target = cell + (target_column - column) * height
+      if (target_column < 0 or target_column >= self.width or
+          occupied >> target & 1 or
+          (carrying and has_above and static >> (target + 1) & 1)):
+        if direction != facing:
+          successors.append(high | (cell << 2) | (direction << 1) | carrying)
+        continue
+      target, _ = self._Landing(occupied, target, row)
+      successors.append(high | (target << 2) | (direction << 1) | carrying)
+
+    target_column = column + _DIRECTIONS[facing]
+    if target_column < 0 or target_column >= self.width:
+      return successors
+    target = cell + _DIRECTIONS[facing] * height
+    head_clear = not (has_above and static >> (cell + 1) & 1)
+    target_filled = occupied >> target & 1
+    above_target_filled = has_above and occupied >> (target + 1) & 1
+
+    # Jump onto the block being faced
+    if (head_clear and target_filled and not above_target_filled and
+        not (carrying and row + 2 < height and
+             static >> (target + 2) & 1)):
+      successors.append(high | ((target + 1) << 2) | (facing << 1) |
+                        carrying)
+
+    if carrying:
+      # Put the block down in the column being faced
+      if (not target_filled and
+          not (has_above and static >> (target + 1) & 1)):
+        landing, _ = self._Landing(occupied, target, row)
+        successors.append(((moveable | (1 << landing)) << shift) |
+                          (cell << 2) | (facing << 1))
+    elif (head_clear and moveable >> target & 1 and
+          not above_target_filled):
+      # Pick up the moveable block being faced
+      successors.append(((moveable & ~(1 << target)) << shift) |
+                        (cell << 2) | (facing << 1) | 1)
+    return successors
+
+  def Solve(self, max_nodes=INLINE_MAX_NODES, time_limit=None):
+    """Searches for the shortest way to the door.
+
+    Args:
+      max_nodes: maximum number of distinct states to expand
+      time_limit: maximum number of seconds to search for, or None
+
+    Returns:
+      SolveResult; status is UNKNOWN if the budget ran out first.
+    """
+    start_time = time.time()
+    deadline = None
+    if time_limit is not None:
+      deadline = start_time + time_limit
+    door_column, door_row = self.door
+    door_cell = door_column * self.height + door_row
+    start_column, start_row = self.start
+    if self.start == self.door:
+      return SolveResult(SOLVABLE, 0, 1, time.time() - start_time)
+    start = ((self.start_moveable << self._shift) |
+             ((start_column * self.height + start_row) << 2) | (RIGHT << 1))
+
+    shift = self._shift
+    low_mask = self._low_mask
+    successors = self.Successors
+    # moveable block bitmask -> bitset of the player bits seen with it
+    seen = {start >> shift: 1 << (start & low_mask)}
+    frontier = [start]
+    moves = 0
+    nodes = 0
+    while frontier:
+      moves += 1
+      next_frontier = []
+      for state in frontier:
+        nodes += 1
+        if nodes > max_nodes or (deadline is not None and
+                                 nodes & 1023 == 0 and
+                                 time.time() > deadline):
+          return SolveResult(UNKNOWN, None, nodes, time.time() - start_time)
+        for successor in successors(state):
+          moveable = successor >> shift
+          bit = 1 << (successor & low_mask)
+          seen_bits = seen.get(moveable, 0)
+          if seen_bits & bit:
+            continue
+          if (successor & low_mask) >> 2 == door_cell:
+            return SolveResult(SOLVABLE, moves, nodes,
+                               time.time() - start_time)
+          seen[moveable] = seen_bits | bit
+          next_frontier.append(successor)
+      frontier = next_frontier
+    return SolveResult(UNSOLVABLE, None, nodes, time.time() - start_time)
+
+
+def SolveLayout(base_rows, layout, width=24, height=10, **budget):
+  """Convenience wrapper for a layout as returned by level_codec."""
+  solver = LevelSolver(base_rows, layout['static_blocks'],
+                       layout['move_blocks'], layout['door'],
+                       layout['player_start'], width=width, height=height)
+  return solver.Solve(**budget)
@@ -0,0 +1,94 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Tests for level_solver against the stock levels.
+
+Run with python -m unittest level_solver_test; the solver needs no SDK.
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# standard library imports
+import os
+import unittest
+
+try:
+  import json
+except ImportError:
+  from django.utils import simplejson as json
+
+# application-specific imports
+from level_solver import DEFERRED_MAX_NODES
+from level_solver import INLINE_MAX_NODES
+from level_solver import SOLVABLE
+from level_solver import SolveLayout
+from level_solver import UNKNOWN
+from level_solver import UNSOLVABLE
+
+
+STOCK_LEVELS_FILE = os.path.join(os.path.dirname(__file__),
+                                 'stock_levels.jsonl')
+
+
+def _IntKeys(blocks):
+  """Converts the string column keys of a JSON record to ints."""
+  result = {}
+  for column, rows in blocks.items():
+    result[int(column)] = [int(row) for row in rows]
+  return result
+
+
+def StockLevels():
+  """Returns (record, layout) for each stock level, in level order."""
+  levels = []
+  stock_file = open(STOCK_LEVELS_FILE)
+  try:
+    for line in stock_file:
+      if not line.strip():
+        continue
+      record = json.loads(line)
+      layout = {'static_blocks': _IntKeys(record['static_blocks']),
+                'move_blocks': _IntKeys(record['move_blocks']),
+                'door': record['door'],
+                'player_start': record['player_start']}
+      levels.append((record, layout))
+  finally:
+    stock_file.close()
+  levels.sort(key=lambda level: level[0]['level'])
+  return levels
+
+
+class StockLevelsTest(unittest.TestCase):
+
+  def testEveryStockLevelSolvesInMinMoves(self):
+    levels = StockLevels()
+    self.assertEqual(5, len(levels))
+    for record, layout in levels:
+      result = SolveLayout(record['base_rows'], layout,
+                           max_nodes=DEFERRED_MAX_NODES)
+      self.assertEqual(SOLVABLE, result.status,
+                       'level %s: %r' % (record['level'], result))
+      self.assertEqual(record['min_moves'], result.moves,
+                       'level %s: %r' % (record['level'], result))
+
+  def testInlineBudgetDefersLargeLevels(self):
+    record, layout = StockLevels()[-1]
+    result = SolveLayout(record['base_rows'], layout)
+    self.assertEqual(UNKNOWN, result.status)
+    self.assertTrue(result.nodes >= INLINE_MAX_NODES)
+
+  def testBlockedDoorIsUnsolvable(self):
+    record, layout = StockLevels()[0]
+    door = layout['door']
+    # wall the door in on both sides, up to the top of the board
+    static_blocks = dict(layout['static_blocks'])
+    for column in (door['column'] - 1, door['column'] + 1):
+      static_blocks[column] = range(10)
+    layout['static_blocks'] = static_blocks
+    result = SolveLayout(record['base_rows'], layout)
+    self.assertEqual(UNSOLVABLE, result.status)
+
+
+if __name__ == '__main__':
+  unittest.main()
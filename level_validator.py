@@ -0,0 +1,114 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Occupancy-grid validation of user-built level layouts.
+
+The whole board is held in a single integer bitmask, column-major, with
+height bits per column: cell (column, row) is bit column * height + row.
+Overlap, hovering and collision checks are then a handful of bitwise
+operations over the whole grid instead of list membership tests per block.
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+
+class ValidationError(Exception):
+  """Raised with a user-facing message when a layout is invalid."""
+
+
+class LayoutValidator(object):
+  """Validates level layouts for a board of a given size in blocks."""
+
+  def __init__(self, width=24, height=10):
+    self.width = width
+    self.height = height
+    self.max_column = width - 1
+    self.max_row = height - 1
+    self._bands = {}
+
+  def Cell(self, column, row):
+    """Returns the bit for a single grid cell."""
+    return 1 << (column * self.height + row)
+
+  def GridMask(self, blocks):
+    """Returns the bitmask for a {column: [rows]} dictionary."""
+    mask = 0
+    height = self.height
+    for column, rows in blocks.iteritems():
+      base = column * height
+      for row in rows:
+        mask |= 1 << (base + row)
+    return mask
+
+  def RowBand(self, rows):
+    """Returns a mask with the bottom rows of every column set."""
+    mask = self._bands.get(rows)
+    if mask is None:
+      band = (1 << rows) - 1
+      mask = 0
+      for column in range(self.width):
+        mask |= band << (column * self.height)
+      self._bands[rows] = mask
+    return mask
+
+  def Validate(self, base_rows, static, moveable, door, player):
+    """Checks a layout, raising ValidationError on the first problem found.
+
+    Args:
+      base_rows: number of full rows at the bottom of the board
+      static: dictionary of column -> list of rows with static blocks
+      moveable: dictionary of column -> list of rows with moveable blocks
+      door: (column, row) of the bottom half of the door
+      player: (column, row) of the player's starting position
+
+    Returns:
+      Dictionary with the static, moveable and occupied bitmasks.
+    """
+    if base_rows < 0 or base_rows > self.max_row:
+      raise ValidationError('%s is invalid for rows at bottom of screen'
+                            % base_rows)
+
+    static_mask = self.GridMask(static)
+    move_mask = self.GridMask(moveable)
+    if static_mask & move_mask:
+      raise ValidationError('Moveable and Static Blocks can\'t occupy '
+                            'the same place')
+
+    # A block is supported if it sits at or below the base rows or has a
+    # block directly beneath it. Shifting by one moves each cell up a row;
+    # the top of a column spills into row 0 of the next, which is always in
+    # the base band anyway.
+    occupied = static_mask | move_mask
+    supported = (occupied << 1) | self.RowBand(base_rows + 1)
+    if move_mask & ~supported:
+      raise ValidationError('Moveable can\'t hover')
+
+    door_column, door_row = door
+    # Door must be on screen;
+    # Door has height of 2 blocks, so can't start in the top row
+    if (door_row < base_rows or door_row > self.max_row - 1 or
+        door_column < 0 or door_column > self.max_column):
+      raise ValidationError('Door out of bounds')
+    door_mask = self.Cell(door_column, door_row) * 3
+    if door_mask & static_mask:
+      raise ValidationError('Door conflicts with Static Blocks')
+    if door_mask & move_mask:
+      raise ValidationError('Door conflicts with Moveable Blocks')
+
+    player_column, player_row = player
+    if (player_row < base_rows or player_row > self.max_row or
+        player_column < 0 or player_column > self.max_column):
+      raise ValidationError('Player out of bounds')
+    # Player *CAN* start in the door if the creator wants it
+    player_mask = self.Cell(player_column, player_row)
+    if player_mask & static_mask:
+      raise ValidationError('Player conflicts with Static Blocks')
+    if player_mask & move_mask:
+      raise ValidationError('Player conflicts with Moveable Blocks')
+    if player_row != base_rows and not (player_mask >> 1) & occupied:
+      raise ValidationError('Player must start grounded')
+
+    return {'static': static_mask,
+            'moveable': move_mask,
+            'occupied': occupied}
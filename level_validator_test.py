@@ -0,0 +1,152 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Tests for level_validator against the checks BuildLevel.post used to make.
+
+BaselineErrors is the list-based validation BuildLevel.post ran before
+LayoutValidator, kept here as the reference. Run with
+python -m unittest level_validator_test; the validator needs no SDK.
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# standard library imports
+import random
+import sys
+import unittest
+
+# application-specific imports
+from level_validator import LayoutValidator
+from level_validator import ValidationError
+
+
+MAX_COLUMN = 23
+MAX_ROW = 9
+
+
+def BaselineErrors(base_rows, static, moveable, door, player):
+  """Returns the messages the old BuildLevel.post could have sent first.
+
+  The old block checks ran in dictionary order, so any overlap or hover
+  problem could be the one reported; every other check has one answer.
+  Returns [] for a valid layout.
+  """
+  if base_rows < 0 or base_rows > MAX_ROW:
+    return ['%s is invalid for rows at bottom of screen' % base_rows]
+
+  block_errors = set()
+  for column, row_list in moveable.iteritems():
+    destination = static.get(column, [])
+    for row in row_list:
+      if row in destination:
+        block_errors.add('Moveable and Static Blocks can\'t occupy '
+                         'the same place')
+      elif row > base_rows:
+        if row - 1 not in row_list + destination:
+          block_errors.add('Moveable can\'t hover')
+  if block_errors:
+    return sorted(block_errors)
+
+  door_column, door_row = door
+  if (door_row < base_rows or door_row > MAX_ROW - 1 or
+      door_column < 0 or door_column > MAX_COLUMN):
+    return ['Door out of bounds']
+  if door_column in static:
+    if (door_row in static[door_column] or
+        door_row + 1 in static[door_column]):
+      return ['Door conflicts with Static Blocks']
+  # The old elif skipped this when the column also had static blocks;
+  # LayoutValidator always checks it
+  if door_column in moveable:
+    if (door_row in moveable[door_column] or
+        door_row + 1 in moveable[door_column]):
+      return ['Door conflicts with Moveable Blocks']
+
+  player_column, player_row = player
+  if (player_row < base_rows or player_row > MAX_ROW or
+      player_column < 0 or player_column > MAX_COLUMN):
+    return ['Player out of bounds']
+  if player_column in static and player_row in static[player_column]:
+    return ['Player conflicts with Static Blocks']
+  elif player_column in moveable and player_row in moveable[player_column]:
+    return ['Player conflicts with Moveable Blocks']
+  if player_row != base_rows:
+    below = static.get(player_column, []) + moveable.get(player_column, [])
+    if player_row - 1 not in below:
+      return ['Player must start grounded']
+  return []
+
+
+def RandomBlocks(rng, base_rows, count):
+  """Returns {column: [rows]} with count blocks, mostly stacked."""
+  blocks = {}
+  for _ in range(count):
+    column = rng.randint(0, MAX_COLUMN)
+    rows = blocks.setdefault(column, [])
+    if rows and rng.random() < 0.8:
+      row = min(max(rows) + 1, MAX_ROW)
+    else:
+      row = rng.randint(base_rows, min(base_rows + 2, MAX_ROW))
+    if row not in rows:
+      rows.append(row)
+  return blocks
+
+
+def RandomLayout(rng):
+  """Returns arguments for Validate, valid often enough to be useful."""
+  base_rows = rng.randint(0, 6)
+  static = RandomBlocks(rng, base_rows, rng.randint(0, 12))
+  moveable = RandomBlocks(rng, base_rows, rng.randint(0, 8))
+  door = (rng.randint(-1, MAX_COLUMN + 1),
+          rng.randint(base_rows - 1, MAX_ROW))
+  player = (rng.randint(-1, MAX_COLUMN + 1),
+            rng.choice([base_rows, base_rows + 1, rng.randint(0, MAX_ROW)]))
+  return base_rows, static, moveable, door, player
+
+
+class LayoutValidatorTest(unittest.TestCase):
+
+  def setUp(self):
+    self.validator = LayoutValidator()
+
+  def Error(self, *layout):
+    try:
+      self.validator.Validate(*layout)
+    except ValidationError:
+      return str(sys.exc_info()[1])
+    return None
+
+  def testMatchesBaselineOnRandomLayouts(self):
+    rng = random.Random(20111006)
+    accepted = 0
+    for _ in range(20000):
+      layout = RandomLayout(rng)
+      expected = BaselineErrors(*layout)
+      error = self.Error(*layout)
+      if not expected:
+        self.assertEqual(None, error, 'rejected %r: %s' % (layout, error))
+        accepted += 1
+      else:
+        self.assertTrue(error in expected,
+                        '%r: %s not in %r' % (layout, error, expected))
+    # Otherwise the comparison says little about valid layouts
+    self.assertTrue(accepted > 500, accepted)
+
+  def testDoorOnMoveableBlockInColumnWithStaticBlocks(self):
+    # Accepted by the old elif chain
+    error = self.Error(0, {5: [3]}, {5: [0]}, (5, 0), (1, 0))
+    self.assertEqual('Door conflicts with Moveable Blocks', error)
+
+  def testBaseRowsOutOfRange(self):
+    self.assertEqual('10 is invalid for rows at bottom of screen',
+                     self.Error(10, {}, {}, (23, 0), (0, 0)))
+
+  def testPlayerGroundedOnMoveableBlock(self):
+    self.assertEqual(None, self.Error(0, {}, {3: [0]}, (23, 0), (3, 1)))
+    self.assertEqual('Player must start grounded',
+                     self.Error(0, {}, {3: [0]}, (23, 0), (4, 1)))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,106 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Small in-process LRU cache used by the request-path caches."""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# standard library imports
+import time
+
+
+# Indices into the linked list entries
+_PREV, _NEXT, _KEY, _VALUE, _EXPIRES = 0, 1, 2, 3, 4
+
+
+class LRUCache(object):
+  """Bounded mapping which evicts the least recently used entry.
+
+  Entries live in a circular doubly linked list with a sentinel root, so get,
+  set and eviction are all O(1). An optional ttl (in seconds) can be given
+  per cache or per entry; expired entries are treated as missing.
+  """
+
+  def __init__(self, max_entries, ttl=None):
+    self.max_entries = max_entries
+    self.ttl = ttl
+    self._map = {}
+    self._root = root = []
+    root[:] = [root, root, None, None, None]
+    self.hits = 0
+    self.misses = 0
+
+  def __len__(self):
+    return len(self._map)
+
+  def __contains__(self, key):
+    return self.get(key) is not None
+
+  def _Unlink(self, entry):
+    entry[_PREV][_NEXT] = entry[_NEXT]
+    entry[_NEXT][_PREV] = entry[_PREV]
+
+  def _LinkLast(self, entry):
+    root = self._root
+    last = root[_PREV]
+    entry[_PREV] = last
+    entry[_NEXT] = root
+    last[_NEXT] = root[_PREV] = entry
+
+  def get(self, key, default=None):
+    """Returns the value for key and marks it most recently used."""
+    entry = self._map.get(key)
+    if entry is None:
+      self.misses += 1
+      return default
+    if entry[_EXPIRES] is not None and entry[_EXPIRES] <= time.time():
+      self._Unlink(entry)
+      del self._map[key]
+      self.misses += 1
+      return default
+    self._Unlink(entry)
+    self._LinkLast(entry)
+    self.hits += 1
+    return entry[_VALUE]
+
+  def set(self, key, value, ttl=None):
+    """Stores value under key, evicting the oldest entry if full."""
+    if ttl is None:
+      ttl = self.ttl
+    expires = None if ttl is None else time.time() + ttl
+
+    entry = self._map.get(key)
+    if entry is not None:
+      self._Unlink(entry)
+      entry[_VALUE] = value
+      entry[_EXPIRES] = expires
+    else:
+      if len(self._map) >= self.max_entries:
+        oldest = self._root[_NEXT]
+        self._Unlink(oldest)
+        del self._map[oldest[_KEY]]
+      entry = [None, None, key, value, expires]
+      self._map[key] = entry
+    self._LinkLast(entry)
+
+  def pop(self, key, default=None):
+    """Removes key and returns its value, or default if not present."""
+    entry = self._map.pop(key, None)
+    if entry is None:
+      return default
+    self._Unlink(entry)
+    return entry[_VALUE]
+
+  def clear(self):
+    """Removes every entry."""
+    root = self._root
+    root[:] = [root, root, None, None, None]
+    self._map.clear()
+
+  def Stats(self):
+    """Returns a dictionary of size and hit/miss counters."""
+    return {'entries': len(self._map),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses}
@@ -7,29 +7,90 @@
 __author__ = 'dhermes@google.com (Danny Hermes)'
 
 # standard library imports
-import os
-import pickle
+import logging
+import sys
 import time
 
+_import_started = time.time()
+
+try:
+  import json
+except ImportError:
+  from django.utils import simplejson as json
+
 # third-party imports
+from google.appengine.api import taskqueue
 from google.appengine.api import users
 from google.appengine.ext import db
 from google.appengine.ext import webapp
-from google.appengine.ext.webapp import template
 from google.appengine.ext.webapp.util import run_wsgi_app
 import jwt
 
 # application-specific imports
+# level_replay, level_solver and sales serve one handler each and are
+# imported there, off the cold start path; warmup.py preloads them
+from compression import GzipMiddleware
+from constants import CATALOG
 from constants import OPEN_ID_PROVIDERS
+from entitlements import ChangeCounter
+from entitlements import EntitlementsVersion
+from entitlements import GetEntitlements
+from entitlements import HasPurchased
+from entitlements import InvalidateEntitlements
+from instrumentation import RecordTiming
+from instrumentation import Snapshot
+from instrumentation import StatsMiddleware
+from level_catalog import BrowseLevels
+from level_catalog import FindPublicLevel
+from level_catalog import FindPlayableLevel
+from level_catalog import RebuildCatalog
+from level_catalog import SetPublic
+from level_catalog import SummaryFor
+from level_cache import InvalidateLevel
+from level_cache import LevelCacheStats
+from level_codec import EncodeLayout
+from level_codec import LevelLayout
+from level_index import IndexEntryFor
+from level_index import LevelExists
+from level_index import ListLevelNames
+from level_index import RebuildIndex
+from level_preview import GetPreview
+from level_preview import PreviewFor
+from level_preview import RebuildPreviews
+from level_preview import StockPreviewVersion
+from level_validator import LayoutValidator
+from level_validator import ValidationError
 from models import Level
-from models import PurchasedItem
+from purchase_queue import DrainPurchases
+from purchase_queue import EnqueuePurchase
+from purchase_queue import PurchaseFromPostback
+from purchase_tokens import GetPurchaseToken
+from purchase_tokens import TokenCacheStats
+from queries import PurchaseKeysFor
+from rate_limits import AdmissionMiddleware
+from rate_limits import AdmissionStats
+from rendering import RenderStats
+from rendering import RenderTemplate
+from rendering import WriteCachedPage
 from sellerinfo import SELLER_ID
 from sellerinfo import SELLER_SECRET
+from warmup import RecordStartup
+from warmup import StartupTimings
+from warmup import WarmUp
 
 
-def DBPIckle(value):
-  """Returns anative python pickled and consumable by the GAE datastore."""
-  return db.Text(pickle.dumps(value))
+LAYOUT_VALIDATOR = LayoutValidator()
+# Longest a poll of /api/entitlements is held waiting for a purchase; each
+# waiting poll ties up a whole single-threaded instance, so clients wait
+# between polls on their own side instead
+ENTITLEMENTS_MAX_WAIT = 1  # seconds
+ENTITLEMENTS_POLL_INTERVAL = 0.5  # seconds
+# Versioned preview URLs never change content; unversioned ones may
+PREVIEW_MAX_AGE = 365 * 24 * 3600  # seconds
+PREVIEW_UNVERSIONED_MAX_AGE = 60  # seconds
+# Levels too big to solve while the builder waits, see SolveLevelTask
+SOLVE_QUEUE = 'level-solve'
+SOLVE_URL = '/_tasks/solve-level'
 
 
 class MainHandler(webapp.RequestHandler):
@@ -49,66 +110,34 @@ class MainHandler(webapp.RequestHandler):
       display_name = user.email()
       sign_out = users.create_logout_url(self.request.uri)
 
-      now = int(time.time())
-      now_plus_one = now + 3600
       identity = user.federated_identity()
+      owned = GetEntitlements(identity)
+
+      # Purchase token for every item the user doesn't own yet; '' otherwise
+      tokens = {}
+      for item_name, price in CATALOG:
+        if item_name in owned:
+          tokens[item_name] = ''
+        else:
+          tokens[item_name] = GetPurchaseToken(identity, item_name, price)
+      levels_token = tokens['Levels']
+      sprite_token = tokens['Sprite']
+      builder_token = tokens['Builder']
+      source_token = tokens['Source']
+      can_purchase = any(tokens.values())
+
+      level_names = ['1']
+      if 'Levels' in owned:
+        level_names.extend(['2', '3', '4', '5'])
+      levels = [{'level': level_name,
+                 'preview': StockPreviewVersion(level_name)}
+                for level_name in level_names]
 
-      request_info = {'currencyCode': 'USD',
-                      'sellerData': identity}
-      basic_jwt_info = {'iss': SELLER_ID,
-                        'aud': 'Google',
-                        'typ': 'google/payments/inapp/item/v1',
-                        'iat': now,
-                        'exp': now_plus_one,
-                        'request': request_info}
-
-      # Start off assuming the user has bought everything there is to buy
-      can_purchase = False
-
-      # Check every possible item to see if user has purchased
-      levels_purchased = PurchasedItem.gql(("WHERE federated_identity = '%s' "
-                                            "AND item_name = '%s'") %
-                                           (identity, 'Levels'))
-      levels = ['1']
-      levels_token = ''
-      if levels_purchased.count() > 0:
-        levels.extend(['2', '3', '4', '5'])
-      else:
-        can_purchase = True
-        request_info.update({'name': 'Levels', 'price': '0.50'})
-        levels_token = jwt.encode(basic_jwt_info, SELLER_SECRET)
-
-      sprite_purchased = PurchasedItem.gql(("WHERE federated_identity = '%s' "
-                                            "AND item_name = '%s'") %
-                                           (identity, 'Sprite'))
-      sprite_token = ''
-      if sprite_purchased.count() == 0:
-        can_purchase = True
-        request_info.update({'name': 'Sprite', 'price': '0.50'})
-        sprite_token = jwt.encode(basic_jwt_info, SELLER_SECRET)
-
-      builder_purchased = PurchasedItem.gql(("WHERE federated_identity = '%s' "
-                                             "AND item_name = '%s'") %
-                                            (identity, 'Builder'))
       user_levels = []
-      builder_token = ''
-      if builder_purchased.count() == 0:
-        can_purchase = True
-        request_info.update({'name': 'Builder', 'price': '2.00'})
-        builder_token = jwt.encode(basic_jwt_info, SELLER_SECRET)
-      else:
-        level_query = Level.gql("WHERE owner = USER('%s')" % user.email())
-        for level in level_query:
-          user_levels.append(level.level)
-
-      source_purchased = PurchasedItem.gql(("WHERE federated_identity = '%s' "
-                                            "AND item_name = '%s'") %
-                                           (identity, 'Source'))
-      source_token = ''
-      if source_purchased.count() == 0:
-        can_purchase = True
-        request_info.update({'name': 'Source', 'price': '8.00'})
-        source_token = jwt.encode(basic_jwt_info, SELLER_SECRET)
+      user_levels_next = None
+      if 'Builder' in owned:
+        user_levels, user_levels_next = ListLevelNames(
+            user, after=self.request.get('levels_after', None))
 
       no_purchases = (levels_token and sprite_token and
                       builder_token and source_token)
@@ -117,12 +146,14 @@ class MainHandler(webapp.RequestHandler):
                        'sign_out': sign_out,
                        'levels': levels,
                        'user_levels': user_levels,
+                       'user_levels_next': user_levels_next,
                        'levels_jwt': levels_token,
                        'sprite_jwt': sprite_token,
                        'builder_jwt': builder_token,
                        'source_jwt': source_token,
                        'can_purchase': can_purchase,
-                       'no_purchases': no_purchases}
+                       'no_purchases': no_purchases,
+                       'entitlements_version': EntitlementsVersion(owned)}
     else:
       # let user choose authenticator
       continue_url = self.request.GET.get('continue', None)
@@ -140,8 +171,7 @@ class MainHandler(webapp.RequestHandler):
                        'user_continue': continue_url,
                        'providers': providers}
 
-    path = os.path.join(os.path.dirname(__file__), 'templates', 'index.html')
-    self.response.out.write(template.render(path, template_vals))
+    self.response.out.write(RenderTemplate('index.html', template_vals))
 
   def post(self):
     """Handles post requests."""
@@ -150,10 +180,8 @@ class MainHandler(webapp.RequestHandler):
     logged_in = (user is not None)
     if logged_in:
       identity = user.federated_identity()
-      purchases = PurchasedItem.gql(
-          ("WHERE federated_identity = '%s'" % identity))
-      for purchase in purchases:
-        purchase.delete()
+      db.delete(PurchaseKeysFor(identity))
+      InvalidateEntitlements(identity)
     self.redirect('/')
 
 
@@ -163,78 +191,85 @@ class Play(webapp.RequestHandler):
   def get(self):
     """Handles get requests."""
     level_name = self.request.get('level')
+    owner_id = self.request.get('owner')
+    user = users.get_current_user()
 
-    curr_level = Level.gql("WHERE level = '%s'" % level_name)
-    if curr_level.count() != 1:
+    # Stock levels have no owner; anything else must belong to this user or
+    # be in the public catalog
+    curr_level, owner = FindPlayableLevel(level_name, user, owner_id)
+    if curr_level is None:
       message = 'Level %s not found' % level_name
       template_vals = {'can_play': False,
                        'message': message}
-      path = os.path.join(os.path.dirname(__file__),
-                          'templates',
-                          'game_play.html')
-      self.response.out.write(template.render(path, template_vals))
+      self.response.out.write(RenderTemplate('game_play.html', template_vals))
       return
 
-    curr_level = curr_level.get()
-    user = users.get_current_user()
-    next_level = curr_level.next_level  # To disable
-    if curr_level.owner is None:
-      levels_purchased = PurchasedItem.gql(("WHERE federated_identity = '%s' "
-                                            "AND item_name = '%s'") %
-                                           (user.federated_identity(),
-                                            'Levels'))
-      if not levels_purchased.count():
-        if level_name != '1':
-          message = 'You don\'t have access to Level %s' % level_name
-          template_vals = {'can_play': False,
-                           'message': message}
-          path = os.path.join(os.path.dirname(__file__),
-                              'templates',
-                              'game_play.html')
-          self.response.out.write(template.render(path, template_vals))
-          return
-        else:
-          next_level = ''
-    elif curr_level.owner != user:
-      message = 'You don\'t have access to Level %s' % level_name
-      template_vals = {'can_play': False,
-                       'message': message}
-      path = os.path.join(os.path.dirname(__file__),
-                          'templates',
-                          'game_play.html')
-      self.response.out.write(template.render(path, template_vals))
-      return
+    next_level = curr_level['next_level']  # To disable
+    owned = GetEntitlements(user.federated_identity())
+    if curr_level['owner'] is None and 'Levels' not in owned:
+      if level_name != '1':
+        message = 'You don\'t have access to Level %s' % level_name
+        template_vals = {'can_play': False,
+                         'message': message}
+        self.response.out.write(RenderTemplate('game_play.html', template_vals))
+        return
+      else:
+        next_level = ''
+
+    sprite = 'translate_robot-lb64' if 'Sprite' in owned else 'android-64'
 
-    sprite_purchased = PurchasedItem.gql(("WHERE federated_identity = '%s' "
-                                          "AND item_name = '%s'") %
-                                         (user.federated_identity(),
-                                          'Sprite'))
-    sprite = ('translate_robot-lb64'
-              if sprite_purchased.count() else 'android-64')
-
-    static_blocks = pickle.loads(str(curr_level.static_blocks))
-    move_blocks = pickle.loads(str(curr_level.move_blocks))
-    player_start = pickle.loads(str(curr_level.player_start))
-    door = pickle.loads(str(curr_level.door))
-    # pickle outputs str and expects it back, though app engine
-    # stores and returns from the DB as unicode
     template_vals = {'can_play': True,
-                     'entity_size': curr_level.entity_size,
-                     'canvas_height_blocks': curr_level.canvas_height_blocks,
-                     'canvas_width_blocks': curr_level.canvas_width_blocks,
-                     'step_size': curr_level.step_size,
+                     'entity_size': curr_level['entity_size'],
+                     'canvas_height_blocks':
+                         curr_level['canvas_height_blocks'],
+                     'canvas_width_blocks': curr_level['canvas_width_blocks'],
+                     'step_size': curr_level['step_size'],
                      'sprite': sprite,
-                     'base_blocks': curr_level.base_rows,
-                     'player_start': player_start,
-                     'door': door,
-                     'static_blocks': static_blocks,
-                     'move_blocks': move_blocks,
-                     'next_level': next_level}
+                     'base_blocks': curr_level['base_rows'],
+                     'player_start': curr_level['player_start'],
+                     'door': curr_level['door'],
+                     'static_blocks': curr_level['static_blocks'],
+                     'move_blocks': curr_level['move_blocks'],
+                     'next_level': next_level,
+                     # A JavaScript string literal, safe inside <script>
+                     'level_name': json.dumps(level_name).replace('</',
+                                                                  '<\\/'),
+                     'level_owner': json.dumps(owner and owner.user_id() or
+                                               '').replace('</', '<\\/')}
+
+    self.response.out.write(RenderTemplate('game_play.html', template_vals))
+
+
+class LevelComplete(webapp.RequestHandler):
+  """Confirms a completed level by replaying the keys the player pressed.
+
+  game_play.html posts the level name and a trace of the action taken on
+  every frame (see level_replay) when the player reaches the door.
+  """
+
+  def post(self):
+    """Handles post requests."""
+    level_name = self.request.get('level')
+    trace = self.request.get('trace')
+    user = users.get_current_user()
+
+    curr_level, owner = FindPlayableLevel(level_name, user,
+                                          self.request.get('owner'))
+
+    completed, frames = False, 0
+    if curr_level is not None and (
+        owner is not None or level_name == '1' or
+        HasPurchased(user.federated_identity(), 'Levels')):
+      from level_replay import RecordCompletion
+      from level_replay import VerifyTrace
+      completed, frames = VerifyTrace(curr_level, trace)
+      if completed:
+        RecordCompletion(user, Level.KeyNameFor(level_name, owner), frames,
+                         trace)
 
-    path = os.path.join(os.path.dirname(__file__),
-                        'templates',
-                        'game_play.html')
-    self.response.out.write(template.render(path, template_vals))
+    self.response.headers['Content-Type'] = 'application/json'
+    self.response.out.write(json.dumps({'completed': completed,
+                                        'frames': frames}))
 
 
 class BuildLevel(webapp.RequestHandler):
@@ -294,180 +329,215 @@ class BuildLevel(webapp.RequestHandler):
   def get(self):
     """Handles get requests."""
     user = users.get_current_user()
-    builder_purchased = PurchasedItem.gql(("WHERE federated_identity = '%s' "
-                                           "AND item_name = '%s'") %
-                                          (user.federated_identity(),
-                                           'Builder'))
-    can_build = (builder_purchased.count() > 0)
+    can_build = HasPurchased(user.federated_identity(), 'Builder')
     denial_message = ('' if can_build else
                       'You don\'t have access to the Level Builder')
     template_vals = {'can_build': can_build,
                      'message': denial_message,
                      'error': False}
 
-    path = os.path.join(os.path.dirname(__file__),
-                        'templates',
-                        'build_level.html')
-    self.response.out.write(template.render(path, template_vals))
+    self.response.out.write(RenderTemplate('build_level.html', template_vals))
 
   def SendError(self, message, can_build):
     """Helper function to send error on invalid post."""
     template_vals = {'can_build': can_build,
                      'message': message,
                      'error': True}
-    path = os.path.join(os.path.dirname(__file__),
-                        'templates',
-                        'build_level.html')
-    self.response.out.write(template.render(path, template_vals))
+    self.response.out.write(RenderTemplate('build_level.html', template_vals))
 
   def post(self):
     """Handles post requests."""
     user = users.get_current_user()
-    builder_purchased = PurchasedItem.gql(("WHERE federated_identity = '%s' "
-                                           "AND item_name = '%s'") %
-                                          (user.federated_identity(),
-                                           'Builder'))
-    can_build = (builder_purchased.count() > 0)
+    can_build = HasPurchased(user.federated_identity(), 'Builder')
 
     level_name = self.request.get('level')
     if level_name in ['1', '2', '3', '4', '5']:
       self.SendError('%s is already a level' % level_name, can_build)
       return
-    else:
-      existing = Level.gql("WHERE owner = USER('%s') AND level='%s'"
-                           % (user.email(), level_name))
-      if existing.count():
-        self.SendError('%s is already a level' % level_name, can_build)
-        return
-
-    # Validate base_rows
-    max_column = 23
-    max_row = 9
+    elif LevelExists(level_name, user):
+      self.SendError('%s is already a level' % level_name, can_build)
+      return
 
     base_rows = self.request.get('base_rows', None)
     try:
       base_rows = int(base_rows)
-      if base_rows < 0 or base_rows > max_row:
-        self.SendError(('%s is invalid for rows at bottom '
-                        'of screen' % base_rows), can_build)
-        return
     except (ValueError, TypeError):
       self.SendError(('%s is invalid for rows at bottom '
                       'of screen' % base_rows), can_build)
       return
 
     # Validate static
-    static = self.ParseRowsFromRequest('static')
+    static = self.ParseRowsFromRequest('static',
+                                       max_row=LAYOUT_VALIDATOR.max_row,
+                                       max_column=LAYOUT_VALIDATOR.max_column)
     if static is None:
       self.SendError(('Static Blocks invalid. Please use '
                       'integers and separate rows by commas'), can_build)
       return
 
     # Validate moveable
-    moveable = self.ParseRowsFromRequest('moveable')
+    moveable = self.ParseRowsFromRequest('moveable',
+                                         max_row=LAYOUT_VALIDATOR.max_row,
+                                         max_column=LAYOUT_VALIDATOR.max_column)
     if moveable is None:
       self.SendError(('Moveable Blocks invalid. Please use '
                       'integers and separate rows by commas'), can_build)
       return
 
-    # Update static or fail if moveable and static share blocks;
-    # also fail if a moveable block would end up hovering
-    for column, row_list in moveable.iteritems():
-      destination = static[column] if column in static else []
-      for row in row_list:
-        if row in destination:
-          self.SendError(('Moveable and Static Blocks can\'t occupy '
-                          'the same place'), can_build)
-          return
-        elif row > base_rows:  # if in row base_rows, block will be supported
-          if row - 1 not in row_list + destination:
-            self.SendError('Moveable can\'t hover', can_build)
-            return
-
-    # Validate door
-    door_column = self.request.get('door_column', '')
-    door_row = self.request.get('door_row', '')
     try:
-      door_column = int(door_column)
-      door_row = int(door_row)
-      # Door must be on screen;
-      # Door has height of 2 blocks, so can't start in the top row
-      if (door_row < base_rows or door_row > max_row - 1 or
-          door_column < 0 or door_column > max_column):
-        self.SendError('Door out of bounds', can_build)
-        return
-
-      # Door must not conflict with squares
-      if door_column in static:
-        if (door_row in static[door_column] or
-            door_row + 1 in static[door_column]):
-          self.SendError('Door conflicts with Static Blocks', can_build)
-          return
-      elif door_column in moveable:
-        if (door_row in moveable[door_column] or
-            door_row + 1 in moveable[door_column]):
-          self.SendError('Door conflicts with Moveable Blocks', can_build)
-          return
+      door_column = int(self.request.get('door_column', ''))
+      door_row = int(self.request.get('door_row', ''))
     except (ValueError, TypeError):
       self.SendError('Door values invalid', can_build)
       return
 
-    door = {'row': door_row,
-            'column': door_column}
-
-    # Validate player
-    player_column = self.request.get('player_column', '')
-    player_row = self.request.get('player_row', '')
     try:
-      player_column = int(player_column)
-      player_row = int(player_row)
-      # Player must start on screen
-      if (player_row < base_rows or player_row > max_row or
-          player_column < 0 or player_column > max_column):
-        self.SendError('Player out of bounds', can_build)
-        return
-
-      # Make sure no collisions with obstacles; though
-      # Player *CAN* start in the door if the creator wants it
-      if player_column in static and player_row in static[player_column]:
-        self.SendError('Player conflicts with Static Blocks', can_build)
-        return
-      elif player_column in moveable and player_row in moveable[player_column]:
-        self.SendError('Player conflicts with Moveable Blocks', can_build)
-        return
-
-      # Player must start on ground
-      if player_row != base_rows:
-        block_below = False
-        if player_column in static:
-          if player_row - 1 in static[player_column]:
-            block_below = True
-        if player_column in moveable:
-          if player_row - 1 in moveable[player_column]:
-            block_below = True
-
-        if not block_below:
-          self.SendError('Player must start grounded', can_build)
-          return
+      player_column = int(self.request.get('player_column', ''))
+      player_row = int(self.request.get('player_row', ''))
     except (ValueError, TypeError):
       self.SendError('Player values invalid', can_build)
       return
 
-    player_start = {'x': player_column*64,  # default entity_size
-                    'y': 64*(10 - (player_row + 1))}  # default canvas_height
+    # Overlap, hovering, door and player checks in one pass over the grid
+    try:
+      LAYOUT_VALIDATOR.Validate(base_rows, static, moveable,
+                                (door_column, door_row),
+                                (player_column, player_row))
+    except ValidationError:
+      self.SendError(str(sys.exc_info()[1]), can_build)
+      return
 
-    new_level = Level(owner=user,
+    door = {'row': door_row,
+            'column': door_column}
+    entity_size = 64  # default entity_size
+    player_start = {'x': player_column * entity_size,
+                    'y': entity_size * (LAYOUT_VALIDATOR.height -
+                                        (player_row + 1))}
+
+    # Refuse levels which can't be finished; if the search runs out of
+    # budget the level is saved and SolveLevelTask finishes the search
+    layout = {'static_blocks': static,
+              'move_blocks': moveable,
+              'door': door,
+              'player_start': player_start}
+    from level_solver import SolveLayout
+    from level_solver import UNKNOWN
+    from level_solver import UNSOLVABLE
+    solution = SolveLayout(base_rows, layout,
+                           width=LAYOUT_VALIDATOR.width,
+                           height=LAYOUT_VALIDATOR.height)
+    if solution.status == UNSOLVABLE:
+      self.SendError('Level %s can\'t be completed' % level_name, can_build)
+      return
+
+    new_level = Level(key_name=Level.KeyNameFor(level_name, user),
+                      owner=user,
                       level=level_name,
                       base_rows=base_rows,
-                      static_blocks=DBPIckle(static),
-                      move_blocks=DBPIckle(moveable),
-                      door=DBPIckle(door),
-                      player_start=DBPIckle(player_start))
-    new_level.put()
+                      canvas_width_blocks=LAYOUT_VALIDATOR.width,
+                      canvas_height_blocks=LAYOUT_VALIDATOR.height,
+                      min_moves=solution.moves,
+                      layout=EncodeLayout(static, moveable,
+                                          door, player_start,
+                                          width=LAYOUT_VALIDATOR.width,
+                                          height=LAYOUT_VALIDATOR.height))
+    entities = [new_level, IndexEntryFor(new_level), PreviewFor(new_level)]
+    if self.request.get('public'):
+      new_level.public = True
+      entities.append(SummaryFor(new_level))
+    db.put(entities)
+    InvalidateLevel(level_name, user)
+    if solution.status == UNKNOWN:
+      taskqueue.add(url=SOLVE_URL, queue_name=SOLVE_QUEUE,
+                    params={'key_name': new_level.key().name()})
 
     self.redirect('/play?level=%s' % level_name)
 
 
+class LevelBrowser(webapp.RequestHandler):
+  """Public catalog of user-built levels."""
+
+  def ShowPage(self, message=''):
+    """Renders one page of the catalog, with an optional message."""
+    search = self.request.get('q')
+    summaries, next_cursor = BrowseLevels(
+        search, cursor=self.request.get('cursor', None))
+    template_vals = {'search': search,
+                     'levels': summaries,
+                     'next_cursor': next_cursor,
+                     'message': message}
+    self.response.out.write(RenderTemplate('levels.html', template_vals))
+
+  def get(self):
+    """Handles get requests."""
+    self.ShowPage()
+
+  def post(self):
+    """Adds one of the user's levels to the catalog or takes it out."""
+    user = users.get_current_user()
+    level_name = self.request.get('level')
+    level = Level.get_by_key_name(Level.KeyNameFor(level_name, user))
+    if level is None:
+      message = 'You have no level called %s' % level_name
+    elif level.unsolvable and self.request.get('public') == '1':
+      message = 'Level %s can\'t be completed' % level_name
+    else:
+      public = self.request.get('public') == '1'
+      SetPublic(level, public)
+      message = 'Level %s is %s' % (level_name,
+                                    'public' if public else 'private')
+    self.ShowPage(message)
+
+
+class LevelPreviewImage(webapp.RequestHandler):
+  """Serves the PNG preview of a level, named as for /play.
+
+  Stock and public levels are previewed for anyone, other levels only for
+  their builder. Pages link previews with v set to the version from the
+  index entry or catalog summary, and those URLs are cached forever.
+  """
+
+  def get(self):
+    """Handles get requests."""
+    level_name = self.request.get('level')
+    owner_id = self.request.get('owner')
+    version = self.request.get('v')
+    user = users.get_current_user()
+
+    owner = None
+    shared = True
+    if owner_id:
+      if user is not None and user.user_id() == owner_id:
+        owner = user
+        shared = False  # the builder's own level may be private
+      else:
+        summary = FindPublicLevel(level_name, owner_id)
+        if summary is None:
+          self.error(404)
+          return
+        owner = summary.owner
+
+    preview = GetPreview(level_name, owner, version=version)
+    if preview is None:
+      self.error(404)
+      return
+
+    scope = 'public' if shared else 'private'
+    if version and version == preview.version:
+      self.response.headers['Cache-Control'] = '%s, max-age=%d, immutable' % (
+          scope, PREVIEW_MAX_AGE)
+    else:
+      self.response.headers['Cache-Control'] = '%s, max-age=%d' % (
+          scope, PREVIEW_UNVERSIONED_MAX_AGE)
+    etag = '"%s"' % preview.version
+    self.response.headers['ETag'] = etag
+    if self.request.headers.get('If-None-Match') == etag:
+      self.response.set_status(304)
+      return
+    self.response.headers['Content-Type'] = 'image/png'
+    self.response.out.write(preview.png)
+
+
 class PostbackVerify(webapp.RequestHandler):
   """Handler for server postback, as per recommendations.
 
@@ -493,7 +563,9 @@ class PostbackVerify(webapp.RequestHandler):
     if encoded_jwt is not None:
       # jwt.decode won't accept unicode, cast to str
       # http://github.com/progrium/pyjwt/issues/4
+      start = time.time()
       decoded_jwt = jwt.decode(str(encoded_jwt), SELLER_SECRET)
+      RecordTiming('jwt_verify', time.time() - start)
 
       # Only update datastore and respond to Google if we have all the values
       # we need. If not, the payment will not go through since the postback
@@ -506,25 +578,225 @@ class PostbackVerify(webapp.RequestHandler):
           request_info = decoded_jwt['request']
           if ('currencyCode' in request_info and 'sellerData' in request_info
               and 'name' in request_info and 'price' in request_info):
-            item = PurchasedItem(currency_code=request_info['currencyCode'],
-                                 federated_identity=request_info['sellerData'],
-                                 item_name=request_info['name'],
-                                 item_price=request_info['price'],
-                                 order_id=order_id)
-            item.put()
-
+            # Recording happens off the request; retried postbacks for a
+            # recorded order are skipped when the queue is drained
+            EnqueuePurchase(PurchaseFromPostback(order_id, request_info))
             self.response.out.write(order_id)
 
 
+class EntitlementsApi(webapp.RequestHandler):
+  """Reports the catalog items a user owns as JSON.
+
+  Meant for polling after a purchase instead of reloading the home page.
+  Sending the last ETag as If-None-Match gets a 304 while nothing changed.
+  With wait=N the request is held for up to N seconds (at most
+  ENTITLEMENTS_MAX_WAIT) until the entitlements change.
+  """
+
+  def get(self):
+    """Handles get requests."""
+    user = users.get_current_user()
+    if user is None:
+      self.error(401)
+      return
+
+    identity = user.federated_identity()
+    known_etags = [tag.strip() for tag in
+                   self.request.headers.get('If-None-Match', '').split(',')]
+    owned = GetEntitlements(identity)
+    etag = '"%s"' % EntitlementsVersion(owned)
+
+    try:
+      wait = min(float(self.request.get('wait', 0)), ENTITLEMENTS_MAX_WAIT)
+    except ValueError:
+      wait = 0
+    if wait > 0 and etag in known_etags:
+      deadline = time.time() + wait
+      counter = ChangeCounter(identity)
+      # The in-process copy may not have seen a postback on another instance
+      owned = GetEntitlements(identity, use_local_cache=False)
+      etag = '"%s"' % EntitlementsVersion(owned)
+      while etag in known_etags and time.time() < deadline:
+        time.sleep(ENTITLEMENTS_POLL_INTERVAL)
+        latest = ChangeCounter(identity)
+        if latest != counter:
+          counter = latest
+          owned = GetEntitlements(identity, use_local_cache=False)
+          etag = '"%s"' % EntitlementsVersion(owned)
+
+    self.response.headers['ETag'] = etag
+    self.response.headers['Cache-Control'] = 'private, no-cache'
+    if etag in known_etags:
+      self.response.set_status(304)
+      return
+    self.response.headers['Content-Type'] = 'application/json'
+    self.response.out.write(json.dumps({'items': sorted(owned),
+                                        'version': etag.strip('"')},
+                                       separators=(',', ':')))
+
+
+class DrainPurchaseQueue(webapp.RequestHandler):
+  """Records queued postbacks; run by the task queue and cron."""
+
+  def get(self):
+    """Handles get requests (cron)."""
+    DrainPurchases()
+
+  def post(self):
+    """Handles post requests (task queue)."""
+    DrainPurchases()
+
+
+class SolveLevelTask(webapp.RequestHandler):
+  """Finishes the solvability check BuildLevel.post ran out of budget for.
+
+  Records the minimal number of moves, or marks the level unsolvable and
+  takes it out of the catalog.
+  """
+
+  def post(self):
+    """Handles post requests (task queue)."""
+    from level_solver import DEFERRED_MAX_NODES
+    from level_solver import DEFERRED_TIME_LIMIT
+    from level_solver import SOLVABLE
+    from level_solver import SolveLayout
+    from level_solver import UNSOLVABLE
+    level = Level.get_by_key_name(self.request.get('key_name'))
+    if level is None or level.min_moves is not None:
+      return
+    solution = SolveLayout(level.base_rows, LevelLayout(level),
+                           width=level.canvas_width_blocks,
+                           height=level.canvas_height_blocks,
+                           max_nodes=DEFERRED_MAX_NODES,
+                           time_limit=DEFERRED_TIME_LIMIT)
+    logging.info('Solved %s: %r in %.1fs', level.key().name(), solution,
+                 solution.seconds)
+    if solution.status == SOLVABLE:
+      level.min_moves = solution.moves
+      entities = [level]
+      if level.public:
+        entities.append(SummaryFor(level))
+      db.put(entities)
+      InvalidateLevel(level.level, level.owner)
+    elif solution.status == UNSOLVABLE:
+      level.unsolvable = True
+      SetPublic(level, False)
+
+
+class RollupSalesTask(webapp.RequestHandler):
+  """Rolls the sales counters up into today's totals; run by cron."""
+
+  def get(self):
+    """Handles get requests (cron)."""
+    from sales import RollupSales
+    RollupSales()
+
+
+class RebuildSalesTask(webapp.RequestHandler):
+  """Recomputes the sales counters from every recorded purchase."""
+
+  def post(self):
+    """Handles post requests (task queue or an admin)."""
+    from sales import RebuildCounters
+    from sales import RollupSales
+    counted = RebuildCounters()
+    RollupSales()
+    self.response.out.write('%d purchases counted' % counted)
+
+
+class RebuildCatalogTask(webapp.RequestHandler):
+  """Rewrites the summary of every public level, e.g. after a schema change."""
+
+  def post(self):
+    """Handles post requests (task queue or an admin)."""
+    rebuilt = RebuildCatalog()
+    self.response.out.write('%d public levels rebuilt' % rebuilt)
+
+
+class RebuildIndexTask(webapp.RequestHandler):
+  """Writes the level name index entries of levels saved before it existed."""
+
+  def post(self):
+    """Handles post requests (task queue or an admin)."""
+    rebuilt = RebuildIndex()
+    self.response.out.write('%d levels indexed' % rebuilt)
+
+
+class RebuildPreviewsTask(webapp.RequestHandler):
+  """Redraws every level preview, e.g. after a PREVIEW_FORMAT change."""
+
+  def post(self):
+    """Handles post requests (task queue or an admin)."""
+    rebuilt = RebuildPreviews()
+    self.response.out.write('%d previews rebuilt' % rebuilt)
+
+
+class LoadStockLevelsTask(webapp.RequestHandler):
+  """Seeds the stock levels from stock_levels.jsonl; see load_levels.py."""
+
+  def post(self):
+    """Handles post requests (an admin)."""
+    from load_levels import LegacyStockLevelsError
+    from load_levels import LoadStockLevels
+    try:
+      loaded = LoadStockLevels()
+    except LegacyStockLevelsError:
+      self.response.set_status(409)
+      self.response.out.write('Run level_io.py delete-legacy first')
+      return
+    self.response.out.write('%d stock levels loaded' % loaded)
+
+
+class SalesReportApi(webapp.RequestHandler):
+  """Reports daily sales per item and currency as JSON; admin only."""
+
+  def get(self):
+    """Handles get requests."""
+    from sales import SalesReport
+    try:
+      days = int(self.request.get('days', 30))
+    except ValueError:
+      days = 30
+    self.response.headers['Content-Type'] = 'application/json'
+    self.response.out.write(json.dumps({'days': SalesReport(days)}))
+
+
 class Instructions(webapp.RequestHandler):
   """Instructions for gameplay."""
 
   def get(self):
     """Handles get requests."""
-    path = os.path.join(os.path.dirname(__file__),
-                        'templates',
-                        'instructions.html')
-    self.response.out.write(template.render(path, {}))
+    WriteCachedPage(self, 'instructions', 'instructions.html', {})
+
+
+class Stats(webapp.RequestHandler):
+  """Reports request timings and cache statistics as JSON; admin only."""
+
+  def get(self):
+    """Handles get requests."""
+    stats = Snapshot()
+    stats['caches'] = {'levels': LevelCacheStats(),
+                       'purchase_tokens': TokenCacheStats(),
+                       'templates': RenderStats()}
+    stats['startup_ms'] = StartupTimings()
+    stats['admission'] = AdmissionStats()
+    self.response.headers['Content-Type'] = 'application/json'
+    self.response.out.write(json.dumps(stats))
+
+
+class Warmup(webapp.RequestHandler):
+  """Preloads the instance before App Engine sends it user requests.
+
+  With report=1 the startup timings are written back as JSON, for measuring
+  cold starts by hand.
+  """
+
+  def get(self):
+    """Handles get requests."""
+    timings = WarmUp()
+    if self.request.get('report'):
+      self.response.headers['Content-Type'] = 'application/json'
+      self.response.out.write(json.dumps(timings, sort_keys=True))
 
 
 class Throw404(webapp.RequestHandler):
@@ -532,21 +804,40 @@ class Throw404(webapp.RequestHandler):
 
   def get(self):
     """Handles get requests."""
-    self.error(404)
     template_vals = {'uri': self.request.application_url}
-    path = os.path.join(os.path.dirname(__file__), 'templates', '404.html')
-    self.response.out.write(template.render(path, template_vals))
+    WriteCachedPage(self, ('404', self.request.application_url),
+                    '404.html', template_vals, status=404)
 
 
-application = webapp.WSGIApplication([
+routes = webapp.WSGIApplication([
     ('/', MainHandler),
     ('/_ah/login_required', MainHandler),
     ('/play', Play),
+    ('/level-complete', LevelComplete),
+    ('/levels', LevelBrowser),
+    ('/level-preview', LevelPreviewImage),
     ('/build-level', BuildLevel),
     ('/instructions', Instructions),
     ('/postback-verify', PostbackVerify),
+    ('/api/entitlements', EntitlementsApi),
+    ('/_stats', Stats),
+    ('/_tasks/drain-purchases', DrainPurchaseQueue),
+    ('/_tasks/rollup-sales', RollupSalesTask),
+    ('/_tasks/rebuild-sales', RebuildSalesTask),
+    ('/_tasks/rebuild-catalog', RebuildCatalogTask),
+    ('/_tasks/rebuild-index', RebuildIndexTask),
+    ('/_tasks/rebuild-previews', RebuildPreviewsTask),
+    ('/_tasks/load-stock-levels', LoadStockLevelsTask),
+    ('/_tasks/solve-level', SolveLevelTask),
+    ('/_sales', SalesReportApi),
+    ('/_ah/warmup', Warmup),
     ('/.*', Throw404),
 ], debug=True)
+application = GzipMiddleware(
+    AdmissionMiddleware(StatsMiddleware(routes), routes))
+
+
+RecordStartup('import_main', time.time() - _import_started)
 
 
 def main():
@@ -7,14 +7,69 @@ class Level(db.Model):
   level = db.StringProperty(required=True)
   next_level = db.StringProperty(default='')
   base_rows = db.IntegerProperty(required=True)
-  static_blocks = db.TextProperty(required=True)  # will be pickled python dict
-  move_blocks = db.TextProperty(required=True)  # will be pickled python dict
-  door = db.TextProperty(required=True)  # will be pickled python dict
-  player_start = db.TextProperty(required=True)  # will be pickled python dict
+  layout = db.BlobProperty()  # see level_codec.EncodeLayout
+  # Legacy layout, only set on levels saved before layout existed
+  static_blocks = db.TextProperty()  # will be pickled python dict
+  move_blocks = db.TextProperty()  # will be pickled python dict
+  door = db.TextProperty()  # will be pickled python dict
+  player_start = db.TextProperty()  # will be pickled python dict
   entity_size = db.IntegerProperty(default=64, required=True)
   canvas_width_blocks = db.IntegerProperty(default=24, required=True)
   canvas_height_blocks = db.IntegerProperty(default=10, required=True)
   step_size = db.IntegerProperty(default=10, required=True)
+  min_moves = db.IntegerProperty()  # from level_solver, None if unknown
+  unsolvable = db.BooleanProperty(default=False)  # see main.SolveLevelTask
+  public = db.BooleanProperty(default=False)  # listed in level_catalog
+
+  @staticmethod
+  def KeyNameFor(level_name, owner=None):
+    """Returns the key name a level is stored under, one per owner and name."""
+    if owner is None:
+      return 'stock:%s' % level_name
+    return 'user:%s:%s' % (owner.email(), level_name)
+
+
+class UserLevelName(db.Model):
+  """Compact index of the levels a user has built; shares the Level key name."""
+  owner = db.UserProperty(required=True)
+  level = db.StringProperty(required=True)
+  preview = db.StringProperty()  # see level_preview.PreviewVersion
+
+
+class PublicLevel(db.Model):
+  """Summary of a level in the public catalog; shares the Level key name."""
+  owner = db.UserProperty(required=True)  # never shown; see owner_id
+  owner_id = db.StringProperty()  # owner.user_id(), the builder in URLs
+  level = db.StringProperty(required=True)
+  creator = db.StringProperty(required=True)  # see level_catalog.CreatorName
+  base_rows = db.IntegerProperty(required=True)
+  static_count = db.IntegerProperty(default=0)
+  move_count = db.IntegerProperty(default=0)
+  min_moves = db.IntegerProperty()
+  published = db.DateTimeProperty(auto_now_add=True)
+  tokens = db.StringListProperty()  # see level_catalog.SearchTokens
+  preview = db.StringProperty()  # see level_preview.PreviewVersion
+
+
+class LevelPreview(db.Model):
+  """PNG thumbnail of a level (see level_preview); shares the Level key name."""
+  owner = db.UserProperty()  # None for the stock levels
+  version = db.StringProperty(required=True)
+  png = db.BlobProperty(required=True)
+
+
+class LevelCompletion(db.Model):
+  """Fastest completion of a level by a user, confirmed by level_replay."""
+  user = db.UserProperty(required=True)
+  level_key_name = db.StringProperty(required=True)  # see Level.KeyNameFor
+  frames = db.IntegerProperty(required=True)
+  trace = db.TextProperty(required=True)
+  completed = db.DateTimeProperty(auto_now=True)
+
+  @staticmethod
+  def KeyNameFor(user, level_key_name):
+    """Returns the key name a completion is stored under, one per user."""
+    return 'completion:%s:%s' % (user.email(), level_key_name)
 
 
 class PurchasedItem(db.Model):
@@ -24,3 +79,35 @@ class PurchasedItem(db.Model):
   item_name = db.StringProperty(required=True)
   item_price = db.StringProperty(required=True)
   order_id = db.StringProperty(required=True)
+
+  @staticmethod
+  def KeyNameForOrder(order_id):
+    """Returns the key name a purchase is stored under, one per order."""
+    return 'order:%s' % order_id
+
+
+class SalesShard(db.Model):
+  """One shard of the running sales totals for an item and currency."""
+  item_name = db.StringProperty(required=True)
+  currency_code = db.StringProperty(required=True)
+  count = db.IntegerProperty(default=0, required=True)
+  revenue_micros = db.IntegerProperty(default=0, required=True)
+  # Order ids counted lately, oldest first; see sales.CountSales
+  recent_orders = db.StringListProperty(indexed=False)
+
+  @staticmethod
+  def KeyNameFor(item_name, currency_code, shard):
+    """Returns the key name of one shard of a counter."""
+    return 'sales:%s:%s:%d' % (item_name, currency_code, shard)
+
+
+class SalesDay(db.Model):
+  """Sales totals rolled up from the shards, one entity per day."""
+  totals = db.TextProperty(required=True)  # JSON, see sales.RollupSales
+  sales = db.TextProperty(required=True)  # JSON, change since previous day
+  updated = db.DateTimeProperty(auto_now=True)
+
+  @staticmethod
+  def KeyNameFor(day):
+    """Returns the key name for a datetime.date; sorts chronologically."""
+    return 'day:%s' % day.isoformat()
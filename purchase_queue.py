@@ -0,0 +1,181 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Deferred, batched recording of purchases from postbacks.
+
+PostbackVerify only verifies the JWT and enqueues the purchase, so Google
+gets its orderId back well inside the 10 second window. A worker drains the
+queue in batches and writes each batch with a single db.put; only purchases
+written for the first time are added to the sales counters, which skip any
+order that overlapping drains both wrote.
+
+The queue backend is pluggable: production uses a task queue pull queue,
+the development server an in-process list.
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# standard library imports
+import logging
+import os
+import threading
+import time
+
+try:
+  import json
+except ImportError:
+  from django.utils import simplejson as json
+
+# third-party imports
+from google.appengine.api import taskqueue
+
+# application-specific imports
+from entitlements import RecordPurchases
+
+
+PULL_QUEUE = 'purchases'
+DRAIN_QUEUE = 'purchase-drain'
+DRAIN_URL = '/_tasks/drain-purchases'
+BATCH_SIZE = 100
+LEASE_SECONDS = 60
+# Enqueues within the same window share a single drain task
+DRAIN_WINDOW = 2  # seconds
+DRAIN_DEADLINE = 20  # seconds a single worker request keeps draining
+
+
+def PurchaseFromPostback(order_id, request_info):
+  """Returns the queued representation of a verified postback."""
+  return {'order_id': order_id,
+          'currency_code': request_info['currencyCode'],
+          'federated_identity': request_info['sellerData'],
+          'item_name': request_info['name'],
+          'item_price': request_info['price']}
+
+
+class InProcessBackend(object):
+  """Queue held in instance memory; for the development server and tests.
+
+  The development server runs neither cron nor task queue workers, so by
+  default every Kick drains the queue before the postback returns. Safe to
+  share between threads; soak.py turns drain_on_kick off and drains from
+  threads of its own.
+  """
+
+  def __init__(self, drain_on_kick=True):
+    self.drain_on_kick = drain_on_kick
+    self._pending = []
+    self._lock = threading.Lock()
+
+  def Enqueue(self, purchase):
+    self._lock.acquire()
+    try:
+      self._pending.append(purchase)
+    finally:
+      self._lock.release()
+
+  def Lease(self, max_items):
+    """Returns (handle, purchases) for up to max_items queued purchases."""
+    self._lock.acquire()
+    try:
+      batch = self._pending[:max_items]
+      del self._pending[:max_items]
+    finally:
+      self._lock.release()
+    return batch, batch
+
+  def Complete(self, handle):
+    pass
+
+  def Release(self, handle):
+    self._lock.acquire()
+    try:
+      self._pending[:0] = handle
+    finally:
+      self._lock.release()
+
+  def Kick(self):
+    if self.drain_on_kick:
+      DrainPurchases()
+
+
+class TaskQueueBackend(object):
+  """Queue stored in a task queue pull queue, see queue.yaml."""
+
+  def __init__(self, queue_name=PULL_QUEUE):
+    self._queue = taskqueue.Queue(queue_name)
+
+  def Enqueue(self, purchase):
+    self._queue.add(taskqueue.Task(payload=json.dumps(purchase),
+                                   method='PULL'))
+
+  def Lease(self, max_items):
+    """Returns (handle, purchases) for up to max_items queued purchases."""
+    tasks = self._queue.lease_tasks(LEASE_SECONDS, max_items)
+    return tasks, [json.loads(task.payload) for task in tasks]
+
+  def Complete(self, handle):
+    if handle:
+      self._queue.delete_tasks(handle)
+
+  def Release(self, handle):
+    # Leases simply expire and the tasks are handed out again
+    pass
+
+  def Kick(self):
+    """Schedules a drain, shared by every enqueue in the same window."""
+    window = int(time.time()) // DRAIN_WINDOW
+    try:
+      taskqueue.add(url=DRAIN_URL, queue_name=DRAIN_QUEUE,
+                    name='drain-%d' % window, countdown=DRAIN_WINDOW)
+    except (taskqueue.TaskAlreadyExistsError,
+            taskqueue.TombstonedTaskError):
+      pass
+
+
+def _DefaultBackend():
+  if os.environ.get('SERVER_SOFTWARE', '').startswith('Development'):
+    return InProcessBackend()
+  return TaskQueueBackend()
+
+_backend = _DefaultBackend()
+
+
+def SetBackend(backend):
+  """Replaces the queue backend, returning the previous one."""
+  global _backend
+  previous, _backend = _backend, backend
+  return previous
+
+
+def EnqueuePurchase(purchase):
+  """Queues a verified purchase for recording and schedules a drain."""
+  _backend.Enqueue(purchase)
+  _backend.Kick()
+
+
+def DrainPurchases(deadline=DRAIN_DEADLINE, batch_size=BATCH_SIZE):
+  """Records queued purchases in batches until empty or out of time.
+
+  Returns:
+    Number of purchases newly written to the datastore.
+  """
+  # Only drain workers count sales; keeps sales off the postback cold start
+  from sales import CountSales
+  stop_at = time.time() + deadline
+  written = 0
+  while time.time() < stop_at:
+    handle, batch = _backend.Lease(batch_size)
+    if not batch:
+      break
+    try:
+      new_items = RecordPurchases(batch)
+    except:
+      _backend.Release(handle)
+      raise
+    _backend.Complete(handle)
+    written += len(new_items)
+    # A failure here leaves the counters short; see sales.RebuildCounters
+    CountSales(new_items)
+  logging.info('Recorded %d new purchases', written)
+  return written
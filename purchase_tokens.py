@@ -0,0 +1,74 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Cache of signed purchase JWTs for the buy buttons on the home page."""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# standard library imports
+import time
+
+# third-party imports
+import jwt
+
+# application-specific imports
+from instrumentation import RecordTiming
+from lru import LRUCache
+from sellerinfo import SELLER_ID
+from sellerinfo import SELLER_SECRET
+
+
+# Tokens are issued at the start of a bucket, so a cached token always has
+# at least TOKEN_LIFETIME - TOKEN_BUCKET seconds left before it expires
+TOKEN_LIFETIME = 3600  # seconds
+TOKEN_BUCKET = 600  # seconds
+MAX_TOKENS = 4096
+
+_token_cache = LRUCache(MAX_TOKENS)
+
+
+def BuildPurchasePayload(identity, item_name, price, issued_at,
+                         currency_code='USD'):
+  """Returns a fresh JWT payload for buying a single catalog item."""
+  return {'iss': SELLER_ID,
+          'aud': 'Google',
+          'typ': 'google/payments/inapp/item/v1',
+          'iat': issued_at,
+          'exp': issued_at + TOKEN_LIFETIME,
+          'request': {'currencyCode': currency_code,
+                      'sellerData': identity,
+                      'name': item_name,
+                      'price': price}}
+
+
+def GetPurchaseToken(identity, item_name, price, now=None):
+  """Returns a signed purchase JWT, reusing one from the same time bucket.
+
+  Args:
+    identity: federated identity of the buyer, sent as sellerData
+    item_name: name of the catalog item
+    price: price of the item as a string, e.g. '0.50'
+    now: optional current time in seconds, defaults to time.time()
+
+  Returns:
+    The encoded JWT as a string.
+  """
+  if now is None:
+    now = time.time()
+  issued_at = int(now) - int(now) % TOKEN_BUCKET
+  key = (identity, item_name, price, issued_at)
+
+  token = _token_cache.get(key)
+  if token is None:
+    payload = BuildPurchasePayload(identity, item_name, price, issued_at)
+    start = time.time()
+    token = jwt.encode(payload, SELLER_SECRET)
+    RecordTiming('jwt_sign', time.time() - start)
+    _token_cache.set(key, token, ttl=issued_at + TOKEN_BUCKET - now)
+  return token
+
+
+def TokenCacheStats():
+  """Returns hit/miss counters for the token cache."""
+  return _token_cache.Stats()
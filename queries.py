@@ -0,0 +1,113 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Datastore queries used by the handlers, parsed once per instance.
+
+Each query is written as GQL with positional parameters and kept in a
+BoundQuery, which parses it the first time a thread uses it and afterwards
+only binds new arguments. Values are never formatted into the GQL string, so
+request parameters such as level names can't change the shape of a query.
+
+Where a handler only needs keys (to delete or count entities) it uses the
+SELECT __key__ variant, which skips fetching the entities themselves. Every
+query here is covered by the built-in indexes or by index.yaml.
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# standard library imports
+import threading
+
+# third-party imports
+from google.appengine.ext import db
+
+# application-specific imports
+from models import Level
+from models import PublicLevel
+from models import PurchasedItem
+from models import UserLevelName
+
+
+MAX_RESULTS = 1000
+
+
+class BoundQuery(object):
+  """A GQL query parsed once and re-bound with new arguments on every use.
+
+  Each thread gets its own db.GqlQuery, since binding changes the query in
+  place. Within a thread, results must be fetched before the same
+  BoundQuery is bound again.
+  """
+
+  def __init__(self, model_class, conditions, keys_only=False):
+    selection = '__key__' if keys_only else '*'
+    self.gql = 'SELECT %s FROM %s %s' % (selection, model_class.kind(),
+                                         conditions)
+    self._local = threading.local()
+
+  def Bind(self, *args):
+    """Returns this thread's parsed query with args bound to :1, :2, ..."""
+    query = getattr(self._local, 'query', None)
+    if query is None:
+      query = self._local.query = db.GqlQuery(self.gql)
+    query.bind(*args)
+    return query
+
+  def Fetch(self, limit, *args):
+    return self.Bind(*args).fetch(limit)
+
+
+PURCHASES_BY_IDENTITY = BoundQuery(
+    PurchasedItem, 'WHERE federated_identity = :1')
+PURCHASE_KEYS_BY_IDENTITY = BoundQuery(
+    PurchasedItem, 'WHERE federated_identity = :1', keys_only=True)
+LEVELS_BY_NAME = BoundQuery(
+    Level, 'WHERE owner = :1 AND level = :2')
+PUBLIC_LEVELS_BY_NAME = BoundQuery(
+    PublicLevel, 'WHERE owner_id = :1 AND level = :2')
+# UserLevelName key names are Level key names, which start with the owner
+LEVEL_NAMES_IN_KEY_RANGE = BoundQuery(
+    UserLevelName, 'WHERE __key__ > :1 AND __key__ < :2 ORDER BY __key__')
+
+
+def PurchasesFor(identity):
+  """Returns every PurchasedItem bought by identity."""
+  return PURCHASES_BY_IDENTITY.Fetch(MAX_RESULTS, identity)
+
+
+def PurchaseKeysFor(identity):
+  """Returns the keys of every PurchasedItem bought by identity."""
+  return PURCHASE_KEYS_BY_IDENTITY.Fetch(MAX_RESULTS, identity)
+
+
+def LevelsNamed(level_name, owner, limit=2):
+  """Returns at most limit Levels called level_name built by owner.
+
+  owner is None for the stock levels.
+  """
+  return LEVELS_BY_NAME.Fetch(limit, owner, level_name)
+
+
+def PublicLevelNamed(level_name, owner_id):
+  """Returns the PublicLevel called level_name built by owner_id, or None."""
+  summaries = PUBLIC_LEVELS_BY_NAME.Fetch(1, owner_id, level_name)
+  if summaries:
+    return summaries[0]
+  return None
+
+
+def LevelNamesFor(owner, after=None, limit=MAX_RESULTS):
+  """Returns UserLevelName entries of owner in name order, after a name.
+
+  Entries are found by key range rather than by owner: a users.User read
+  back from the datastore has lost its federated_provider, so entries
+  written from one (see level_index.RebuildIndex) wouldn't match an owner
+  filter for the signed-in user.
+  """
+  prefix = Level.KeyNameFor('', owner)
+  # ':' + 1 == ';', so every key name starting with prefix sorts before end
+  end = prefix[:-1] + ';'
+  start_key = db.Key.from_path(UserLevelName.kind(), prefix + (after or ''))
+  end_key = db.Key.from_path(UserLevelName.kind(), end)
+  return LEVEL_NAMES_IN_KEY_RANGE.Fetch(limit, start_key, end_key)
@@ -0,0 +1,208 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Admission control for the expensive endpoints.
+
+Building a level (validation, solving and a batch put) and resetting
+purchases are the most expensive requests a single user can repeat at will,
+while /postback-verify must answer within 10 seconds or Google cancels the
+transaction. The python runtime serves one request at a time per instance,
+so postbacks can only be kept from queueing behind user traffic by giving
+them instances of their own:
+
+  * the same code is deployed a second time as version POSTBACK_VERSION
+    (appcfg.py -V postbacks update .) and the seller account's postback URL,
+    constants.POSTBACK_URL, points at that version; App Engine scales each
+    version's instances separately
+  * on that version AdmissionMiddleware serves only POSTBACK_VERSION_ROUTES
+    (postbacks and the drains they schedule) and answers everything else
+    with a 404, so users can't load it
+
+On every other version, each user has a token bucket per expensive lane,
+held in memcache so every instance sees the same bucket, falling back to a
+bucket in instance memory when memcache is unavailable or too contended.
+Requests over the limit are turned away with a 503 and a Retry-After header.
+
+Routes are named by handler class and method as in instrumentation, so
+every URL mapped to a handler is covered.
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# standard library imports
+import os
+import threading
+import time
+
+# third-party imports
+from google.appengine.api import memcache
+from google.appengine.api import users
+
+# application-specific imports
+from instrumentation import RouteName
+from lru import LRUCache
+
+
+ENABLED = True  # benchmark.py turns admission control off
+# route (see instrumentation.RouteName) -> lane of the expensive routes
+EXPENSIVE_ROUTES = {'BuildLevel.post': 'build',
+                    'MainHandler.post': 'reset'}
+# lane -> (tokens added per minute, bucket size)
+USER_LIMITS = {'build': (6, 10),
+               'reset': (2, 5)}
+POSTBACK_VERSION = 'postbacks'
+# Push tasks run on the version that added them, so the drains the postbacks
+# schedule (purchase_queue.TaskQueueBackend.Kick) are served here too
+POSTBACK_VERSION_ROUTES = ('PostbackVerify.post', 'DrainPurchaseQueue.post',
+                           'Warmup.get', 'Stats.get')
+MEMCACHE_NAMESPACE = 'rate-limits'
+BUCKET_TTL = 3600  # seconds; an idle bucket is full again long before this
+MAX_CAS_ATTEMPTS = 3
+MAX_LOCAL_BUCKETS = 4096
+
+_local_buckets = LRUCache(MAX_LOCAL_BUCKETS, ttl=BUCKET_TTL)
+_local_lock = threading.Lock()
+_counters = {}
+
+
+def _Count(lane, outcome):
+  lane_counters = _counters.setdefault(lane, {})
+  lane_counters[outcome] = lane_counters.get(outcome, 0) + 1
+
+
+def _Refill(state, per_second, size, now):
+  """Takes a token from a bucket.
+
+  Args:
+    state: (tokens, updated) of the bucket, or None for a new, full one
+    per_second: tokens added per second
+    size: most tokens the bucket holds
+    now: current time in seconds
+
+  Returns:
+    (allowed, retry_after, new state); retry_after is the number of seconds
+    until a token is available when not allowed.
+  """
+  if state is None:
+    tokens, updated = size, now
+  else:
+    tokens, updated = state
+  tokens = min(size, tokens + max(0, now - updated) * per_second)
+  if tokens >= 1:
+    return True, 0, (tokens - 1, now)
+  return False, (1 - tokens) / per_second, (tokens, now)
+
+
+def _TakeFromMemcache(key, per_second, size, now):
+  """Returns (allowed, retry_after), or None if memcache couldn't decide."""
+  client = memcache.Client()
+  for _ in range(MAX_CAS_ATTEMPTS):
+    state = client.gets(key, namespace=MEMCACHE_NAMESPACE)
+    allowed, retry_after, new_state = _Refill(state, per_second, size, now)
+    if state is None:
+      stored = client.add(key, new_state, time=BUCKET_TTL,
+                          namespace=MEMCACHE_NAMESPACE)
+    else:
+      stored = client.cas(key, new_state, time=BUCKET_TTL,
+                          namespace=MEMCACHE_NAMESPACE)
+    if stored:
+      return allowed, retry_after
+  return None
+
+
+def _TakeFromLocal(key, per_second, size, now):
+  _local_lock.acquire()
+  try:
+    allowed, retry_after, new_state = _Refill(_local_buckets.get(key),
+                                              per_second, size, now)
+    _local_buckets.set(key, new_state)
+  finally:
+    _local_lock.release()
+  return allowed, retry_after
+
+
+def TakeToken(lane, user, now=None):
+  """Takes a token from user's bucket for lane.
+
+  Args:
+    lane: key of USER_LIMITS
+    user: users.User making the request
+    now: optional current time in seconds, defaults to time.time()
+
+  Returns:
+    (allowed, retry_after) where retry_after is the number of seconds until
+    the next token, when not allowed.
+  """
+  if now is None:
+    now = time.time()
+  per_minute, size = USER_LIMITS[lane]
+  per_second = per_minute / 60.0
+  key = '%s:%s' % (lane, user.user_id() or user.email())
+  result = _TakeFromMemcache(key, per_second, size, now)
+  if result is None:
+    _Count(lane, 'local_fallback')
+    result = _TakeFromLocal(key, per_second, size, now)
+  return result
+
+
+def OnPostbackVersion():
+  """Returns True on instances of the version serving only postbacks."""
+  version = os.environ.get('CURRENT_VERSION_ID', '')
+  return version.split('.')[0] == POSTBACK_VERSION
+
+
+def _Reject(start_response, retry_after, message):
+  start_response('503 Service Unavailable',
+                 [('Content-Type', 'text/plain; charset=utf-8'),
+                  ('Retry-After', str(max(1, int(retry_after + 0.5)))),
+                  ('Cache-Control', 'no-cache')])
+  return [message]
+
+
+class AdmissionMiddleware(object):
+  """WSGI middleware applying the limits above to the expensive routes.
+
+  Args:
+    application: WSGI application to wrap
+    routes: the webapp.WSGIApplication it serves, to name routes by
+  """
+
+  def __init__(self, application, routes):
+    self.application = application
+    self.routes = routes
+
+  def __call__(self, environ, start_response):
+    if not ENABLED:
+      return self.application(environ, start_response)
+
+    route = RouteName(self.routes, environ)
+    if OnPostbackVersion():
+      if route in POSTBACK_VERSION_ROUTES:
+        return self.application(environ, start_response)
+      _Count(POSTBACK_VERSION, 'refused')
+      start_response('404 Not Found',
+                     [('Content-Type', 'text/plain; charset=utf-8')])
+      return ['Not served by this version.']
+
+    lane = EXPENSIVE_ROUTES.get(route)
+    if lane is None:
+      return self.application(environ, start_response)
+
+    user = users.get_current_user()
+    if user is not None:
+      allowed, retry_after = TakeToken(lane, user)
+      if not allowed:
+        _Count(lane, 'rate_limited')
+        return _Reject(start_response, retry_after,
+                       'Too many requests, please wait a little.')
+    _Count(lane, 'admitted')
+    return self.application(environ, start_response)
+
+
+def AdmissionStats():
+  """Returns {lane: {outcome: count}} for this instance."""
+  stats = {}
+  for lane, lane_counters in _counters.iteritems():
+    stats[lane] = dict(lane_counters)
+  return stats
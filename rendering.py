@@ -0,0 +1,197 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Template registry and whole-response cache for IAP Hello World.
+
+Every template is loaded and compiled once per instance. Pages which don't
+depend on the request (or only on a small cache key) can also be served from
+an in-process response cache with ETag and Last-Modified validators, so
+browsers revalidate with a conditional GET and get back a 304. A gzipped
+copy of each cached page is kept for clients which accept it, so cached
+pages are compressed once rather than per request (see compression.py for
+everything else).
+
+Scripts and stylesheets are referenced through the bundle manifest written
+by build_assets.py, which every template receives as assets.
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# standard library imports
+from email.utils import formatdate
+from email.utils import mktime_tz
+from email.utils import parsedate_tz
+import hashlib
+import os
+import time
+
+try:
+  import json
+except ImportError:
+  from django.utils import simplejson as json
+
+# third-party imports
+from google.appengine.ext.webapp import template
+import django.template
+
+# application-specific imports
+from compression import AcceptsGzip
+from compression import Gzip
+from instrumentation import RecordTiming
+from lru import LRUCache
+
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates')
+# Written by build_assets.py
+ASSET_MANIFEST = os.path.join(os.path.dirname(__file__), 'bundles',
+                              'manifest.json')
+TEMPLATE_NAMES = ('index.html', 'game_play.html', 'build_level.html',
+                  'instructions.html', 'levels.html', '404.html')
+
+MAX_CACHED_PAGES = 100
+
+_templates = {}
+_asset_urls = {}
+_render_stats = {}
+_page_cache = LRUCache(MAX_CACHED_PAGES)
+_page_counters = {'not_modified': 0, 'gzipped': 0}
+
+
+def GetTemplate(name):
+  """Returns the compiled template for name, loading it on first use."""
+  compiled = _templates.get(name)
+  if compiled is None:
+    compiled = template.load(os.path.join(TEMPLATE_DIR, name))
+    _templates[name] = compiled
+  return compiled
+
+
+def LoadTemplates():
+  """Compiles every template up front."""
+  for name in TEMPLATE_NAMES:
+    GetTemplate(name)
+
+
+def AssetUrls():
+  """Returns the URLs of the current asset bundles, read once per instance.
+
+  Keys are bundle names with dots replaced so templates can use them,
+  e.g. {{ assets.game_js }} for game.js.
+  """
+  if not _asset_urls:
+    manifest_file = open(ASSET_MANIFEST)
+    try:
+      manifest = json.load(manifest_file)
+    finally:
+      manifest_file.close()
+    for bundle_name, url in manifest.iteritems():
+      _asset_urls[bundle_name.replace('.', '_')] = url
+  return _asset_urls
+
+
+def RenderTemplate(name, template_vals):
+  """Renders the template called name with template_vals.
+
+  Args:
+    name: file name of a template in the templates directory
+    template_vals: dictionary of values for the template; the bundle URLs
+                   from AssetUrls are added as assets
+
+  Returns:
+    The rendered page as a string.
+  """
+  start = time.time()
+  template_vals = dict(template_vals, assets=AssetUrls())
+  result = GetTemplate(name).render(django.template.Context(template_vals))
+  elapsed = time.time() - start
+  stats = _render_stats.setdefault(name, [0, 0.0])
+  stats[0] += 1
+  stats[1] += elapsed
+  RecordTiming('template', elapsed)
+  return result
+
+
+class _CachedPage(object):
+  """A rendered page with its validators and, once asked for, gzipped copy."""
+
+  def __init__(self, body, status):
+    if isinstance(body, unicode):
+      body = body.encode('utf-8')
+    self.body = body
+    self.status = status
+    self.etag = '"%s"' % hashlib.md5(body).hexdigest()
+    self.last_modified = int(time.time())
+    self._gzipped = None
+
+  def Variant(self, gzipped):
+    """Returns (body, etag) of the plain or gzipped copy of the page."""
+    if not gzipped:
+      return self.body, self.etag
+    if self._gzipped is None:
+      self._gzipped = Gzip(self.body)
+    # Each encoding is a different representation with its own strong ETag
+    return self._gzipped, self.etag[:-1] + '-gzip"'
+
+
+def _NotModified(request, etag, last_modified):
+  """Returns True if the request's validators match a page."""
+  if_none_match = request.headers.get('If-None-Match')
+  if if_none_match is not None:
+    return etag in [tag.strip() for tag in if_none_match.split(',')]
+  if_modified_since = request.headers.get('If-Modified-Since')
+  if if_modified_since is not None:
+    parsed = parsedate_tz(if_modified_since)
+    if parsed is not None:
+      return mktime_tz(parsed) >= last_modified
+  return False
+
+
+def WriteCachedPage(handler, cache_key, name, template_vals,
+                    status=200, max_age=3600):
+  """Writes a cacheable page to handler.response, rendering at most once.
+
+  Args:
+    handler: the webapp.RequestHandler serving the request
+    cache_key: hashable key identifying this rendering of the page
+    name: template to render on a cache miss
+    template_vals: values for the template on a cache miss
+    status: HTTP status of the page
+    max_age: seconds clients may reuse the page without revalidating
+  """
+  page = _page_cache.get(cache_key)
+  if page is None:
+    page = _CachedPage(RenderTemplate(name, template_vals), status)
+    _page_cache.set(cache_key, page)
+
+  gzipped = AcceptsGzip(handler.request.headers.get('Accept-Encoding', ''))
+  body, etag = page.Variant(gzipped)
+
+  response = handler.response
+  response.headers['ETag'] = etag
+  response.headers['Last-Modified'] = formatdate(page.last_modified,
+                                                 usegmt=True)
+  response.headers['Cache-Control'] = 'public, max-age=%d' % max_age
+  response.headers['Vary'] = 'Accept-Encoding'
+  if page.status == 200 and _NotModified(handler.request, etag,
+                                         page.last_modified):
+    _page_counters['not_modified'] += 1
+    response.set_status(304)
+    return
+  response.set_status(page.status)
+  if gzipped:
+    _page_counters['gzipped'] += 1
+    response.headers['Content-Encoding'] = 'gzip'
+  response.out.write(body)
+
+
+def RenderStats():
+  """Returns template and response cache statistics."""
+  templates = {}
+  for name, (count, seconds) in _render_stats.iteritems():
+    templates[name] = {'renders': count, 'seconds': seconds}
+  pages = _page_cache.Stats()
+  pages.update(_page_counters)
+  return {'compiled': sorted(_templates),
+          'renders': templates,
+          'pages': pages}
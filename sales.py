@@ -0,0 +1,249 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Sharded sales counters and daily sales reports.
+
+Every newly recorded purchase adds to a running count and revenue for its
+item name and currency. Each running total is split over NUM_SHARDS
+SalesShard entities and each order goes to the one its order id hashes to,
+so concurrent drains of the purchase queue rarely contend on an entity
+group. A shard also keeps the order ids it counted lately, and skips them:
+two drains which both wrote the same order (see
+entitlements.RecordPurchases) count it once. Revenue is kept in millionths
+of the currency unit so that it adds up exactly.
+
+A cron job rolls the shards up into one SalesDay entity per day, holding the
+running totals and the sales since the previous rollup day; a report over a
+range of days is a single batch get. RebuildCounters recomputes the totals
+from the PurchasedItem entities, for when the shards have drifted (a drain
+that failed after writing purchases but before counting them).
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# standard library imports
+import datetime
+import decimal
+import hashlib
+
+try:
+  import json
+except ImportError:
+  from django.utils import simplejson as json
+
+# third-party imports
+from google.appengine.ext import db
+
+# application-specific imports
+from models import PurchasedItem
+from models import SalesDay
+from models import SalesShard
+
+
+NUM_SHARDS = 20
+# Order ids each shard remembers; duplicates only race within one drain window
+RECENT_ORDERS = 200
+MICROS = 1000000
+MAX_SHARDS_READ = 1000  # every shard of every item and currency
+MAX_REPORT_DAYS = 90
+# Oldest previous rollup looked for when computing a day's sales
+MAX_ROLLUP_GAP = 31  # days
+
+
+def PriceMicros(price):
+  """Returns a price string such as '0.50' in millionths, as an int."""
+  return int(decimal.Decimal(price) * MICROS)
+
+
+def _AddTo(totals, item_name, currency_code, count, revenue_micros):
+  total = totals.setdefault((item_name, currency_code), [0, 0])
+  total[0] += count
+  total[1] += revenue_micros
+
+
+def _TotalsFromPurchases(purchases):
+  totals = {}
+  for purchase in purchases:
+    _AddTo(totals, purchase.item_name, purchase.currency_code, 1,
+           PriceMicros(purchase.item_price))
+  return totals
+
+
+def ShardKeyNameFor(purchase):
+  """Returns the key name of the shard counting a PurchasedItem."""
+  shard = int(hashlib.md5(purchase.order_id.encode('utf-8')).hexdigest(),
+              16) % NUM_SHARDS
+  return SalesShard.KeyNameFor(purchase.item_name, purchase.currency_code,
+                               shard)
+
+
+def _IncrementShard(key_name, purchases):
+  shard = SalesShard.get_by_key_name(key_name)
+  if shard is None:
+    shard = SalesShard(key_name=key_name, item_name=purchases[0].item_name,
+                       currency_code=purchases[0].currency_code)
+  counted = set(shard.recent_orders)
+  for purchase in purchases:
+    if purchase.order_id not in counted:
+      counted.add(purchase.order_id)
+      shard.count += 1
+      shard.revenue_micros += PriceMicros(purchase.item_price)
+      shard.recent_orders.append(purchase.order_id)
+  del shard.recent_orders[:-RECENT_ORDERS]
+  shard.put()
+
+
+def CountSales(purchases):
+  """Adds newly recorded purchases to the counters, each order once.
+
+  Purchases are grouped by shard first, so a batch costs one transaction per
+  shard it touches: at most NUM_SHARDS per item and currency.
+
+  Args:
+    purchases: PurchasedItem entities which were just written
+  """
+  by_shard = {}
+  for purchase in purchases:
+    by_shard.setdefault(ShardKeyNameFor(purchase), []).append(purchase)
+  for key_name, shard_purchases in by_shard.iteritems():
+    db.run_in_transaction(_IncrementShard, key_name, shard_purchases)
+
+
+def ReadTotals():
+  """Sums every shard; returns {(item_name, currency_code): [count, micros]}.
+
+  One query, for the rollup job only.
+  """
+  totals = {}
+  for shard in SalesShard.all().fetch(MAX_SHARDS_READ):
+    _AddTo(totals, shard.item_name, shard.currency_code, shard.count,
+           shard.revenue_micros)
+  return totals
+
+
+def _Records(totals):
+  """Returns totals as a list of JSON-friendly records, sorted."""
+  records = []
+  for (item_name, currency_code), (count, revenue_micros) in sorted(
+      totals.iteritems()):
+    records.append({'item_name': item_name,
+                    'currency_code': currency_code,
+                    'count': count,
+                    'revenue_micros': revenue_micros})
+  return records
+
+
+def _FromRecords(records):
+  totals = {}
+  for record in records:
+    _AddTo(totals, record['item_name'], record['currency_code'],
+           record['count'], record['revenue_micros'])
+  return totals
+
+
+def _PreviousRollup(day):
+  """Returns the most recent SalesDay before day, within MAX_ROLLUP_GAP."""
+  earliest = day - datetime.timedelta(days=MAX_ROLLUP_GAP)
+  query = SalesDay.all()
+  query.filter('__key__ <', db.Key.from_path('SalesDay',
+                                             SalesDay.KeyNameFor(day)))
+  query.filter('__key__ >=', db.Key.from_path('SalesDay',
+                                              SalesDay.KeyNameFor(earliest)))
+  return query.order('-__key__').get()
+
+
+def RollupSales(day=None):
+  """Writes the SalesDay for day (default today, UTC) from the shards.
+
+  Run periodically; each run replaces the day's entity, so purchases
+  counted after a day's last rollup are reported on the next day.
+
+  Returns:
+    The SalesDay written.
+  """
+  if day is None:
+    day = datetime.datetime.utcnow().date()
+  totals = ReadTotals()
+
+  sales = {}
+  previous = _PreviousRollup(day)
+  previous_totals = {}
+  if previous is not None:
+    previous_totals = _FromRecords(json.loads(previous.totals))
+  for key, (count, revenue_micros) in totals.iteritems():
+    before = previous_totals.get(key, [0, 0])
+    if count != before[0] or revenue_micros != before[1]:
+      sales[key] = [count - before[0], revenue_micros - before[1]]
+
+  rollup = SalesDay(key_name=SalesDay.KeyNameFor(day),
+                    totals=json.dumps(_Records(totals)),
+                    sales=json.dumps(_Records(sales)))
+  rollup.put()
+  return rollup
+
+
+def SalesReport(days=30, today=None):
+  """Returns the rolled up sales for the last days days, newest first.
+
+  Reads at most MAX_REPORT_DAYS SalesDay entities in one batch get. Days
+  without a rollup are left out.
+  """
+  if today is None:
+    today = datetime.datetime.utcnow().date()
+  days = max(1, min(days, MAX_REPORT_DAYS))
+  dates = [today - datetime.timedelta(days=offset) for offset in range(days)]
+  rollups = SalesDay.get_by_key_name([SalesDay.KeyNameFor(date)
+                                      for date in dates])
+  report = []
+  for date, rollup in zip(dates, rollups):
+    if rollup is not None:
+      report.append({'day': date.isoformat(),
+                     'sales': json.loads(rollup.sales),
+                     'totals': json.loads(rollup.totals)})
+  return report
+
+
+def RebuildCounters(batch_size=500):
+  """Recomputes every counter from the PurchasedItem entities.
+
+  Purchases counted while this runs may be lost; run it while the purchase
+  queue is quiet.
+
+  Returns:
+    Number of purchases counted.
+  """
+  totals = {}
+  counted = 0
+  query = PurchasedItem.all()
+  while True:
+    purchases = query.fetch(batch_size)
+    for (item_name, currency_code), (count, revenue_micros) in (
+        _TotalsFromPurchases(purchases).iteritems()):
+      _AddTo(totals, item_name, currency_code, count, revenue_micros)
+    counted += len(purchases)
+    if len(purchases) < batch_size:
+      break
+    query.with_cursor(query.cursor())
+
+  # Each total goes in shard 0; every other existing shard is zeroed. The
+  # recent orders are kept, so they still aren't counted again
+  shards = {}
+  for shard in SalesShard.all().fetch(MAX_SHARDS_READ):
+    shard.count = 0
+    shard.revenue_micros = 0
+    shards[shard.key().name()] = shard
+  for (item_name, currency_code), (count, revenue_micros) in (
+      totals.iteritems()):
+    key_name = SalesShard.KeyNameFor(item_name, currency_code, 0)
+    shard = shards.get(key_name)
+    if shard is None:
+      shard = shards[key_name] = SalesShard(key_name=key_name,
+                                            item_name=item_name,
+                                            currency_code=currency_code)
+    shard.count = count
+    shard.revenue_micros = revenue_micros
+  entities = shards.values()
+  for start in range(0, len(entities), batch_size):
+    db.put(entities[start:start + batch_size])
+  return counted
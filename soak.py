@@ -0,0 +1,303 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Concurrent soak test of /postback-verify with fault injection.
+
+Signs postbacks the way Google does and sends them from a pool of threads
+to the WSGI application, on the same SDK stubs as benchmark.py. Some orders
+are sent twice with separately signed JWTs (duplicate orderIds), some
+acknowledged postbacks are resent (retries), and every postback that fails
+or misses the deadline is retried, as Google does. Datastore RPCs can be
+slowed down at random. Several drain workers record the queued purchases
+while the postbacks arrive, so copies of one order can be recorded by
+overlapping drains; postbacks only enqueue, as in production.
+
+Afterwards the datastore is audited: every acknowledged order must be
+recorded, and counted exactly once by the sales counters. Purchases are keyed
+by orderId, so an order can't be stored twice; what duplicates and
+overlapping drains can break is the count, reported as overcounted. The
+report gives throughput, latency percentiles against the 10 second
+deadline after which Google cancels a transaction, and any lost or
+overcounted purchases:
+
+  python soak.py --orders=2000 --threads=8 --drainers=4 \\
+      --duplicate_rate=0.1 --retry_rate=0.05 --delay_ms=50 --delay_rate=0.2
+
+The python 2.5 runtime serves one request at a time per instance, so
+--threads=1 models it; more threads model concurrent requests.
+
+The App Engine SDK must be on sys.path (or pass --sdk).
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# standard library imports
+import optparse
+import Queue
+import random
+import sys
+import threading
+import time
+
+try:
+  import json
+except ImportError:
+  from django.utils import simplejson as json
+
+# application-specific imports
+from benchmark import DATASTORE_SERVICE
+from benchmark import Environment
+from benchmark import Percentile
+from benchmark import PostbackJwt
+
+
+DEADLINE = 10  # seconds Google waits for the postback's 200 OK
+DRAIN_SLICE = 1  # seconds each concurrent drain runs for
+DRAINERS = 4
+AUDIT_BATCH_SIZE = 500
+
+
+class DatastoreDelay(object):
+  """Sleeps before a fraction of datastore RPCs; Hook is the pre-call hook."""
+
+  def __init__(self, delay, rate):
+    self.delay = delay
+    self.rate = rate
+    self.injected = 0
+    self._lock = threading.Lock()
+
+  def Hook(self, service, call, request, response):
+    if (service == DATASTORE_SERVICE and self.delay > 0 and
+        random.random() < self.rate):
+      self._lock.acquire()
+      try:
+        self.injected += 1
+      finally:
+        self._lock.release()
+      time.sleep(self.delay)
+
+
+def Postbacks(num_orders, duplicate_rate, num_buyers=100):
+  """Returns a shuffled list of (order_id, jwt) pairs to send.
+
+  A duplicate_rate fraction of the orders appear twice, with separately
+  signed JWTs for the same orderId.
+  """
+  from constants import CATALOG
+  postbacks = []
+  for index in range(num_orders):
+    order_id = 'soak-%d' % index
+    identity = 'https://id.example.com/buyer%d' % (index % num_buyers)
+    item_name, price = random.choice(CATALOG)
+    copies = 2 if random.random() < duplicate_rate else 1
+    for _ in range(copies):
+      postbacks.append((order_id,
+                        PostbackJwt(order_id, identity, item_name, price)))
+  random.shuffle(postbacks)
+  return postbacks
+
+
+class _Outcomes(object):
+  """Latencies and acknowledgements gathered from every sending thread."""
+
+  def __init__(self):
+    self.latencies = []
+    self.acknowledged = set()
+    self.failures = 0
+    self.over_deadline = 0
+    self.retries = 0
+    self._lock = threading.Lock()
+
+  def Add(self, order_id, seconds, ok, retry):
+    self._lock.acquire()
+    try:
+      self.latencies.append(seconds)
+      if seconds > DEADLINE:
+        self.over_deadline += 1
+      elif ok:
+        self.acknowledged.add(order_id)
+      else:
+        self.failures += 1
+      if retry:
+        self.retries += 1
+    finally:
+      self._lock.release()
+
+
+def _Send(env, order_id, token, outcomes, retry_rate, max_retries):
+  for attempt in range(max_retries + 1):
+    start = time.time()
+    try:
+      response = env.Request('/postback-verify', {'jwt': token})
+      ok = response.status_int == 200 and response.body == order_id
+    except Exception:
+      ok = False
+    seconds = time.time() - start
+    outcomes.Add(order_id, seconds, ok and seconds <= DEADLINE, attempt > 0)
+    # Failed or late postbacks are retried; a few good ones are resent
+    if ok and seconds <= DEADLINE and random.random() >= retry_rate:
+      return
+
+
+def _Sender(env, work, outcomes, retry_rate, max_retries):
+  while True:
+    try:
+      order_id, token = work.get_nowait()
+    except Queue.Empty:
+      return
+    _Send(env, order_id, token, outcomes, retry_rate, max_retries)
+
+
+def _Drainer(stop):
+  from purchase_queue import DrainPurchases
+  while not stop.isSet():
+    if not DrainPurchases(deadline=DRAIN_SLICE):
+      time.sleep(0.05)
+
+
+def Soak(env, postbacks, threads=8, drainers=DRAINERS, retry_rate=0.05,
+         max_retries=3):
+  """Sends every postback concurrently while draining the purchase queue.
+
+  Returns:
+    Dictionary of statistics; see Audit for the datastore side.
+  """
+  from purchase_queue import DrainPurchases
+  work = Queue.Queue()
+  for postback in postbacks:
+    work.put(postback)
+  outcomes = _Outcomes()
+
+  stop = threading.Event()
+  drain_threads = [threading.Thread(target=_Drainer, args=(stop,))
+                   for _ in range(drainers)]
+  senders = [threading.Thread(target=_Sender,
+                              args=(env, work, outcomes, retry_rate,
+                                    max_retries))
+             for _ in range(threads)]
+  start = time.time()
+  for thread in drain_threads + senders:
+    thread.start()
+  for thread in senders:
+    thread.join()
+  elapsed = time.time() - start
+  stop.set()
+  for thread in drain_threads:
+    thread.join()
+  # Whatever is still queued
+  while DrainPurchases():
+    pass
+
+  latencies = sorted(outcomes.latencies)
+  return {'postbacks': len(latencies),
+          'retries': outcomes.retries,
+          'throughput': len(latencies) / max(elapsed, 1e-9),
+          'p50_ms': 1000 * Percentile(latencies, 0.50),
+          'p95_ms': 1000 * Percentile(latencies, 0.95),
+          'p99_ms': 1000 * Percentile(latencies, 0.99),
+          'max_ms': 1000 * (latencies[-1] if latencies else 0),
+          'over_deadline': outcomes.over_deadline,
+          'failures': outcomes.failures,
+          'acknowledged': outcomes.acknowledged}
+
+
+def Audit(acknowledged):
+  """Checks the recorded purchases and sales counters against the orders.
+
+  Args:
+    acknowledged: set of order ids whose postbacks got their 200 OK in time
+
+  Returns:
+    Dictionary with the numbers of recorded and lost purchases, and of
+    sales counted beyond the recorded purchases.
+  """
+  from models import PurchasedItem
+  from sales import ReadTotals
+
+  recorded = set()
+  query = PurchasedItem.all()
+  while True:
+    purchases = query.fetch(AUDIT_BATCH_SIZE)
+    recorded.update([purchase.order_id for purchase in purchases])
+    if len(purchases) < AUDIT_BATCH_SIZE:
+      break
+    query.with_cursor(query.cursor())
+
+  counted = sum([count for count, _ in ReadTotals().itervalues()])
+  return {'recorded': len(recorded),
+          'lost': len(acknowledged - recorded),
+          'overcounted': counted - len(recorded)}
+
+
+def Report(stats, audit, out=sys.stdout):
+  """Prints the soak results."""
+  out.write('%d postbacks (%d retries) at %.1f/s\n'
+            % (stats['postbacks'], stats['retries'], stats['throughput']))
+  out.write('latency p50 %.1f ms, p95 %.1f ms, p99 %.1f ms, max %.1f ms\n'
+            % (stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+               stats['max_ms']))
+  out.write('%d over the %ds deadline, %d failed\n'
+            % (stats['over_deadline'], DEADLINE, stats['failures']))
+  out.write('%d orders acknowledged, %d recorded, %d lost\n'
+            % (len(stats['acknowledged']), audit['recorded'], audit['lost']))
+  out.write('%d sales overcounted\n' % audit['overcounted'])
+
+
+def main(argv):
+  parser = optparse.OptionParser(usage='%prog [options]')
+  parser.add_option('--sdk', help='path to the App Engine SDK')
+  parser.add_option('--orders', type='int', default=1000)
+  parser.add_option('--threads', type='int', default=8)
+  parser.add_option('--drainers', type='int', default=DRAINERS,
+                    help='concurrent drain workers')
+  parser.add_option('--duplicate_rate', type='float', default=0.1,
+                    help='fraction of orders sent twice')
+  parser.add_option('--retry_rate', type='float', default=0.05,
+                    help='fraction of acknowledged postbacks resent')
+  parser.add_option('--max_retries', type='int', default=3)
+  parser.add_option('--delay_ms', type='float', default=0,
+                    help='delay injected before datastore RPCs')
+  parser.add_option('--delay_rate', type='float', default=0.1,
+                    help='fraction of datastore RPCs delayed')
+  parser.add_option('--seed', type='int', help='random seed, for reruns')
+  parser.add_option('--save', help='write results as JSON')
+  options, _ = parser.parse_args(argv[1:])
+
+  if options.sdk:
+    sys.path.insert(0, options.sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+  if options.seed is not None:
+    random.seed(options.seed)
+
+  env = Environment()
+  delay = DatastoreDelay(options.delay_ms / 1000.0, options.delay_rate)
+  from google.appengine.api import apiproxy_stub_map
+  apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+      'soak-delay', delay.Hook, DATASTORE_SERVICE)
+  # Only the drain threads record purchases, not the postbacks themselves
+  from purchase_queue import InProcessBackend
+  from purchase_queue import SetBackend
+  SetBackend(InProcessBackend(drain_on_kick=False))
+  try:
+    postbacks = Postbacks(options.orders, options.duplicate_rate)
+    stats = Soak(env, postbacks, threads=options.threads,
+                 drainers=options.drainers, retry_rate=options.retry_rate,
+                 max_retries=options.max_retries)
+    audit = Audit(stats['acknowledged'])
+  finally:
+    env.Deactivate()
+
+  Report(stats, audit)
+  sys.stdout.write('%d datastore RPCs delayed\n' % delay.injected)
+  if options.save:
+    stats['acknowledged'] = len(stats['acknowledged'])
+    out = open(options.save, 'w')
+    json.dump({'options': options.__dict__, 'results': stats,
+               'audit': audit}, out, indent=2, sort_keys=True)
+    out.close()
+
+
+if __name__ == '__main__':
+  main(sys.argv)
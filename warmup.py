@@ -0,0 +1,100 @@
+# Copyright 2011 Google Inc. All Rights Reserved.
+
+# pylint: disable-msg=C6409,C6203
+
+"""Preloads per-instance state before an instance takes user traffic.
+
+With inbound_services: warmup in app.yaml, App Engine requests /_ah/warmup
+on a new instance before routing users to it. WarmUp then does everything
+the first user requests would otherwise do while the user waits: compiling
+the templates, pinning the stock levels and their previews, importing the
+modules main.py defers, and preparing the JWT signer for the catalog items.
+Warmup only reads; a missing stock level is logged, and seeding it is left
+to /_tasks/load-stock-levels.
+
+How long importing main.py and each warmup step took is kept per instance
+and reported at /_stats, and by /_ah/warmup?report=1.
+"""
+
+__author__ = 'dhermes@google.com (Danny Hermes)'
+
+# standard library imports
+import logging
+import time
+
+# third-party imports
+import jwt
+
+# application-specific imports
+from constants import CATALOG
+from level_cache import STOCK_LEVELS
+from level_preview import StockPreviewVersion
+from purchase_tokens import BuildPurchasePayload
+from rendering import AssetUrls
+from rendering import LoadTemplates
+from sellerinfo import SELLER_SECRET
+
+
+# Imported by the handlers that need them rather than by main.py
+DEFERRED_MODULES = ('level_replay', 'level_solver', 'sales')
+
+_startup_ms = {}
+
+
+def RecordStartup(step, seconds):
+  """Keeps how long a startup step took on this instance."""
+  _startup_ms[step] = round(seconds * 1000, 3)
+
+
+def StartupTimings():
+  """Returns {step: milliseconds} for the startup steps run so far."""
+  return dict(_startup_ms)
+
+
+def _WarmTemplates():
+  LoadTemplates()
+  AssetUrls()
+
+
+def _WarmStockLevels():
+  # StockPreviewVersion loads the level through GetLevel
+  for name in STOCK_LEVELS:
+    if StockPreviewVersion(name) is None:
+      logging.warning('Stock level %s is missing; seed it with '
+                      '/_tasks/load-stock-levels', name)
+
+
+def _WarmModules():
+  for name in DEFERRED_MODULES:
+    __import__(name)
+
+
+def _WarmSigner():
+  # Builds the shared signer with its keyed HMAC state; the tokens themselves
+  # are per buyer and aren't cached
+  signer = jwt.get_signer(SELLER_SECRET)
+  now = int(time.time())
+  for item_name, price in CATALOG:
+    signer.encode(BuildPurchasePayload('', item_name, price, now))
+
+
+_STEPS = (('templates', _WarmTemplates),
+          ('stock_levels', _WarmStockLevels),
+          ('modules', _WarmModules),
+          ('jwt_signer', _WarmSigner))
+
+
+def WarmUp():
+  """Runs every warmup step; a failing step is logged and skipped.
+
+  Returns:
+    StartupTimings() afterwards.
+  """
+  for step, function in _STEPS:
+    start = time.time()
+    try:
+      function()
+    except Exception:
+      logging.exception('Warmup step %s failed', step)
+    RecordStartup(step, time.time() - start)
+  return StartupTimings()